@@ -0,0 +1,83 @@
+"""
+Benchmark of the generation of image CAPTCHAs (images/sec).
+
+Usage:
+    python benchmarks/captcha_benchmark.py --count 2000 [--font /path/to/font.ttf] [--workers 4]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image import CaptchaPool, ImageCaptcha, numpy  # noqa: E402
+
+
+def random_texts(count, length=4):
+    """Return a list of random CAPTCHA texts."""
+    alphabet = string.ascii_uppercase + string.digits
+    return [''.join(random.choice(alphabet) for _ in range(length)) for _ in range(count)]
+
+
+def images_per_second(captcha, texts):
+    """Generate a PNG CAPTCHA for each of the texts and return the rate."""
+    start = time.perf_counter()
+    for text in texts:
+        captcha.generate(text)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def batch_images_per_second(captcha, texts, workers):
+    """Generate the CAPTCHAs with a batch over worker processes and return the rate."""
+    start = time.perf_counter()
+    captcha.generate_batch(texts, workers=workers)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def pool_get_latency(captcha, count, workers):
+    """Take CAPTCHAs from a filled pool and return the mean latency of `get` (in microseconds)."""
+    with CaptchaPool(captcha, queue_depth=count, workers=workers) as pool:
+        while pool.qsize() < count:
+            time.sleep(0.05)
+        start = time.perf_counter()
+        for _ in range(count):
+            pool.get()
+        return (time.perf_counter() - start) * 1000000 / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000, help='number of CAPTCHAs to generate')
+    parser.add_argument('--font', action='append', default=None, help='font file (can be repeated)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    args = parser.parse_args()
+
+    texts = random_texts(args.count)
+    configurations = [
+        ('no glyph cache', dict(glyph_cache_bytes=0)),
+        ('glyph cache', dict()),
+    ]
+    if numpy is not None:
+        configurations += [
+            ('numpy', dict(backend='numpy')),
+            ('noise', dict(noise=True)),
+            ('numpy noise', dict(backend='numpy', noise=True)),
+        ]
+    for label, options in configurations:
+        captcha = ImageCaptcha(fonts=args.font, **options)
+        captcha.generate(texts[0])  # load the fonts
+        rate = images_per_second(captcha, texts)
+        print(f'{label:>16}: {rate:8.1f} images/sec')
+
+    captcha = ImageCaptcha(fonts=args.font)
+    rate = batch_images_per_second(captcha, texts, args.workers)
+    print(f'{"batch":>16}: {rate:8.1f} images/sec ({args.workers} workers)')
+    latency = pool_get_latency(captcha, min(args.count, 1000), args.workers)
+    print(f'{"pool get":>16}: {latency:8.1f} us/image')
+
+
+if __name__ == '__main__':
+    main()
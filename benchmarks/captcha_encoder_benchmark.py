@@ -0,0 +1,60 @@
+"""
+Benchmark of the encoder profiles of the image CAPTCHAs (encoding latency against payload size).
+
+Usage:
+    python benchmarks/captcha_encoder_benchmark.py --count 1000 [--font /path/to/font.ttf]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image import ENCODER_PROFILES, ImageCaptcha, encode_image  # noqa: E402
+
+
+def random_texts(count, length=4):
+    """Return a list of random CAPTCHA texts."""
+    alphabet = string.ascii_uppercase + string.digits
+    return [''.join(random.choice(alphabet) for _ in range(length)) for _ in range(count)]
+
+
+def percentile(values, percent):
+    """Return the percentile of the sorted values."""
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def measure(images, profile):
+    """Encode each of the images with the profile; return the sorted latencies (ms) and the mean size."""
+    latencies = []
+    total_size = 0
+    for im in images:
+        start = time.perf_counter()
+        _, size = encode_image(im, profile)
+        latencies.append((time.perf_counter() - start) * 1000)
+        total_size += size
+    return sorted(latencies), total_size / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=1000, help='number of CAPTCHAs to encode')
+    parser.add_argument('--font', action='append', default=None, help='font file (can be repeated)')
+    args = parser.parse_args()
+
+    captcha = ImageCaptcha(fonts=args.font)
+    images = [captcha.generate_image(text) for text in random_texts(args.count)]
+
+    print(f'{"profile":>12} {"mean ms":>9} {"p50 ms":>9} {"p99 ms":>9} {"bytes":>8}')
+    for profile in ENCODER_PROFILES:
+        latencies, size = measure(images, profile)
+        mean = sum(latencies) / len(latencies)
+        print(f'{profile:>12} {mean:9.3f} {percentile(latencies, 50):9.3f} '
+              f'{percentile(latencies, 99):9.3f} {size:8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark comparing the throughput of each copy strategy of the copy backend.
+
+Large MOV files are created in a temporary directory and copied with each copy strategy on its
+own (copy_file_range, sendfile, reflink, buffered), and with `shutil.copy2` for reference.
+
+Usage:
+    python benchmarks/copy_backend_benchmark.py --files 3 --size 256
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rosh.copy_backend import COPY_STRATEGIES, CopyBackend  # noqa: E402
+
+
+def create_movies(directory: str, number_of_files: int, size_in_megabytes: int):
+    """Creates the MOV files to copy; returns their paths"""
+    block = os.urandom(1024 * 1024)
+    filenames = []
+    for index in range(number_of_files):
+        filename = os.path.join(directory, f'IMG_{index:04d}.MOV')
+        with open(filename, 'wb') as file:
+            for _ in range(size_in_megabytes):
+                file.write(block)
+        filenames.append(filename)
+    return filenames
+
+
+def measure(copy_function, filenames, destination_directory: str) -> float:
+    """Copies each of the files with the copy function; returns the throughput in MB/s"""
+    os.makedirs(destination_directory)
+    total_bytes = sum(os.path.getsize(filename) for filename in filenames)
+    start = time.perf_counter()
+    for filename in filenames:
+        copy_function(filename, os.path.join(destination_directory, os.path.basename(filename)))
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(destination_directory)
+    return total_bytes / (1024 * 1024) / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=3, help='number of MOV files')
+    parser.add_argument('--size', type=int, default=256, help='size of each MOV file (MB)')
+    parser.add_argument('--tmpdir', default=None, help='directory (filesystem) in which to create the files')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as root:
+        filenames = create_movies(root, args.files, args.size)
+        print(f'{args.files} files of {args.size} MB in {root}')
+
+        for strategy in COPY_STRATEGIES:
+            copy_backend = CopyBackend([strategy])
+            try:
+                throughput = measure(copy_backend.copy, filenames, os.path.join(root, strategy))
+                print(f'{strategy:>16}: {throughput:10.1f} MB/s')
+            except OSError as exception:
+                shutil.rmtree(os.path.join(root, strategy), ignore_errors=True)
+                print(f'{strategy:>16}: not supported ({exception.strerror})')
+
+        throughput = measure(CopyBackend().copy, filenames, os.path.join(root, 'default'))
+        print(f'{"default backend":>16}: {throughput:10.1f} MB/s')
+        throughput = measure(shutil.copy2, filenames, os.path.join(root, 'copy2'))
+        print(f'{"shutil.copy2":>16}: {throughput:10.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
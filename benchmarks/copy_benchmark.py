@@ -0,0 +1,76 @@
+"""
+Benchmark comparing the serial and parallel copy of a directory of pictures and videos.
+
+A synthetic tree of JPEG and MOV files is created in a temporary directory and then copied
+with `Directory.copy_files` using one thread and using a pool of threads.
+
+Usage:
+    python benchmarks/copy_benchmark.py --files 2000 --workers 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rosh.directory import Directory  # noqa: E402
+
+
+def create_synthetic_tree(source_directory: str, number_of_files: int, file_size: int) -> int:
+    """Creates a tree of dated folders containing JPEG and MOV files; returns the total number of bytes"""
+    total_bytes = 0
+    payload = os.urandom(file_size)
+    for index in range(number_of_files):
+        folder = os.path.join(source_directory, f'2019_05_{(index % 28) + 1:02d}')
+        os.makedirs(folder, exist_ok=True)
+        extension = 'MOV' if index % 10 == 0 else 'JPG'
+        size = random.randint(file_size // 2, file_size)
+        with open(os.path.join(folder, f'IMG_{index:05d}.{extension}'), 'wb') as file:
+            file.write(payload[:size])
+        total_bytes += size
+    return total_bytes
+
+
+def run_copy(source_directory: str, destination_directory: str, max_workers: int,
+             max_copies_per_destination: int) -> float:
+    """Copies the source directory to a new destination directory; returns the elapsed time in seconds"""
+    pictures = os.path.join(destination_directory, 'Pictures')
+    videos = os.path.join(destination_directory, 'Videos')
+    with contextlib.redirect_stdout(io.StringIO()):
+        directory = Directory(source_directory, pictures, videos)
+        start = time.perf_counter()
+        directory.copy_files(max_workers=max_workers, max_copies_per_destination=max_copies_per_destination)
+        elapsed = time.perf_counter() - start
+    assert directory.files_not_copied == 0, 'All of the files should have been copied'
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000, help='number of files in the synthetic tree')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='maximum size of each file (bytes)')
+    parser.add_argument('--workers', type=int, default=8, help='number of threads for the parallel copy')
+    parser.add_argument('--per-destination', type=int, default=0,
+                        help='maximum concurrent copies per destination (0 = unlimited)')
+    parser.add_argument('--tmpdir', default=None, help='directory in which to create the synthetic tree')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as root:
+        source_directory = os.path.join(root, 'source')
+        total_bytes = create_synthetic_tree(source_directory, args.files, args.size)
+        megabytes = total_bytes / (1024 * 1024)
+
+        print(f'Synthetic tree: {args.files} files, {megabytes:.1f} MB')
+        for label, workers in (('serial', 1), ('parallel', args.workers)):
+            elapsed = run_copy(source_directory, os.path.join(root, label), workers, args.per_destination)
+            print(f'{label:>8} ({workers:2d} workers): {elapsed:7.3f} s, '
+                  f'{args.files / elapsed:8.1f} files/s, {megabytes / elapsed:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
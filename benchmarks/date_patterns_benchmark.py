@@ -0,0 +1,90 @@
+"""
+Benchmark of the date patterns used to date files from their folder and file names.
+
+First, the parse rate of the date patterns is measured over synthetic file names from phones,
+cameras and apps.  Second, the hit rate (the files dated without reading them) is reported for a
+tree of files, for the date patterns and for the previous rule (folder or file name starting with
+"20").
+
+Usage:
+    python benchmarks/date_patterns_benchmark.py --names 1000000 [--tree /path/to/pictures]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rosh.date_patterns import parse_date  # noqa: E402
+from rosh.file import File  # noqa: E402
+
+
+NAME_TEMPLATES = [
+    'IMG_{n:04d}.JPG',
+    'IMG_{y}{m:02d}{d:02d}_{n:06d}.jpg',
+    'PXL_{y}{m:02d}{d:02d}_{n:09d}.jpg',
+    'VID_{y}{m:02d}{d:02d}_{n:06d}.mp4',
+    'IMG-{y}{m:02d}{d:02d}-WA{n:04d}.jpg',
+    '{y}-{m:02d}-{d:02d}_12-54-13_IMG_{n:04d}.JPG',
+    'Screenshot_{y}-{m:02d}-{d:02d}-10-11-12.png',
+    'DSC{n:05d}.JPG',
+]
+
+
+def legacy_date_from_path(filename_with_path: str) -> str:
+    """Returns the date found with the previous rule (folder or file name starting with "20")"""
+    directories = [directory for directory in filename_with_path.split('/') if directory != '']
+    if len(directories) > 1 and directories[-2].startswith('20'):
+        return directories[-2][:10].replace('_', '-')
+    if directories[-1].startswith('20'):
+        return directories[-1][:10].replace('_', '-')
+    return ''
+
+
+def synthetic_names(number_of_names: int):
+    """Returns a list of synthetic file names"""
+    random.seed(0)
+    return [random.choice(NAME_TEMPLATES).format(y=random.randint(2010, 2023), m=random.randint(1, 12),
+                                                  d=random.randint(1, 28), n=random.randint(0, 9999))
+            for _ in range(number_of_names)]
+
+
+def sample_tree(number_of_files: int):
+    """Returns the paths of a sample tree of files in dated and undated folders"""
+    folders = ['/Pictures/iPhone8', '/Pictures/2019_05_06', '/Pictures/WhatsApp Images', '/Pictures/DCIM/100APPLE']
+    return [os.path.join(random.choice(folders), name) for name in synthetic_names(number_of_files)]
+
+
+def walk_tree(directory: str):
+    """Returns the paths of the pictures and videos in the directory and its sub-directories"""
+    return [os.path.join(root, file)
+            for root, _, files in os.walk(directory)
+            for file in files
+            if File.check_file_extension(file)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--names', type=int, default=1000000, help='number of synthetic names to parse')
+    parser.add_argument('--tree', default=None, help='directory for the hit rate report (default: synthetic)')
+    args = parser.parse_args()
+
+    names = synthetic_names(args.names)
+    start = time.perf_counter()
+    dated = sum(1 for name in names if parse_date(name))
+    elapsed = time.perf_counter() - start
+    print(f'Parsed {args.names} names in {elapsed:.2f} s: {args.names / elapsed:,.0f} names/s '
+          f'({dated / args.names:.1%} dated)')
+
+    paths = walk_tree(args.tree) if args.tree else sample_tree(10000)
+    legacy_hits = sum(1 for path in paths if legacy_date_from_path(path))
+    hits = sum(1 for path in paths if File.extract_date_from_path(path))
+    print(f'Hit rate over {len(paths)} files ({args.tree or "synthetic tree"}):')
+    print(f'    previous rule: {legacy_hits / max(1, len(paths)):6.1%}')
+    print(f'    date patterns: {hits / max(1, len(paths)):6.1%}')
+
+
+if __name__ == '__main__':
+    main()
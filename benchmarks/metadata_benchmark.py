@@ -0,0 +1,90 @@
+"""
+Benchmark comparing the per-file latency of extracting the creation date of pictures and videos.
+
+The creation date is extracted from synthetic JPEG (EXIF) and MOV (QuickTime) files with the
+native header reader (`rosh.metadata.read_creation_date`) and with the `hachoir-metadata`
+subprocess that was previously used for every undated file.
+
+Usage:
+    python benchmarks/metadata_benchmark.py --files 200
+"""
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rosh.metadata import read_creation_date, read_creation_date_with_hachoir  # noqa: E402
+
+
+def build_jpeg(payload_size: int) -> bytes:
+    """Returns the bytes of a JPEG file with an EXIF segment containing DateTime and DateTimeOriginal"""
+    value = b'2014:05:25 10:11:12\x00'
+    exif_ifd_offset = 8 + 2 + 2 * 12 + 4
+    ifd0_value_offset = exif_ifd_offset + 2 + 12 + 4
+    exif_value_offset = ifd0_value_offset + len(value)
+    tiff = b'MM' + struct.pack('>HI', 42, 8)
+    tiff += struct.pack('>H', 2)
+    tiff += struct.pack('>HHII', 0x0132, 2, len(value), ifd0_value_offset)
+    tiff += struct.pack('>HHII', 0x8769, 4, 1, exif_ifd_offset)
+    tiff += struct.pack('>I', 0)
+    tiff += struct.pack('>H', 1) + struct.pack('>HHII', 0x9003, 2, len(value), exif_value_offset)
+    tiff += struct.pack('>I', 0)
+    tiff += value + value
+    exif = b'Exif\x00\x00' + tiff
+    app1 = b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif
+    return b'\xff\xd8' + app1 + b'\xff\xda\x00\x02' + os.urandom(payload_size) + b'\xff\xd9'
+
+
+def build_mov(payload_size: int) -> bytes:
+    """Returns the bytes of a QuickTime file whose 'moov' atom follows the media data"""
+    def atom(atom_type, contents):
+        return struct.pack('>I4s', len(contents) + 8, atom_type) + contents
+
+    mvhd = atom(b'mvhd', struct.pack('>B3sII', 0, b'\x00\x00\x00', 3629800000, 3629800000) + b'\x00' * 88)
+    return atom(b'ftyp', b'qt  \x00\x00\x02\x00qt  ') + atom(b'mdat', os.urandom(payload_size)) + atom(b'moov', mvhd)
+
+
+def time_per_file(function, filenames) -> float:
+    """Returns the mean latency (milliseconds) of calling the function for each of the files"""
+    start = time.perf_counter()
+    for filename in filenames:
+        function(filename)
+    return (time.perf_counter() - start) * 1000 / len(filenames)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200, help='number of files of each type')
+    parser.add_argument('--size', type=int, default=2 * 1024 * 1024, help='size of the media data (bytes)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        samples = {'JPEG': [], 'MOV': []}
+        jpeg, mov = build_jpeg(args.size), build_mov(args.size)
+        for index in range(args.files):
+            for kind, extension, contents in (('JPEG', 'JPG', jpeg), ('MOV', 'MOV', mov)):
+                filename = os.path.join(root, f'IMG_{index:05d}.{extension}')
+                with open(filename, 'wb') as file:
+                    file.write(contents)
+                samples[kind].append(filename)
+
+        for kind, filenames in samples.items():
+            assert all(read_creation_date(filename) for filename in filenames)
+            native = time_per_file(read_creation_date, filenames)
+            print(f'{kind:>4} native header reader: {native:8.3f} ms/file')
+            if shutil.which('hachoir-metadata'):
+                subprocess_latency = time_per_file(read_creation_date_with_hachoir,
+                                                   filenames[:max(1, args.files // 10)])
+                print(f'{kind:>4} hachoir subprocess:   {subprocess_latency:8.3f} ms/file '
+                      f'({subprocess_latency / native:.0f}x slower)')
+            else:
+                print(f'{kind:>4} hachoir subprocess:   hachoir-metadata is not installed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the decoding of the telemetry messages (messages per second on a single core, by backend).
+
+Usage:
+    python benchmarks/telemetry_benchmark.py --count 200000 [--devices 1000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest.telemetry import DECODER_BACKENDS, MESSAGE_KEYS, TelemetryDecoder  # noqa: E402
+
+
+def random_messages(count, devices):
+    """Return a list of (topic, payload) telemetry messages, about 1 in 20 of them not valid."""
+    messages = []
+    for index in range(count):
+        datastream_name = random.choice(['temp', 'humidity', 'battery'])
+        topic = f'telemetry/{random.randrange(devices):032x}/{datastream_name}'
+        message = {'context': {'elevation': '%.1f' % random.uniform(10, 50),
+                               'latitude': '%.1f' % random.uniform(10, 50),
+                               'longitude': '%.1f' % random.uniform(10, 50)},
+                   'datastream_name': datastream_name, 'value': '%.1f' % random.uniform(10, 50)}
+        if index % 20 == 0:
+            message['extra'] = 1
+        messages.append((topic, json.dumps(message).encode()))
+    return messages
+
+
+def decode_original(topic, payload, received):
+    """Decode a message as `on_message` did: json.loads, sorted lists of keys and a dict document."""
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(message, dict) or sorted(MESSAGE_KEYS) != sorted(message.keys()):
+        return None
+    topic_levels = topic.split('/')
+    if len(topic_levels) < 2 or message['datastream_name'] == '' or message['value'] == '':
+        return None
+    return {'tstamp': received, 'device_id': topic_levels[1], 'value': message['value'],
+            'context': message['context'], 'datastream_name': message['datastream_name']}
+
+
+def measure(decode, messages):
+    """Decode all of the messages; return the number of messages per second and the number of valid ones."""
+    received = datetime.now()
+    start = time.perf_counter()
+    valid = sum(1 for topic, payload in messages if decode(topic, payload, received) is not None)
+    return len(messages) / (time.perf_counter() - start), valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=200000, help='number of messages to decode')
+    parser.add_argument('--devices', type=int, default=1000, help='number of devices publishing the messages')
+    args = parser.parse_args()
+
+    messages = random_messages(args.count, args.devices)
+    decoders = [('original', decode_original)]
+    for backend in DECODER_BACKENDS:
+        try:
+            decoders.append((backend, TelemetryDecoder(backend)))
+        except ImportError:
+            print(f'{backend:>10} not installed')
+
+    print(f'{"decoder":>10} {"messages/s":>12} {"valid":>8}')
+    for name, decode in decoders:
+        rate, valid = measure(decode, messages)
+        print(f'{name:>10} {rate:12.0f} {valid:8d}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark suite of the generation of image CAPTCHAs (images/sec and p99 latency), with pytest-benchmark.
+
+Each benchmark records its throughput (images_per_sec) and its p99 latency (p99_ms) in the extra
+info of the results, so that a saved run is the baseline that later runs are compared against.
+
+Usage:
+    CAPTCHA_FONT=/path/to/font.ttf python -m pytest benchmarks/test_captcha_benchmark.py --benchmark-autosave
+    CAPTCHA_FONT=/path/to/font.ttf python -m pytest benchmarks/test_captcha_benchmark.py --benchmark-compare
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image  # noqa: E402
+
+
+FONT = os.environ.get('CAPTCHA_FONT', image.DEFAULT_FONTS[0])
+
+# Seed of the CAPTCHAs, so that every run generates the same images
+SEED = 20181022
+
+pytestmark = pytest.mark.skipif(not os.path.isfile(FONT), reason=f'font not found: {FONT}')
+
+
+def record_throughput(benchmark):
+    """Add the images/sec and the p99 latency of the benchmark to its extra info."""
+    if benchmark.stats is None:
+        # --benchmark-disable: the function was run once, without timings
+        return
+    data = sorted(benchmark.stats.stats.data)
+    benchmark.extra_info['images_per_sec'] = round(len(data) / sum(data), 1)
+    benchmark.extra_info['p99_ms'] = round(data[min(len(data) - 1, int(len(data) * 0.99))] * 1000, 3)
+
+
+@pytest.mark.parametrize('backend', image.BACKENDS)
+@pytest.mark.parametrize('length', [4, 6, 8])
+def test_image_captcha_text_length(benchmark, backend, length):
+    if backend == 'numpy' and image.numpy is None:
+        pytest.skip('numpy is not installed')
+    captcha = image.ImageCaptcha(fonts=[FONT], seed=SEED, backend=backend)
+    text = 'ABCDEFGH'[:length]
+    benchmark(captcha.generate, text)
+    record_throughput(benchmark)
+
+
+@pytest.mark.parametrize('size', [(160, 60), (240, 90), (320, 120)])
+def test_image_captcha_size(benchmark, size):
+    width, height = size
+    font_sizes = tuple(int(font_size * height / 60) for font_size in image.DEFAULT_FONT_SIZES)
+    captcha = image.ImageCaptcha(width=width, height=height, fonts=[FONT], font_sizes=font_sizes, seed=SEED)
+    benchmark(captcha.generate, 'ABCD')
+    record_throughput(benchmark)
+
+
+@pytest.mark.parametrize('profile', sorted(image.ENCODER_PROFILES))
+def test_image_captcha_encoder_profile(benchmark, profile):
+    captcha = image.ImageCaptcha(fonts=[FONT], seed=SEED)
+    benchmark(captcha.generate_bytes, 'ABCD', profile)
+    record_throughput(benchmark)
+
+
+@pytest.mark.skipif(image.wheezy_captcha is None, reason='wheezy.captcha is not installed')
+@pytest.mark.parametrize('length', [4, 6, 8])
+def test_wheezy_captcha_text_length(benchmark, length):
+    captcha = image.WheezyCaptcha(fonts=[FONT])
+    captcha.seed(SEED)
+    benchmark(captcha.generate, 'ABCDEFGH'[:length])
+    record_throughput(benchmark)
@@ -6,8 +6,18 @@
     Generate Image CAPTCHAs, just the normal image CAPTCHAs you are using.
 """
 
+import logging
+import math
+import multiprocessing.util
 import os
 import random
+import string
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from PIL import Image
 from PIL import ImageFilter
 from PIL.ImageDraw import Draw
@@ -20,23 +30,364 @@ try:
     from wheezy.captcha import image as wheezy_captcha
 except ImportError:
     wheezy_captcha = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data')
 DEFAULT_FONTS = [os.path.join(DATA_DIR, 'DroidSansMono.ttf')]
 #DEFAULT_FONTS = [os.path.join(DATA_DIR, 'font1.ttf')]
+DEFAULT_FONT_SIZES = (42, 50, 56)
 
 if wheezy_captcha:
-    __all__ = ['ImageCaptcha', 'WheezyCaptcha']
+    __all__ = ['ImageCaptcha', 'WheezyCaptcha', 'CaptchaPool',
+               'CaptchaPoolError']
 else:
-    __all__ = ['ImageCaptcha']
+    __all__ = ['ImageCaptcha', 'CaptchaPool', 'CaptchaPoolError']
+
+logger = logging.getLogger(__name__)
 
 
 table  =  []
 for  i  in  range( 256 ):
     table.append( i * 1.97 )
 
+#: Colors of the cached glyphs are rounded to buckets of this many levels.
+COLOR_BUCKET_SIZE = 64
+#: Default memory budget (in bytes) of the glyph cache of ImageCaptcha.
+DEFAULT_GLYPH_CACHE_BYTES = 32 * 1024 * 1024
+#: Scales of the glyphs fitted into the width of a CAPTCHA are rounded
+#: down to multiples of 1 / SCALE_STEPS, so that the scaled glyphs are cached.
+SCALE_STEPS = 32
+#: Backends composing the images of ImageCaptcha.
+BACKENDS = ('pil', 'numpy')
+#: Encoder settings of the CAPTCHA images, by profile name. The ``colors``
+#: setting quantizes the image to a palette of that many colors first.
+ENCODER_PROFILES = {
+    # PNG with the default zlib settings of PIL
+    'png': {'format': 'png'},
+    # PNG with the fastest zlib level: larger, but much cheaper to encode
+    'png-fast': {'format': 'png', 'compress_level': 1},
+    # PNG of a small palette (a CAPTCHA has few colors) with the fastest
+    # zlib level: about a third of the size of a PNG of RGB pixels
+    'png-palette': {'format': 'png', 'compress_level': 1, 'colors': 16},
+    # lossy WebP with the fastest method
+    'webp': {'format': 'webp', 'quality': 60, 'method': 0},
+}
+
+if numpy is not None:
+    #: The mask ``table`` as a lookup array, scaled to alpha in [0, 1].
+    MASK_TABLE = numpy.minimum(numpy.arange(256) * 1.97, 255).astype(
+        numpy.uint8).astype(numpy.float32) / 255
+    #: Weights of the 3x3 ``ImageFilter.SMOOTH`` kernel.
+    SMOOTH_CENTER = numpy.float32(5.0 / 13)
+    SMOOTH_EDGE = numpy.float32(1.0 / 13)
+
+
+class GlyphCache(object):
+    """A bounded LRU cache of rendered glyphs and their masks.
+
+    Each glyph is keyed by (char, font file, font size, color bucket,
+    horizontal scale). The color is rounded to a bucket (see
+    :data:`COLOR_BUCKET_SIZE`), so the number of distinct glyphs stays small
+    while the text color still varies.
+
+    :param max_bytes: The memory budget of the cached bitmaps, in bytes.
+    """
+    def __init__(self, max_bytes=DEFAULT_GLYPH_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._glyphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._glyphs)
+
+    @staticmethod
+    def color_bucket(color):
+        """Round each channel of the color to the center of its bucket."""
+        half = COLOR_BUCKET_SIZE // 2
+        return tuple(min(255, v // COLOR_BUCKET_SIZE * COLOR_BUCKET_SIZE + half)
+                     for v in color)
+
+    def get(self, c, font, color, render=None, scale=1):
+        """Return the (glyph, mask) of the character, rendering it if needed.
+
+        :param c: the character.
+        :param font: the FreeType font to render the character with.
+        :param color: color of the text.
+        :param render: function rendering the glyph, :func:`render_glyph`
+                       by default.
+        :param scale: horizontal scale of the glyph.
+        """
+        render = render or render_glyph
+        if color is not None:
+            color = self.color_bucket(color)
+        key = (c, font.path, font.size, color, render.__name__, scale)
+        with self._lock:
+            entry = self._glyphs.get(key)
+            if entry is not None:
+                self._glyphs.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+
+        if scale != 1:
+            glyph, mask = scale_glyph(*self.get(c, font, color, render), scale=scale)
+        else:
+            glyph, mask = render(c, font, color)
+        if isinstance(glyph, Image.Image):
+            w, h = glyph.size
+            entry_bytes = w * h * 5  # RGBA glyph and L mask
+        else:
+            entry_bytes = glyph.nbytes + (mask.nbytes if mask is not None else 0)
+        if entry_bytes > self.max_bytes:
+            return glyph, mask
+
+        with self._lock:
+            if key not in self._glyphs:
+                self._glyphs[key] = (glyph, mask, entry_bytes)
+                self.size_bytes += entry_bytes
+                while self.size_bytes > self.max_bytes:
+                    _, (_, _, evicted_bytes) = self._glyphs.popitem(last=False)
+                    self.size_bytes -= evicted_bytes
+        return glyph, mask
+
+    def clear(self):
+        with self._lock:
+            self._glyphs.clear()
+            self.size_bytes = 0
+
+
+class FontRegistry(object):
+    """A registry of the TrueType fonts loaded by the process.
+
+    Each (font file, size) is loaded once and shared by every ImageCaptcha
+    of the process. FreeType maps the font file into memory, so the font
+    data is shared with the page cache; fonts loaded before the workers
+    are forked (such as with ``gunicorn --preload``) are also shared by the
+    workers, which then do not pay for loading them on their first CAPTCHA::
+
+        FONT_REGISTRY.prewarm(['/path/to/A.ttf'], (42, 50, 56))
+    """
+    def __init__(self):
+        self._fonts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fonts)
+
+    def get(self, path, size):
+        """Return the font of the file and size, loading it if needed.
+
+        :param path: the font file.
+        :param size: the font size.
+        """
+        key = (path, size)
+        font = self._fonts.get(key)
+        if font is None:
+            with self._lock:
+                font = self._fonts.get(key)
+                if font is None:
+                    font = self._fonts[key] = truetype(path, size)
+        return font
+
+    def prewarm(self, fonts=None, font_sizes=None):
+        """Load the fonts in each of the sizes, such as before forking.
+
+        :param fonts: font files, the default fonts of ImageCaptcha if None.
+        :param font_sizes: font sizes, the default sizes of ImageCaptcha
+                           if None.
+        :return: the fonts.
+        """
+        return tuple([
+            self.get(n, s)
+            for n in fonts or DEFAULT_FONTS
+            for s in font_sizes or DEFAULT_FONT_SIZES
+        ])
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+
+    def _after_fork(self):
+        # the lock may have been held by another thread when forking
+        self._lock = threading.Lock()
+
+
+#: The fonts shared by all the ImageCaptcha instances of the process.
+FONT_REGISTRY = FontRegistry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=FONT_REGISTRY._after_fork)
+else:
+    # before Python 3.7, only the processes forked by multiprocessing (such
+    # as the workers of CaptchaPool) release the lock
+    multiprocessing.util.register_after_fork(FONT_REGISTRY,
+                                             FontRegistry._after_fork)
+
+
+def render_glyph(c, font, color):
+    """Render a character into a new RGBA image and create its paste mask.
+
+    :param c: the character.
+    :param font: the FreeType font to render the character with.
+    :param color: color of the text.
+    """
+    w, h = Draw(Image.new('RGBA', (1, 1))).textsize(c, font=font)
+    glyph = Image.new('RGBA', (w, h))
+    Draw(glyph).text((0, 0), c, font=font, fill=color)
+    mask = glyph.convert('L').point(table)
+    return glyph, mask
+
+
+def render_glyph_coverage(c, font, color=None):
+    """Render the coverage of a character into an array, for numpy.
+
+    The RGB of a glyph rendered by :func:`render_glyph` is the color of the
+    text wherever the character is drawn, and black elsewhere; so its mask
+    is a single alpha (given by the color) over the pixels covered by the
+    character. The coverage does not depend on the color, which is applied
+    while compositing. The array is indexed by (x, y), as the canvas of
+    :meth:`ImageCaptcha.create_captcha_array` is.
+
+    :param c: the character.
+    :param font: the FreeType font to render the character with.
+    :param color: unused, the coverage is the same for every color.
+    :return: (coverage, None), the coverage being 0 or 1 for each pixel.
+    """
+    w, h = Draw(Image.new('L', (1, 1))).textsize(c, font=font)
+    image = Image.new('L', (w, h))
+    Draw(image).text((0, 0), c, font=font, fill=255)
+    covered = numpy.asarray(image).T > 0
+    # the coverage has the 3 channels: broadcasting it while compositing
+    # is several times slower than a contiguous array
+    coverage = numpy.repeat(covered[:, :, None], 3, axis=2).astype(numpy.float32)
+    return coverage, None
+
+
+def mask_alpha(color):
+    """Return the alpha of the mask of the glyphs drawn in the color."""
+    r, g, b = color[:3]
+    # the luminance of Image.convert('L')
+    return MASK_TABLE[(r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16]
+
+
+def scale_glyph(glyph, mask, scale):
+    """Scale a glyph (image or array) and its mask horizontally.
+
+    :param glyph: the glyph, as rendered by :func:`render_glyph` or
+                  :func:`render_glyph_coverage`.
+    :param mask: the mask of the glyph, or None.
+    :param scale: horizontal scale of the glyph.
+    """
+    if isinstance(glyph, Image.Image):
+        w, h = glyph.size
+        size = (max(1, int(w * scale)), h)
+        return glyph.resize(size, Image.BILINEAR), mask.resize(size, Image.BILINEAR)
+
+    w = glyph.shape[0]
+    weights = bilinear_weights(w, max(1, int(w * scale)))
+
+    def resample(array):
+        return numpy.tensordot(weights, array, axes=1)
+
+    return resample(glyph), None if mask is None else resample(mask)
+
+
+def bilinear_weights(in_size, out_size):
+    """Return the (out_size, in_size) weights of the columns resampled by
+    ``Image.resize(..., Image.BILINEAR)``: when shrinking, PIL widens the
+    triangle filter by the ratio of the sizes, so that every column of the
+    input contributes to the output.
+    """
+    ratio = in_size / float(out_size)
+    support = max(ratio, 1.0)
+    centers = (numpy.arange(out_size) + 0.5) * ratio
+    columns = numpy.arange(in_size) + 0.5
+    weights = numpy.maximum(
+        1 - numpy.abs(columns[None, :] - centers[:, None]) / support, 0)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return weights.astype(numpy.float32)
+
+
+_dot_offsets = {}
+
+
+def dot_offsets(width):
+    """Return the (dx, dy) arrays of the pixels of a noise dot of the width.
+
+    A dot is the line from (x, y) to (x - 1, y - 1) drawn by PIL, so the
+    pixels are taken from a line drawn by PIL once.
+    """
+    offsets = _dot_offsets.get(width)
+    if offsets is None:
+        center = 2 * width
+        mask = Image.new('L', (4 * width, 4 * width))
+        Draw(mask).line(((center, center), (center - 1, center - 1)),
+                        fill=255, width=width)
+        ys, xs = numpy.nonzero(numpy.asarray(mask))
+        offsets = _dot_offsets[width] = (xs - center, ys - center)
+    return offsets
+
+
+def glyph_size(glyph):
+    """Return the (width, height) of a glyph image or array."""
+    if isinstance(glyph, Image.Image):
+        return glyph.size
+    return glyph.shape[0], glyph.shape[1]
+
+
+_buffers = threading.local()
+
+
+def encode_image(im, profile='png'):
+    """Encode the image with the settings of an encoder profile.
+
+    The image is saved into an output buffer owned by the calling thread,
+    which is reused from one image to the next.
+
+    :param im: the image to be encoded.
+    :param profile: name of the profile, see :data:`ENCODER_PROFILES`.
+    :return: (data, size) of the encoded image.
+    """
+    try:
+        options = dict(ENCODER_PROFILES[profile])
+    except KeyError:
+        raise ValueError('Unknown encoder profile: %s' % profile)
+    colors = options.pop('colors', None)
+    if colors:
+        im = im.quantize(colors, method=Image.FASTOCTREE)
+
+    out = getattr(_buffers, 'out', None)
+    if out is None:
+        out = _buffers.out = BytesIO()
+    # the buffer keeps its allocation, only the encoded size is copied out
+    out.seek(0)
+    im.save(out, **options)
+    size = out.tell()
+    view = out.getbuffer()
+    try:
+        data = bytes(view[:size])
+    finally:
+        view.release()
+    return data, size
+
 
 class _Captcha(object):
+    #: Random number generator of the CAPTCHAs: each instance sets its own
+    #: ``random.Random``, so seeding it leaves the random module alone.
+    _random = None
+
+    def seed(self, seed=None):
+        """Seed the random number generator of the CAPTCHAs.
+
+        :param seed: the seed, None to seed from the system entropy.
+        """
+        self._random.seed(seed)
+
     def generate(self, chars, format='png'):
         """Generate an Image Captcha of the given characters.
 
@@ -59,10 +410,106 @@ class _Captcha(object):
         im = self.generate_image(chars)
         return im.save(output, format=format)
 
+    def generate_bytes(self, chars, profile='png'):
+        """Generate an Image Captcha of the given characters as bytes.
+
+        :param chars: text to be generated.
+        :param profile: name of the encoder profile, see
+                        :data:`ENCODER_PROFILES`.
+        :return: (data, size) of the encoded image.
+        """
+        return encode_image(self.generate_image(chars), profile)
+
+    def generate_batch(self, texts, format='png', workers=None, chunk_size=16):
+        """Generate an Image Captcha for each of the given texts.
+
+        :param texts: list of texts to be generated.
+        :param format: image file format
+        :param workers: number of processes to generate the images with,
+                        None to generate them in the current process.
+        :param chunk_size: number of images generated by a process at a time.
+        :return: list of the image data (one BytesIO per text).
+
+        Each chunk is generated with its own seed, drawn from the random
+        number generator of the CAPTCHA, so a seeded CAPTCHA generates the
+        same batch whatever the number of workers.
+        """
+        chunks = [texts[i:i + chunk_size]
+                  for i in range(0, len(texts), chunk_size)]
+        seeds = [self._random.getrandbits(64) for _ in chunks]
+        if not workers:
+            return [BytesIO(data)
+                    for chunk, seed in zip(chunks, seeds)
+                    for _, data in _generate_chunk(self, chunk, format, seed)]
+
+        with _start_worker_processes(self, workers) as executor:
+            futures = [_submit_chunk(executor, self, chunk, format, seed)
+                       for chunk, seed in zip(chunks, seeds)]
+            return [BytesIO(data)
+                    for future in futures
+                    for _, data in future.result()]
+
+
+def _generate_chunk(captcha, texts, format, seed=None):
+    """Generate the CAPTCHAs of the texts in a worker process.
+
+    :param seed: seed of the random number generator for this chunk.
+    :return: list of (text, image data) tuples.
+    """
+    if seed is not None:
+        captcha.seed(seed)
+    return [(chars, captcha.generate(chars, format=format).getvalue())
+            for chars in texts]
+
+
+#: CAPTCHA of the worker process, unpickled once by :func:`_init_worker` so
+#: that its fonts and glyph cache are kept from one chunk to the next.
+_worker_captcha = None
+
+#: Executors take an initializer from Python 3.7; before, the CAPTCHA is
+#: sent along with each chunk and a worker keeps the first one it receives.
+_WORKER_INITIALIZER = sys.version_info >= (3, 7)
+
+
+def _init_worker(captcha):
+    """Keep the CAPTCHA of a worker process (executor initializer)."""
+    global _worker_captcha
+    _worker_captcha = captcha
+
+
+def _generate_worker_chunk(texts, format, seed=None, captcha=None):
+    """Generate the CAPTCHAs of the texts with the CAPTCHA of the worker."""
+    if _worker_captcha is None:
+        _init_worker(captcha)
+    return _generate_chunk(_worker_captcha, texts, format, seed)
+
+
+def _start_worker_processes(captcha, workers):
+    """Start the worker processes generating the CAPTCHAs of `captcha`."""
+    if _WORKER_INITIALIZER:
+        return ProcessPoolExecutor(max_workers=workers,
+                                   initializer=_init_worker,
+                                   initargs=(captcha,))
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _submit_chunk(executor, captcha, texts, format, seed):
+    """Submit a chunk of texts to the worker processes; return its future."""
+    if _WORKER_INITIALIZER:
+        return executor.submit(_generate_worker_chunk, texts, format, seed)
+    return executor.submit(_generate_worker_chunk, texts, format, seed,
+                           captcha)
+
 
 class WheezyCaptcha(_Captcha):
-    """Create an image CAPTCHA with wheezy.captcha."""
-    def __init__(self, width=200, height=75, fonts=None):
+    """Create an image CAPTCHA with wheezy.captcha.
+
+    wheezy.captcha draws its own random numbers from the random module, so
+    the seed of this instance only sets the seeds of the chunks of
+    :meth:`generate_batch`, not the images.
+    """
+    def __init__(self, width=200, height=75, fonts=None, seed=None):
+        self._random = random.Random(seed)
         self._width = width
         self._height = height
         self._fonts = fonts or DEFAULT_FONTS
@@ -98,57 +545,196 @@ class ImageCaptcha(_Captcha):
 
         captcha = ImageCaptcha(fonts=['/path/to/A.ttf', '/path/to/B.ttf'])
 
-    You can put as many fonts as you like. But be aware of your memory, all of
-    the fonts are loaded into your memory, so keep them a lot, but not too
-    many.
+    You can put as many fonts as you like. Each font is loaded once per
+    process in :data:`FONT_REGISTRY`, and shared by all the instances; with
+    several worker processes, prewarm the registry before forking them so
+    that the workers share the loaded fonts too.
 
     :param width: The width of the CAPTCHA image.
     :param height: The height of the CAPTCHA image.
     :param fonts: Fonts to be used to generate CAPTCHA images.
     :param font_sizes: Random choose a font size from this parameters.
+    :param glyph_cache_bytes: Memory budget of the cache of rendered glyphs,
+                              0 to render every glyph from scratch.
+    :param backend: 'pil' to compose the images with PIL operations, or
+                    'numpy' to compose them with array operations in one
+                    buffer (requires numpy).
+    :param noise: Draw noise dots and a noise curve over the text.
+    :param seed: Seed of the random number generator of this instance, so
+                 that the same texts generate byte-identical images.
     """
-    def __init__(self, width=160, height=60, fonts=None, font_sizes=None):
+    def __init__(self, width=160, height=60, fonts=None, font_sizes=None,
+                 glyph_cache_bytes=DEFAULT_GLYPH_CACHE_BYTES, backend='pil',
+                 noise=False, seed=None):
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend: %s' % backend)
+        if backend == 'numpy' and numpy is None:
+            raise ImportError('The numpy backend requires numpy')
+        self._backend = backend
+        self._noise = noise
+        self._random = random.Random(seed)
         self._width = width
         self._height = height
         self._fonts = fonts or DEFAULT_FONTS
-        self._font_sizes = font_sizes or (42, 50, 56)
+        self._font_sizes = font_sizes or DEFAULT_FONT_SIZES
         self._truefonts = []
+        self._glyph_cache_bytes = glyph_cache_bytes
+        if glyph_cache_bytes:
+            self._glyph_cache = GlyphCache(glyph_cache_bytes)
+        else:
+            self._glyph_cache = None
+
+    def __getstate__(self):
+        # fonts and cached glyphs are not picklable, a worker process
+        # loads its own fonts and renders its own glyphs
+        state = self.__dict__.copy()
+        state['_truefonts'] = []
+        state['_glyph_cache'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._glyph_cache_bytes:
+            self._glyph_cache = GlyphCache(self._glyph_cache_bytes)
 
     @property
     def truefonts(self):
         if self._truefonts:
             return self._truefonts
-        self._truefonts = tuple([
-            truetype(n, s)
-            for n in self._fonts
-            for s in self._font_sizes
-        ])
+        self._truefonts = FONT_REGISTRY.prewarm(self._fonts, self._font_sizes)
         return self._truefonts
 
     @staticmethod
-    def create_noise_curve(image, color):
+    def create_noise_curve(image, color, rng=random):
         w, h = image.size
-        x1 = random.randint(0, int(w / 5))
-        x2 = random.randint(w - int(w / 5), w)
-        y1 = random.randint(int(h / 5), h - int(h / 5))
-        y2 = random.randint(y1, h - int(h / 5))
+        x1 = rng.randint(0, int(w / 5))
+        x2 = rng.randint(w - int(w / 5), w)
+        y1 = rng.randint(int(h / 5), h - int(h / 5))
+        y2 = rng.randint(y1, h - int(h / 5))
         points = [x1, y1, x2, y2]
-        end = random.randint(160, 200)
-        start = random.randint(0, 20)
+        end = rng.randint(160, 200)
+        start = rng.randint(0, 20)
         Draw(image).arc(points, start, end, fill=color)
         return image
 
     @staticmethod
-    def create_noise_dots(image, color, width=3, number=30):
+    def create_noise_dots(image, color, width=3, number=30, rng=random):
         draw = Draw(image)
         w, h = image.size
         while number:
-            x1 = random.randint(0, w)
-            y1 = random.randint(0, h)
+            x1 = rng.randint(0, w)
+            y1 = rng.randint(0, h)
             draw.line(((x1, y1), (x1 - 1, y1 - 1)), fill=color, width=width)
             number -= 1
         return image
 
+    @staticmethod
+    def create_noise_dots_array(canvas, color, width=3, number=30, rng=random):
+        """Draw the noise dots of :meth:`create_noise_dots` into an array."""
+        w, h = canvas.shape[:2]
+        x, y = numpy.array([(rng.randint(0, w), rng.randint(0, h))
+                            for _ in range(number)]).T
+        # each dot is the short line of the given width drawn by PIL
+        dx, dy = dot_offsets(width)
+        xs = (x[:, None] + dx[None, :]).ravel()
+        ys = (y[:, None] + dy[None, :]).ravel()
+        inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+        canvas[xs[inside], ys[inside]] = color[:3]
+        return canvas
+
+    @staticmethod
+    def create_noise_curve_array(canvas, color, rng=random):
+        """Draw the noise curve of :meth:`create_noise_curve` into an array."""
+        w, h = canvas.shape[:2]
+        x1 = rng.randint(0, int(w / 5))
+        x2 = rng.randint(w - int(w / 5), w)
+        y1 = rng.randint(int(h / 5), h - int(h / 5))
+        y2 = rng.randint(y1, h - int(h / 5))
+        end = rng.randint(160, 200)
+        start = rng.randint(0, 20)
+        # the arc is drawn by PIL into a mask, so it has the same pixels
+        mask = Image.new('L', (w, h))
+        Draw(mask).arc([x1, y1, x2, y2], start, end, fill=255)
+        canvas[numpy.asarray(mask).T > 0] = color[:3]
+        return canvas
+
+    @staticmethod
+    def smooth_array(canvas):
+        """Apply ``ImageFilter.SMOOTH`` to an array (the border is kept)."""
+        # the 3x3 box is separable: sum the rows, then the columns
+        rows = canvas[:-2] + canvas[1:-1]
+        rows += canvas[2:]
+        box = rows[:, :-2] + rows[:, 1:-1]
+        box += rows[:, 2:]
+        box *= SMOOTH_EDGE
+        result = canvas.copy()
+        inner = result[1:-1, 1:-1]
+        inner *= SMOOTH_CENTER - SMOOTH_EDGE
+        inner += box
+        return result
+
+    def _draw_character(self, c, color, render):
+        font = self._random.choice(self.truefonts)
+        if self._glyph_cache is not None:
+            glyph, mask = self._glyph_cache.get(c, font, color, render)
+        else:
+            glyph, mask = render(c, font, color)
+
+        dx = self._random.randint(0, 4)
+        dy = self._random.randint(0, 6)
+
+        # rotate
+        #im = im.crop(im.getbbox())
+        #im = im.rotate(random.uniform(-30, 30), Image.BILINEAR, expand=1)
+
+        # the glyph is placed at (dx, dy) within a cell of (w + dx, h + dy)
+        return c, font, glyph, mask, dx, dy
+
+    def layout_glyphs(self, chars, color, render=render_glyph):
+        """Render the glyphs of the text and compute where they are placed.
+
+        The glyphs are laid out in a single canvas of the size of the
+        CAPTCHA: if the text is wider than the CAPTCHA, the glyphs and their
+        positions are scaled horizontally to fit, instead of resampling the
+        whole image.
+
+        :param chars: text to be generated.
+        :param color: color of the text.
+        :param render: function rendering each glyph.
+        :return: list of the (glyph, mask, x, y) placements of the glyphs.
+                 The random spaces between characters move the following
+                 glyphs, but are not placed themselves.
+        """
+        cells = []
+        for c in chars:
+            if self._random.random() > 0.5:
+                cells.append(self._draw_character(" ", color, render))
+            cells.append(self._draw_character(c, color, render))
+
+        text_width = sum([glyph_size(glyph)[0] + dx for _, _, glyph, _, dx, _ in cells])
+        scale = 1
+        if text_width > self._width:
+            steps = math.floor(SCALE_STEPS * self._width / float(text_width))
+            scale = max(steps, 1) / float(SCALE_STEPS)
+
+        average = int(text_width / len(chars))
+        rand = int(0.25 * average)
+        offset = int(average * 0.1)
+
+        placements = []
+        for c, font, glyph, mask, dx, dy in cells:
+            w, h = glyph_size(glyph)
+            top = int((self._height - h - dy) / 2)
+            if c != " ":
+                if scale != 1:
+                    if self._glyph_cache is not None:
+                        glyph, mask = self._glyph_cache.get(c, font, color, render, scale)
+                    else:
+                        glyph, mask = scale_glyph(glyph, mask, scale)
+                placements.append((glyph, mask, int((offset + dx) * scale), top + dy))
+            offset = offset + w + dx + self._random.randint(-rand, 0)
+        return placements
+
     def create_captcha_image(self, chars, color, background):
         """Create the CAPTCHA image itself.
 
@@ -159,84 +745,291 @@ class ImageCaptcha(_Captcha):
         The color should be a tuple of 3 numbers, such as (0, 255, 255).
         """
         image = Image.new('RGB', (self._width, self._height), background)
-        draw = Draw(image)
-
-        def _draw_character(c):
-            font = random.choice(self.truefonts)
-            w, h = draw.textsize(c, font=font)
-
-            dx = random.randint(0, 4)
-            dy = random.randint(0, 6)
-            im = Image.new('RGBA', (w + dx, h + dy))
-            Draw(im).text((dx, dy), c, font=font, fill=color)
-
-            # rotate
-            #im = im.crop(im.getbbox())
-            #im = im.rotate(random.uniform(-30, 30), Image.BILINEAR, expand=1)
-
-            # warp
-            dx = w * random.uniform(0.1, 0.3)
-            dy = h * random.uniform(0.2, 0.3)
-            x1 = int(random.uniform(-dx, dx))
-            y1 = int(random.uniform(-dy, dy))
-            x2 = int(random.uniform(-dx, dx))
-            y2 = int(random.uniform(-dy, dy))
-            w2 = w + abs(x1) + abs(x2)
-            h2 = h + abs(y1) + abs(y2)
-            data = (
-                x1, y1,
-                -x1, h2 - y2,
-                w2 + x2, h2 + y2,
-                w2 - x2, -y1,
-            )
-            #im = im.resize((w2, h2))
-            #im = im.transform((w, h), Image.QUAD, data)
-            return im
-
-        images = []
-        for c in chars:
-            if random.random() > 0.5:
-                images.append(_draw_character(" "))
-            images.append(_draw_character(c))
+        for glyph, mask, x, y in self.layout_glyphs(chars, color):
+            image.paste(glyph, (x, y), mask)
+        return image
 
-        text_width = sum([im.size[0] for im in images])
+    def create_captcha_array(self, chars, color, background):
+        """Create the CAPTCHA image as a float32 array of (width, height, 3).
 
-        width = max(text_width, self._width)
-        image = image.resize((width, self._height))
+        The glyphs are composited with their masks into a single buffer of
+        the size of the CAPTCHA.
 
-        average = int(text_width / len(chars))
-        rand = int(0.25 * average)
-        offset = int(average * 0.1)
+        :param chars: text to be generated.
+        :param color: color of the text.
+        :param background: color of the background.
+        """
+        if self._glyph_cache is not None:
+            # the glyphs of the pil backend are cached in the color of the
+            # bucket (see GlyphCache), paint the same color
+            color = GlyphCache.color_bucket(color)
+        canvas = numpy.empty((self._width, self._height, 3), dtype=numpy.float32)
+        canvas[:] = background
+        paint = numpy.array(color[:3], dtype=numpy.float32)
+        alpha = mask_alpha(color)
 
-        for im in images:
-            w, h = im.size
-            mask = im.convert('L').point(table)
-            image.paste(im, (offset, int((self._height - h) / 2)), mask)
-            offset = offset + w + random.randint(-rand, 0)
+        for coverage, _, x, y in self.layout_glyphs(chars, None, render_glyph_coverage):
+            w, h = coverage.shape[:2]
+            # clip the glyph to the canvas, as Image.paste does
+            left, top = max(x, 0), max(y, 0)
+            right, bottom = min(x + w, self._width), min(y + h, self._height)
+            if left >= right or top >= bottom:
+                continue
+            region = canvas[left:right, top:bottom]
+            delta = paint - region
+            delta *= coverage[left - x:right - x, top - y:bottom - y]
+            delta *= alpha
+            region += delta
+        return canvas
 
-        if width > self._width:
-            image = image.resize((self._width, self._height))
+    def generate_image_array(self, chars):
+        """Generate the image of the given characters with the numpy backend.
 
-        return image
+        :param chars: text to be generated.
+        """
+        background = random_color(238, 255, rng=self._random)
+        color = random_color(10, 200, self._random.randint(220, 255), self._random)
+        canvas = self.create_captcha_array(chars, color, background)
+        if self._noise:
+            self.create_noise_dots_array(canvas, color, rng=self._random)
+            self.create_noise_curve_array(canvas, color, rng=self._random)
+        canvas = self.smooth_array(canvas)
+        canvas += 0.5
+        pixels = canvas.clip(0, 255).astype(numpy.uint8).transpose(1, 0, 2)
+        return Image.fromarray(numpy.ascontiguousarray(pixels), 'RGB')
 
     def generate_image(self, chars):
         """Generate the image of the given characters.
 
         :param chars: text to be generated.
         """
-        background = random_color(238, 255)
-        color = random_color(10, 200, random.randint(220, 255))
+        if self._backend == 'numpy':
+            return self.generate_image_array(chars)
+        background = random_color(238, 255, rng=self._random)
+        color = random_color(10, 200, self._random.randint(220, 255), self._random)
         im = self.create_captcha_image(chars, color, background)
-        #self.create_noise_dots(im, color)
-        #self.create_noise_curve(im, color)
+        if self._noise:
+            self.create_noise_dots(im, color, rng=self._random)
+            self.create_noise_curve(im, color, rng=self._random)
         im = im.filter(ImageFilter.SMOOTH)
         return im
 
 
-def random_color(start, end, opacity=None):
-    red = random.randint(start, end)
-    green = random.randint(start, end)
-    blue = random.randint(start, end)
+def random_color(start, end, opacity=None, rng=random):
+    red = rng.randint(start, end)
+    green = rng.randint(start, end)
+    blue = rng.randint(start, end)
     if opacity is None:
         return (red, green, blue)
     return (red, green, blue, opacity)
+
+
+#: Characters used by :class:`CaptchaPool` to create random texts.
+DEFAULT_ALPHABET = string.ascii_uppercase + string.digits
+#: Seconds :class:`CaptchaPool` waits before generating a batch again after
+#: a failed one, doubled with each consecutive failure.
+DEFAULT_RETRY_DELAY = 0.1
+#: Longest wait of :class:`CaptchaPool` between failed batches, in seconds.
+MAX_RETRY_DELAY = 30.0
+#: Number of consecutive failed batches after which :meth:`CaptchaPool.get`
+#: raises :class:`CaptchaPoolError` when no CAPTCHA is ready.
+DEFAULT_MAX_FAILURES = 5
+
+
+class CaptchaPoolError(Exception):
+    """The worker processes of a :class:`CaptchaPool` keep failing."""
+
+
+class CaptchaPool(object):
+    """Keep a queue of CAPTCHAs ready, generated in background processes.
+
+    A request handler takes a CAPTCHA with :meth:`get`, which only dequeues
+    a ready (text, image data) pair. When the number of ready (and pending)
+    CAPTCHAs drops below the low watermark, the pool refills the queue up to
+    its depth with batches generated by the worker processes::
+
+        pool = CaptchaPool(ImageCaptcha(fonts=['/path/to/A.ttf']), workers=4)
+        pool.start()
+        text, data = pool.get()
+
+    :param captcha: the ImageCaptcha or WheezyCaptcha generating the images.
+    :param queue_depth: number of ready CAPTCHAs to keep.
+    :param low_watermark: refill when fewer CAPTCHAs are ready (or pending),
+                          defaults to half of the queue depth.
+    :param workers: number of worker processes.
+    :param batch_size: number of CAPTCHAs generated by a process at a time.
+    :param format: image file format
+    :param text_length: length of the random texts.
+    :param alphabet: characters of the random texts.
+    :param retry_delay: seconds to wait before generating batches again after
+                        a failed batch, doubled with each consecutive failure
+                        (up to :data:`MAX_RETRY_DELAY`).
+    :param max_failures: number of consecutive failed batches after which
+                         :meth:`get` raises :class:`CaptchaPoolError` instead
+                         of generating a CAPTCHA when none is ready.
+
+    Each worker process unpickles the CAPTCHA once, when it starts, so its
+    fonts and glyph cache are kept from one batch to the next.
+    """
+    def __init__(self, captcha, queue_depth=1000, low_watermark=None,
+                 workers=None, batch_size=32, format='png', text_length=4,
+                 alphabet=DEFAULT_ALPHABET, retry_delay=DEFAULT_RETRY_DELAY,
+                 max_failures=DEFAULT_MAX_FAILURES):
+        self.captcha = captcha
+        self.queue_depth = queue_depth
+        if low_watermark is None:
+            low_watermark = queue_depth // 2
+        self.low_watermark = low_watermark
+        self.workers = workers
+        self.batch_size = batch_size
+        self.format = format
+        self.text_length = text_length
+        self.alphabet = alphabet
+        self.retry_delay = retry_delay
+        self.max_failures = max_failures
+        self.errors = 0
+        self.failures = 0
+        self._error = None
+        self._retry_at = 0
+        self._random = random.SystemRandom()
+        self._ready = deque()
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._stopped = True
+        self._executor = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def qsize(self):
+        """Return the number of ready CAPTCHAs."""
+        return len(self._ready)
+
+    def random_text(self):
+        """Return a random text for a CAPTCHA."""
+        return ''.join(self._random.choice(self.alphabet)
+                       for _ in range(self.text_length))
+
+    def start(self):
+        """Start the worker processes and fill the queue."""
+        self._stopped = False
+        self._executor = self._start_workers()
+        self._thread = threading.Thread(target=self._refill, name='captcha-pool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _start_workers(self):
+        return _start_worker_processes(self.captcha, self.workers)
+
+    def stop(self):
+        """Stop refilling the queue and shut the worker processes down."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get(self, timeout=0):
+        """Take a ready CAPTCHA from the queue.
+
+        If no CAPTCHA is ready within `timeout` seconds, one is generated in
+        the calling thread instead, so the caller is never left without one,
+        unless the last `max_failures` batches of the workers failed.
+
+        :param timeout: seconds to wait for a ready CAPTCHA.
+        :return: (text, image data) tuple.
+        :raises CaptchaPoolError: no CAPTCHA is ready and the workers keep
+                                  failing.
+        """
+        with self._condition:
+            if not self._ready and timeout:
+                self._condition.wait_for(lambda: self._ready, timeout)
+            item = self._ready.popleft() if self._ready else None
+            self._condition.notify_all()
+            if item is None and self.failures >= self.max_failures:
+                raise CaptchaPoolError(
+                    '%d consecutive batches failed: %r'
+                    % (self.failures, self._error)) from self._error
+
+        if item is None:
+            chars = self.random_text()
+            item = (chars, self.captcha.generate(chars, format=self.format).getvalue())
+        return item
+
+    def _needs_refill(self):
+        return (self._stopped or
+                len(self._ready) + self._pending < self.low_watermark)
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._needs_refill)
+                if self._stopped:
+                    return
+                delay = self._retry_at - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                missing = self.queue_depth - len(self._ready) - self._pending
+                batches = []
+                while missing > 0:
+                    size = min(missing, self.batch_size)
+                    batches.append([self.random_text() for _ in range(size)])
+                    self._pending += size
+                    missing -= size
+
+            for texts in batches:
+                try:
+                    future = _submit_chunk(self._executor, self.captcha,
+                                           texts, self.format,
+                                           self._random.getrandbits(64))
+                except BrokenProcessPool as exc:
+                    # a worker process died: start new ones for the next try
+                    self._executor.shutdown(wait=False)
+                    self._executor = self._start_workers()
+                    self._on_failure(exc, len(texts))
+                    continue
+                future.add_done_callback(
+                    lambda future, size=len(texts): self._on_batch(future, size))
+
+    def _on_batch(self, future, size):
+        if future.cancelled():
+            with self._condition:
+                self._pending -= size
+                self._condition.notify_all()
+            return
+        exc = future.exception()
+        if exc is not None:
+            self._on_failure(exc, size)
+            return
+        with self._condition:
+            self._pending -= size
+            self._ready.extend(future.result())
+            self.failures = 0
+            self._error = None
+            self._condition.notify_all()
+
+    def _on_failure(self, exc, size):
+        """Count a failed batch, and wait longer before the next one."""
+        with self._condition:
+            self._pending -= size
+            self.errors += 1
+            self.failures += 1
+            self._error = exc
+            failures = self.failures
+            delay = min(self.retry_delay * 2 ** (failures - 1),
+                        MAX_RETRY_DELAY)
+            self._retry_at = time.monotonic() + delay
+            self._condition.notify_all()
+        logger.error('Generating a batch of %d CAPTCHAs failed '
+                     '(%d in a row, retrying in %.1fs): %r',
+                     size, failures, delay, exc)
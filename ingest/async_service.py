@@ -0,0 +1,386 @@
+"""
+Specifies the asyncio service that receives the telemetry from the MQTT broker and stores it in MongoDB.
+
+The service (and the supervisor of its instances) requires Python 3.8 or later, unlike the paho client
+and the workers of `mongomqtt.py`, which only import it when it is used.
+
+.. module:: async_service
+    :synopsis: module defining an asyncio ingest service (async MQTT client and motor) with reconnection.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import asyncio
+import logging
+import random
+import zlib
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, BulkWriteError, PyMongoError
+
+from .rollups import DEFAULT_FLUSH_INTERVAL, RollupAggregator
+from .storage import TIMESERIES_OPTIONS, documents_not_failed, documents_written, storage_for
+from .telemetry import decode_telemetry, topic_device_id
+
+try:
+    import aiomqtt
+except ImportError:
+    aiomqtt = None
+
+try:
+    import motor.motor_asyncio as motor_asyncio
+except ImportError:
+    motor_asyncio = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of bulk writes to MongoDB in flight at the same time
+DEFAULT_CONCURRENCY = 16
+
+# Number of documents written by each bulk insert
+DEFAULT_BATCH_SIZE = 1000
+
+# Maximum number of seconds that a document waits before it is written
+DEFAULT_MAX_DELAY = 0.5
+
+# Maximum number of decoded documents waiting to be written; receiving waits while the queue is full
+DEFAULT_MAX_QUEUE = 100000
+
+# Maximum number of connections to MongoDB
+DEFAULT_POOL_SIZE = 100
+
+# Number of times that a bulk write is retried after losing the connection to MongoDB
+DEFAULT_WRITE_RETRIES = 5
+
+# Maximum number of topics whose partition is cached
+PARTITION_CACHE_SIZE = 65536
+
+# Counters of the service (reported to the supervisor of the instances)
+SERVICE_COUNTERS = ('messages_received', 'messages_skipped', 'messages_invalid', 'documents_written',
+                    'documents_failed', 'batches_written', 'reconnects')
+
+
+class Backoff:
+    """Defines an exponential backoff (with jitter) between the attempts to reconnect.
+
+    :param initial: number of seconds to wait after the first failure
+    :param maximum: maximum number of seconds to wait
+    :param factor: factor that the wait is multiplied by after each failure
+    """
+    def __init__(self, initial: float = 0.5, maximum: float = 30.0, factor: float = 2.0) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.failures = 0
+
+    def __repr__(self):
+        return f'Backoff(failures={self.failures})'
+
+    def delay(self) -> float:
+        """Returns the number of seconds to wait after one more failure"""
+        delay = min(self.maximum, self.initial * self.factor ** self.failures)
+        self.failures += 1
+        return delay * random.uniform(0.5, 1.0)
+
+    def reset(self) -> None:
+        """Resets the wait after a success"""
+        self.failures = 0
+
+
+def shared_subscription(topic: str, group: str) -> str:
+    """Returns the shared subscription (MQTT v5) of a group to a topic filter
+
+    The broker delivers each message of a shared subscription to only one of the clients of the
+    group, so several instances of the service share the load without receiving every message.
+    """
+    return f'$share/{group}/{topic}'
+
+
+def device_partition(device_id: str, partitions: int) -> int:
+    """Returns the partition (0 to partitions - 1) of a device; stable across processes and restarts"""
+    return zlib.crc32(device_id.encode()) % partitions
+
+
+def mqtt_connector(hostname: str, port: int = 1883, username: str = None, password: str = None,
+                   keepalive: int = 60, mqtt5: bool = False):
+    """Returns a function connecting to the MQTT broker with aiomqtt (an async context manager yielding the client)"""
+    if aiomqtt is None:
+        raise RuntimeError('The asyncio ingest service requires aiomqtt (pip install aiomqtt)')
+    options = {'protocol': aiomqtt.ProtocolVersion.V5} if mqtt5 else {}
+
+    def connect():
+        return aiomqtt.Client(hostname, port=port, username=username, password=password, keepalive=keepalive,
+                              **options)
+    return connect
+
+
+def mqtt_errors() -> tuple:
+    """Returns the exceptions raised when the connection to the MQTT broker is lost"""
+    return (OSError, aiomqtt.MqttError) if aiomqtt is not None else (OSError,)
+
+
+async def open_async_storage(uri: str, database: str, collection: str, storage: str = 'documents',
+                             pool_size: int = DEFAULT_POOL_SIZE):
+    """Returns the storage of the telemetry in a collection of a new motor client (see `storage.open_storage`)
+
+    :param uri: URI (or host:port) of the MongoDB server
+    :param database: name of the database
+    :param collection: name of the collection
+    :param storage: storage mode of the telemetry (see `storage.STORAGE_MODES`)
+    :param pool_size: maximum number of connections to MongoDB
+    """
+    if motor_asyncio is None:
+        raise RuntimeError('The asyncio ingest service requires motor (pip install motor)')
+    db = motor_asyncio.AsyncIOMotorClient(uri, maxPoolSize=pool_size)[database]
+    store = storage_for(storage, db[collection], asynchronous=True)
+    if storage == 'timeseries' and collection not in await db.list_collection_names():
+        await db.create_collection(collection, timeseries=TIMESERIES_OPTIONS)
+    await store.ensure_indexes()
+    return store
+
+
+async def open_async_rollups(uri: str, database: str, collection: str,
+                             flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> RollupAggregator:
+    """Returns the rollups of a collection (see `rollups.RollupAggregator`), created in a thread of the executor
+
+    The aggregator creates the indexes of its collections with pymongo, which would block the event loop.
+
+    :param uri: URI (or host:port) of the MongoDB server
+    :param database: name of the database
+    :param collection: name of the collection of the telemetry
+    :param flush_interval: number of seconds between the writes of the rollups
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        None, partial(RollupAggregator, MongoClient(uri)[database], collection, flush_interval=flush_interval))
+
+
+class AsyncIngestService:
+    """Defines an asyncio service receiving the telemetry from the MQTT broker and writing it to MongoDB.
+
+    A single task receives the messages, decodes them and queues the documents; `concurrency`
+    writer tasks take the documents from the queue and write them with unordered bulk inserts (of
+    up to `batch_size` documents, or the documents that arrived within `max_delay` seconds).  With
+    motor, the writes share the connection pool of the client, so one process keeps many writes in
+    flight without a thread per connection.  The queue is bounded: when MongoDB is slower than the
+    messages arrive, receiving waits (backpressure).
+
+    When the connection to the broker is lost, the service reconnects with an exponential backoff;
+    a bulk write failing with AutoReconnect is retried the same way (up to `write_retries` times).
+
+    :param connect: function returning an async context manager that yields the connected MQTT client
+                    (with `subscribe` and the `messages` async iterator, such as `mqtt_connector`)
+    :param storage: collection (with a coroutine `insert_many`) that the documents are written to
+    :param topic: topic filter subscribed to
+    :param concurrency: number of bulk writes in flight at the same time
+    :param batch_size: number of documents written by each bulk insert
+    :param max_delay: maximum number of seconds that a document waits before it is written
+    :param max_queue: maximum number of documents waiting to be written
+    :param write_retries: number of times that a bulk write is retried after losing the connection
+    :param backoff: function returning the backoff between the attempts to reconnect
+    :param decode: function returning the record (Telemetry) of a message, or None if the message is not valid
+    :param connection_errors: exceptions raised when the connection to the broker is lost
+    :param partition: (index, partitions) of the devices whose messages are stored by this instance, the
+                      messages of the other devices being skipped (when every instance receives all of the
+                      messages, such as without shared subscriptions)
+    :param rollups: rollups (see `rollups.RollupAggregator`, and `open_async_rollups`) that the values of the
+                    documents written are added to; they are closed (and flushed) when the service stops
+    """
+    def __init__(self, connect, storage, topic: str = '#', concurrency: int = DEFAULT_CONCURRENCY,
+                 batch_size: int = DEFAULT_BATCH_SIZE, max_delay: float = DEFAULT_MAX_DELAY,
+                 max_queue: int = DEFAULT_MAX_QUEUE, write_retries: int = DEFAULT_WRITE_RETRIES,
+                 backoff=Backoff, decode=decode_telemetry, connection_errors: tuple = None,
+                 partition: tuple = None, rollups=None) -> None:
+        self.connect = connect
+        self.storage = storage
+        self.topic = topic
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.write_retries = write_retries
+        self.backoff = backoff
+        self.decode = decode
+        self.connection_errors = connection_errors or mqtt_errors()
+        self.partition = partition
+        self.rollups = rollups
+        self.messages_received = 0
+        self.messages_skipped = 0
+        self.messages_invalid = 0
+        self.documents_written = 0
+        self.documents_failed = 0
+        self.batches_written = 0
+        self.writes_in_flight = 0
+        self.reconnects = 0
+        self._queue = None
+        self._receiver = None
+        self._stopping = False
+        self._partitions = {}
+
+    def __repr__(self):
+        return (f'AsyncIngestService(received={self.messages_received}, written={self.documents_written}, '
+                f'failed={self.documents_failed})')
+
+    async def run(self) -> None:
+        """Receives and stores the telemetry until `stop` is called; then writes the queued documents"""
+        self._queue = asyncio.Queue(self.max_queue)
+        writers = [asyncio.create_task(self._run_writer(), name=f'ingest-writer-{index}')
+                   for index in range(self.concurrency)]
+        self._receiver = asyncio.create_task(self._receive(), name='ingest-receiver')
+        if self._stopping:
+            self._receiver.cancel()
+        try:
+            await self._receiver
+        except asyncio.CancelledError:
+            if not self._stopping:
+                raise
+        finally:
+            self._receiver = None
+            for _ in writers:
+                await self._queue.put(None)
+            await asyncio.gather(*writers)
+            if self.rollups is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.rollups.close)
+
+    def counters(self) -> dict:
+        """Returns the counters of the service (see SERVICE_COUNTERS)"""
+        return {name: getattr(self, name) for name in SERVICE_COUNTERS}
+
+    def stop(self) -> None:
+        """Stops receiving the messages (the queued documents are still written)"""
+        self._stopping = True
+        if self._receiver is not None:
+            self._receiver.cancel()
+
+    async def _receive(self) -> None:
+        backoff = self.backoff()
+        while True:
+            try:
+                async with self.connect() as client:
+                    await client.subscribe(self.topic)
+                    logger.info('Connected to the MQTT broker, subscribed to %s', self.topic)
+                    backoff.reset()
+                    async for message in client.messages:
+                        await self.put(str(message.topic), message.payload)
+            except self.connection_errors as exception:
+                delay = backoff.delay()
+                self.reconnects += 1
+                logger.warning('Connection to the MQTT broker lost (%s), reconnecting in %.1f s', exception, delay)
+                await asyncio.sleep(delay)
+            else:
+                # The broker closed the stream of messages
+                await asyncio.sleep(backoff.delay())
+                self.reconnects += 1
+
+    async def put(self, topic: str, payload: bytes, received=None) -> bool:
+        """Decodes a message and queues its document, waiting while the queue is full; returns False if not valid"""
+        self.messages_received += 1
+        if self.partition is not None and not self._in_partition(topic):
+            self.messages_skipped += 1
+            return False
+        try:
+            document = self.decode(topic, payload, received or datetime.now())
+        except Exception:
+            logger.exception('Decoding Exception: %s', topic)
+            document = None
+        if document is None:
+            self.messages_invalid += 1
+            return False
+        await self._queue.put(document)
+        return True
+
+    def _in_partition(self, topic: str) -> bool:
+        index, partitions = self.partition
+        partition = self._partitions.get(topic)
+        if partition is None:
+            device_id = topic_device_id(topic)
+            partition = device_partition(device_id, partitions) if device_id is not None else index
+            if len(self._partitions) >= PARTITION_CACHE_SIZE:
+                self._partitions.clear()
+            self._partitions[topic] = partition
+        return partition == index
+
+    async def _next_batch(self) -> list:
+        """Returns the next batch of documents (empty once the service is stopped)"""
+        document = await self._queue.get()
+        if document is None:
+            return []
+        batch = [document]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    document = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                document = self._queue.get_nowait()
+            if document is None:
+                # Let this writer finish after its batch
+                self._queue.put_nowait(None)
+                break
+            batch.append(document)
+        return batch
+
+    async def _run_writer(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                return
+            self.writes_in_flight += 1
+            try:
+                await self._write(batch)
+            finally:
+                self.writes_in_flight -= 1
+
+    async def _write(self, batch: list) -> None:
+        backoff = self.backoff()
+        for attempt in range(self.write_retries + 1):
+            try:
+                await self.storage.insert_many(batch, ordered=False)
+                written = len(batch)
+                rolled_up = batch
+            except BulkWriteError as exception:
+                written = documents_written(exception)
+                rolled_up = documents_not_failed(self.storage, batch, exception)
+                logger.warning('Bulk insert of %d documents: %d errors', len(batch),
+                               len(exception.details.get('writeErrors', [])))
+            except AutoReconnect as exception:
+                if attempt == self.write_retries:
+                    logger.error('Bulk insert of %d documents failed: %s', len(batch), exception)
+                    self.documents_failed += len(batch)
+                    return
+                delay = backoff.delay()
+                logger.warning('Connection to MongoDB lost (%s), retrying in %.1f s', exception, delay)
+                await asyncio.sleep(delay)
+                continue
+            except PyMongoError as exception:
+                logger.error('Bulk insert of %d documents failed: %s', len(batch), exception)
+                self.documents_failed += len(batch)
+                return
+            self.documents_written += written
+            self.documents_failed += len(batch) - written
+            self.batches_written += 1
+            if self.rollups is not None:
+                for document in rolled_up:
+                    self.rollups.add(document)
+            return
+
+
+@asynccontextmanager
+async def ingest_service(connect, storage, **options):
+    """Runs an ingest service in the background for the duration of the context; yields the service"""
+    service = AsyncIngestService(connect, storage, **options)
+    task = asyncio.create_task(service.run())
+    try:
+        yield service
+    finally:
+        service.stop()
+        await task
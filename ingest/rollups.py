@@ -0,0 +1,272 @@
+"""
+Specifies the rollups (count, minimum, maximum and mean per minute and per hour) of the telemetry, computed at ingest time.
+
+.. module:: rollups
+    :synopsis: module defining streaming rollups of the telemetry, flushed periodically to rollup collections.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .storage import to_number
+
+
+logger = logging.getLogger(__name__)
+
+
+# Resolutions of the rollups, by name (the suffix of their collection)
+RESOLUTIONS = {'1m': timedelta(minutes=1), '1h': timedelta(hours=1)}
+
+# Number of seconds between the writes of the rollups to their collections
+DEFAULT_FLUSH_INTERVAL = 10.0
+
+# Origin of the periods of the rollups
+EPOCH = datetime(1970, 1, 1)
+
+
+def rollup_collection_name(collection: str, resolution: str) -> str:
+    """Returns the name of the collection of the rollups of a collection at a resolution, such as Data_rollup_1m"""
+    return f'{collection}_rollup_{resolution}'
+
+
+def period_start(tstamp: datetime, resolution: timedelta) -> datetime:
+    """Returns the start of the period (such as the minute) of the date and time"""
+    return EPOCH + (tstamp - EPOCH) // resolution * resolution
+
+
+class Rollup:
+    """Defines the accumulator of the numeric values of a device and datastream over a period.
+
+    :param value: first value
+    """
+    __slots__ = ('count', 'total', 'minimum', 'maximum')
+
+    def __init__(self, value: float) -> None:
+        self.count = 1
+        self.total = value
+        self.minimum = value
+        self.maximum = value
+
+    def __repr__(self):
+        return f'Rollup(count={self.count}, min={self.minimum}, max={self.maximum}, mean={self.mean})'
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count
+
+    def add(self, value: float) -> None:
+        """Adds a value to the rollup"""
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other: 'Rollup') -> None:
+        """Adds the values of another rollup of the same period"""
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+
+class RollupAggregator:
+    """Defines the rollups of the numeric telemetry per (device_id, datastream_name), at several resolutions.
+
+    Each numeric value added updates the in-memory rollup of its device, datastream and period
+    (such as the minute) at each resolution.  Every `flush_interval` seconds (and when closed), a
+    background thread writes the rollups to their collections (one per resolution, such as
+    Data_rollup_1m) with a bulk upsert per collection, and starts them over:
+        {"device_id": ..., "datastream_name": "temp", "period": 2019-05-06T10:11:00, "count": 12,
+         "sum": 258.3, "min": 21.0, "max": 21.9}
+    The upserts add to the count and sum and keep the minimum and maximum of the stored rollup, so
+    several aggregators (such as one per worker process) can update the same collections.  The
+    mean is the sum divided by the count (see `read_rollups`).  Rollups that cannot be written are
+    kept in memory and written with the next flush.
+
+    This class is safe to use from several threads.
+
+    :param database: MongoDB database of the rollup collections
+    :param collection: name of the collection of the telemetry (the prefix of the rollup collections)
+    :param resolutions: names of the resolutions of the rollups (see RESOLUTIONS)
+    :param flush_interval: number of seconds between the writes of the rollups (None not to write them in
+                           the background)
+    """
+    def __init__(self, database, collection: str = 'Data', resolutions=tuple(RESOLUTIONS),
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> None:
+        self.resolutions = {name: RESOLUTIONS[name] for name in resolutions}
+        self.collections = {name: database[rollup_collection_name(collection, name)] for name in self.resolutions}
+        self.flush_interval = flush_interval
+        self.values_added = 0
+        self.values_skipped = 0
+        self.rollups_written = 0
+        self._rollups = {name: {} for name in self.resolutions}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        for rollups in self.collections.values():
+            rollups.create_index([('device_id', ASCENDING), ('datastream_name', ASCENDING),
+                                  ('period', ASCENDING)], unique=True)
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._run, name='rollups', daemon=True)
+            self._thread.start()
+
+    def __repr__(self):
+        return f'RollupAggregator({", ".join(self.resolutions)}, added={self.values_added})'
+
+    def __len__(self):
+        """Returns the number of rollups in memory"""
+        return sum(len(rollups) for rollups in self._rollups.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, telemetry) -> bool:
+        """Adds the value of a decoded message (Telemetry record or document); returns False if it is not numeric"""
+        if isinstance(telemetry, dict):
+            device_id, datastream_name = telemetry['device_id'], telemetry['datastream_name']
+            value, tstamp = telemetry['value'], telemetry['tstamp']
+        else:
+            device_id, datastream_name = telemetry.device_id, telemetry.datastream_name
+            value, tstamp = telemetry.value, telemetry.tstamp
+        value = to_number(value)
+        if type(value) is not float:
+            self.values_skipped += 1
+            return False
+        with self._lock:
+            for name, resolution in self.resolutions.items():
+                key = (device_id, datastream_name, period_start(tstamp, resolution))
+                rollup = self._rollups[name].get(key)
+                if rollup is None:
+                    self._rollups[name][key] = Rollup(value)
+                else:
+                    rollup.add(value)
+            self.values_added += 1
+        return True
+
+    def flush(self) -> bool:
+        """Writes the rollups in memory to their collections; returns False if some of them could not be written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._rollups = self._rollups, {name: {} for name in self.resolutions}
+            flushed = True
+            for name, rollups in pending.items():
+                if not rollups:
+                    continue
+                keys = list(rollups)
+                try:
+                    self.collections[name].bulk_write([self.rollup_update(key, rollups[key]) for key in keys],
+                                                      ordered=False)
+                    self.rollups_written += len(rollups)
+                except BulkWriteError as exception:
+                    # The other upserts were applied: restoring them would count their values twice
+                    failed = {error['index'] for error in exception.details.get('writeErrors', ())}
+                    logger.error('Writing %d of %d rollups (%s) failed: %s', len(failed), len(rollups), name,
+                                 exception)
+                    self._restore(name, {keys[index]: rollups[keys[index]] for index in failed})
+                    self.rollups_written += len(rollups) - len(failed)
+                    flushed = flushed and not failed
+                except PyMongoError as exception:
+                    logger.error('Writing %d rollups (%s) failed: %s', len(rollups), name, exception)
+                    self._restore(name, rollups)
+                    flushed = False
+            return flushed
+
+    def _restore(self, name: str, rollups: dict) -> None:
+        """Merges rollups that could not be written back into the rollups in memory"""
+        with self._lock:
+            current = self._rollups[name]
+            for key, rollup in rollups.items():
+                if key in current:
+                    rollup.merge(current[key])
+                current[key] = rollup
+
+    @staticmethod
+    def rollup_update(key: tuple, rollup: Rollup) -> UpdateOne:
+        """Returns the upsert adding a rollup to the stored rollup of its device, datastream and period"""
+        device_id, datastream_name, period = key
+        return UpdateOne({'device_id': device_id, 'datastream_name': datastream_name, 'period': period},
+                         {'$inc': {'count': rollup.count, 'sum': rollup.total},
+                          '$min': {'min': rollup.minimum}, '$max': {'max': rollup.maximum}}, upsert=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """Stops the background thread and writes the rollups in memory"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+def read_rollups(collection, device_id: str, datastream_name: str, start: datetime = None, end: datetime = None):
+    """Yields the rollups of a device and datastream, in the order of their periods, with their mean
+
+    :param collection: rollup collection (such as Data_rollup_1m)
+    :param device_id: id of the device
+    :param datastream_name: name of the datastream
+    :param start: start of the first period (None for the first rollup)
+    :param end: end of the periods, excluded (None for the last rollup)
+    """
+    query = {'device_id': device_id, 'datastream_name': datastream_name}
+    if start is not None or end is not None:
+        query['period'] = {}
+        if start is not None:
+            query['period']['$gte'] = start
+        if end is not None:
+            query['period']['$lt'] = end
+    for rollup in collection.find(query, {'_id': False}).sort('period', ASCENDING):
+        rollup['mean'] = rollup['sum'] / rollup['count']
+        yield rollup
+
+
+class RollupSink:
+    """Defines a sink adding each document to a sink (such as a `WriteBehindBuffer`) and to rollups.
+
+    :param sink: sink (with `add` and `close`) that the documents are added to
+    :param rollups: rollups that the values of the documents are added to
+    """
+    def __init__(self, sink, rollups: RollupAggregator) -> None:
+        self.sink = sink
+        self.rollups = rollups
+
+    def __repr__(self):
+        return f'RollupSink({self.sink!r}, {self.rollups!r})'
+
+    def add(self, document, timeout: float = None) -> bool:
+        """Adds a document to the sink, and to the rollups if the sink accepted it"""
+        added = self.sink.add(document, timeout=timeout)
+        if added:
+            self.rollups.add(document)
+        return added
+
+    def close(self) -> None:
+        self.sink.close()
+        self.rollups.close()
+
+
+def open_rollup_sink(sink_factory, uri: str, database: str, collection: str,
+                     flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> RollupSink:
+    """Returns the sink created by `sink_factory`, with the rollups of a collection (such as in a worker process)
+
+    :param sink_factory: function returning the sink (with `add` and `close`) that the documents are added to
+    :param uri: URI (or host:port) of the MongoDB server
+    :param database: name of the database
+    :param collection: name of the collection of the telemetry
+    :param flush_interval: number of seconds between the writes of the rollups
+    """
+    rollups = RollupAggregator(MongoClient(uri)[database], collection, flush_interval=flush_interval)
+    return RollupSink(sink_factory(), rollups)
@@ -0,0 +1,297 @@
+"""
+Specifies the on-disk spool holding the telemetry documents while MongoDB is slow or down.
+
+.. module:: spool
+    :synopsis: module defining a memory-mapped, append-only, segmented spool of documents.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+import bson
+
+
+logger = logging.getLogger(__name__)
+
+
+# Size of each segment file of the spool, in bytes
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Maximum disk space used by the segments of the spool, in bytes
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Header of each record: length and CRC-32 of the BSON document (a length of 0 ends the segment)
+RECORD_HEADER = struct.Struct('<II')
+
+# Name of the segment files (by sequence number)
+SEGMENT_NAME = 'segment-{:012d}.log'
+
+# Name of the file holding the position of the first record not replayed yet
+POSITION_NAME = 'position'
+
+
+class SpoolFull(Exception):
+    """Raised when documents do not fit in the disk space of the spool"""
+
+
+class Spool:
+    """Defines an append-only log of documents on disk, split into memory-mapped segments.
+
+    Documents are appended as BSON records (with their length and CRC-32) to the current segment,
+    a file of `segment_size` bytes mapped in memory; when it is full, a new segment is started.
+    The segments use at most `max_bytes` of disk: appending raises SpoolFull when a new segment
+    would exceed it.  The records are kept out of the heap, and survive a crash of the process.
+
+    `replay` reads the records in the order that they were appended and passes them, in batches,
+    to a write function (such as the `insert_many` of a storage); the position of the first record
+    not replayed yet is saved after each successful batch, and the segments fully replayed are
+    removed.  A batch whose write fails is replayed again later, so the documents should have
+    deterministic _ids (see `storage.document_id`) for the replay to be idempotent.
+
+    A spool directory is used by a single process at a time (it is locked).  This class is safe
+    to use from several threads.
+
+    :param directory: directory of the segment files (created if needed)
+    :param segment_size: size of each segment file, in bytes
+    :param max_bytes: maximum disk space used by the segments, in bytes
+    """
+    def __init__(self, directory: str, segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        if max_bytes < segment_size:
+            raise ValueError('The spool must hold at least one segment')
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.pending = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, 'lock'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise
+        self._segments = sorted(int(name[8:20]) for name in os.listdir(directory)
+                                if name.startswith('segment-') and name.endswith('.log'))
+        self._position = self._read_position()
+        self._file = None
+        self._map = None
+        if not self._segments:
+            self._segments.append(0)
+        self._open_segment(self._segments[-1])
+        self._offset = self._scan_end()
+        self.pending = self._count_pending()
+
+    def __repr__(self):
+        return f'Spool({self.directory}, pending={self.pending}, segments={len(self._segments)})'
+
+    def __len__(self):
+        return self.pending
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def disk_usage(self) -> int:
+        """Returns the disk space used by the segments, in bytes"""
+        return len(self._segments) * self.segment_size
+
+    def _path(self, sequence: int) -> str:
+        return os.path.join(self.directory, SEGMENT_NAME.format(sequence))
+
+    def _read_position(self) -> tuple:
+        try:
+            with open(os.path.join(self.directory, POSITION_NAME)) as file:
+                sequence, offset = file.read().split()
+                return int(sequence), int(offset)
+        except FileNotFoundError:
+            return (self._segments[0] if self._segments else 0), 0
+
+    def _write_position(self, position: tuple) -> None:
+        path = os.path.join(self.directory, POSITION_NAME)
+        with open(path + '.tmp', 'w') as file:
+            file.write('%d %d' % position)
+        os.replace(path + '.tmp', path)
+        self._position = position
+
+    def _open_segment(self, sequence: int) -> None:
+        """Maps the segment that records are appended to (creating its file of segment_size bytes)"""
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+        self._file = open(self._path(sequence), 'a+b')
+        if os.fstat(self._file.fileno()).st_size < self.segment_size:
+            self._file.truncate(self.segment_size)
+        self._map = mmap.mmap(self._file.fileno(), self.segment_size)
+        self._offset = 0
+
+    def _records(self, data, offset: int, end: int):
+        """Yields the (offset of the next record, BSON record) of the records of a segment, from offset to end"""
+        while offset + RECORD_HEADER.size <= end:
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            if length == 0 or start + length > end:
+                return
+            record = data[start:start + length]
+            if zlib.crc32(record) != crc:
+                # Torn write (such as a crash while appending): the segment ends here
+                logger.warning('Spool %s: corrupted record at offset %d', self.directory, offset)
+                return
+            offset = start + length
+            yield offset, record
+
+    def _scan_end(self) -> int:
+        """Returns the offset after the last complete record of the current segment"""
+        end = 0
+        for end, _ in self._records(self._map, 0, self.segment_size):
+            pass
+        return end
+
+    def _count_pending(self) -> int:
+        count = 0
+        sequence, offset = self._position
+        for segment in self._segments:
+            if segment < sequence:
+                continue
+            for _ in self._segment_records(segment, offset if segment == sequence else 0):
+                count += 1
+        return count
+
+    def _segment_records(self, sequence: int, offset: int):
+        if sequence == self._segments[-1]:
+            yield from self._records(self._map, offset, self._offset)
+            return
+        with open(self._path(sequence), 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from self._records(data, offset, len(data))
+
+    def append(self, documents: list) -> int:
+        """Appends documents (dicts) to the spool; returns the number of documents appended
+
+        :raise SpoolFull: if the documents do not fit in the disk space of the spool (none is appended then)
+        """
+        records = []
+        for document in documents:
+            record = bson.encode(document)
+            if RECORD_HEADER.size + len(record) > self.segment_size:
+                raise ValueError(f'Document of {len(record)} bytes larger than a segment of the spool')
+            records.append(record)
+
+        with self._lock:
+            # Checks that all the records fit before writing any of them
+            offset, segments = self._offset, len(self._segments)
+            for record in records:
+                size = RECORD_HEADER.size + len(record)
+                if offset + size > self.segment_size:
+                    offset, segments = 0, segments + 1
+                offset += size
+            if segments * self.segment_size > self.max_bytes:
+                raise SpoolFull(f'Spool {self.directory} is full ({self.max_bytes} bytes)')
+
+            for record in records:
+                size = RECORD_HEADER.size + len(record)
+                if self._offset + size > self.segment_size:
+                    self._segments.append(self._segments[-1] + 1)
+                    self._open_segment(self._segments[-1])
+                self._map[self._offset + RECORD_HEADER.size:self._offset + size] = record
+                if self._offset + size + RECORD_HEADER.size <= self.segment_size:
+                    # Ends the segment after the record (a segment that starts over may hold older records)
+                    RECORD_HEADER.pack_into(self._map, self._offset + size, 0, 0)
+                RECORD_HEADER.pack_into(self._map, self._offset, len(record), zlib.crc32(record))
+                self._offset += size
+            self.pending += len(records)
+        return len(records)
+
+    def read(self, count: int) -> tuple:
+        """Returns up to count documents not replayed yet, and the position after them (see `commit`)"""
+        documents = []
+        with self._lock:
+            sequence, offset = self._position
+            for segment in self._segments:
+                if segment < sequence:
+                    continue
+                if segment > sequence:
+                    sequence, offset = segment, 0
+                for offset, record in self._segment_records(segment, offset):
+                    documents.append(bson.decode(record))
+                    if len(documents) == count:
+                        return documents, (sequence, offset)
+        return documents, (sequence, offset)
+
+    def commit(self, position: tuple, count: int) -> None:
+        """Saves the position of the first document not replayed yet, and removes the segments fully replayed"""
+        with self._lock:
+            self._write_position(position)
+            self.pending -= count
+            while self._segments[0] < position[0]:
+                os.remove(self._path(self._segments.pop(0)))
+            if self.pending == 0 and position == (self._segments[-1], self._offset) and self._offset > 0:
+                # Everything is replayed: the current segment starts over
+                self._map[:RECORD_HEADER.size] = bytes(RECORD_HEADER.size)
+                self._offset = 0
+                self._write_position((self._segments[-1], 0))
+
+    def replay(self, write, batch_size: int = 1000, max_batches: int = None) -> int:
+        """Passes the documents of the spool, in batches, to a write function; returns the number replayed
+
+        The position is saved after each batch; if the write function raises an exception, the
+        replay stops (and the exception is raised) and the batch is replayed again the next time.
+
+        :param write: function called with each batch (list) of documents
+        :param batch_size: maximum number of documents in each batch
+        :param max_batches: maximum number of batches replayed (None for all of the documents)
+        """
+        replayed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            documents, position = self.read(batch_size)
+            if not documents:
+                break
+            write(documents)
+            self.commit(position, len(documents))
+            replayed += len(documents)
+            batches += 1
+        return replayed
+
+    def sync(self) -> None:
+        """Writes the current segment to disk"""
+        with self._lock:
+            self._map.flush()
+
+    def close(self) -> None:
+        """Writes the current segment to disk and releases the spool"""
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+                self._map.close()
+                self._file.close()
+                self._map = None
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+
+
+def open_spool(directory: str, **options) -> Spool:
+    """Returns the first spool of a directory that is not used by another process (0, 1, ... sub-directories)
+
+    Each worker process uses its own spool; a process that is restarted takes over the spool of
+    the process that it replaces, so no spooled document is left behind.
+
+    :param directory: directory of the spools
+    :param options: options of the spool (segment_size, max_bytes)
+    """
+    index = 0
+    while True:
+        try:
+            return Spool(os.path.join(directory, str(index)), **options)
+        except BlockingIOError:
+            index += 1
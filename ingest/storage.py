@@ -0,0 +1,360 @@
+"""
+Specifies how the telemetry documents are stored in MongoDB (one document per reading, hourly buckets or a
+time-series collection).
+
+.. module:: storage
+    :synopsis: module defining the storage modes of the telemetry and the migration between them.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import hashlib
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+from .telemetry import as_document
+
+
+logger = logging.getLogger(__name__)
+
+
+# Storage modes of the telemetry
+STORAGE_MODES = ('documents', 'buckets', 'timeseries')
+
+# Storage modes whose writes are idempotent (a batch written again is not stored twice), so they can be spooled
+IDEMPOTENT_STORAGE_MODES = ('documents', 'buckets')
+
+# Error code of a duplicate key
+DUPLICATE_KEY = 11000
+
+# Options of the time-series collection of the readings (MongoDB 5.0+)
+TIMESERIES_OPTIONS = {'timeField': 'tstamp', 'metaField': 'meta', 'granularity': 'seconds'}
+
+# Number of documents read (and written) at a time while migrating a collection
+MIGRATION_BATCH_SIZE = 1000
+
+
+def to_number(value):
+    """Returns the value as a number (float) if it is one, such as "21.5", or else the value unchanged"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def document_id(document: dict) -> ObjectId:
+    """Returns the deterministic _id (an ObjectId) of a telemetry document, from its device, datastream, time and value
+
+    Writing the same reading twice (such as when a batch is replayed from the spool after a
+    write that failed midway) then fails with a duplicate key instead of storing it twice.  The
+    _id is an ObjectId like those of the documents written without it, so all the _ids of a
+    collection sort (and resume a migration) in the same BSON type.
+    """
+    key = '\0'.join((str(document['device_id']), str(document['datastream_name']), document['tstamp'].isoformat(),
+                     repr(to_number(document['value']))))
+    return ObjectId(hashlib.blake2b(key.encode(), digest_size=12).digest())
+
+
+def only_duplicate_keys(exception: BulkWriteError) -> bool:
+    """Returns True if all the errors of a bulk write are duplicate keys (the documents were written already)"""
+    return all(error.get('code') == DUPLICATE_KEY for error in exception.details.get('writeErrors', []))
+
+
+def documents_written(exception: BulkWriteError) -> int:
+    """Returns the number of documents written by a bulk write that failed (inserted, or upserted and modified)"""
+    details = exception.details
+    return details.get('nInserted', 0) + details.get('nUpserted', 0) + details.get('nModified', 0)
+
+
+def documents_not_failed(storage, documents: list, exception: BulkWriteError) -> list:
+    """Returns the documents of a bulk write that failed which were written by it
+
+    The errors of a bucket write are those of the upserts of its buckets, not of its documents, so
+    none of its documents are returned.
+    """
+    if isinstance(storage, BucketCollection):
+        return []
+    failed = {error['index'] for error in exception.details.get('writeErrors', [])}
+    return [document for index, document in enumerate(documents) if index not in failed]
+
+
+def bucket_hour(tstamp: datetime) -> datetime:
+    """Returns the start of the hour of the date and time (the bucket that a reading is stored in)"""
+    return tstamp.replace(minute=0, second=0, microsecond=0)
+
+
+class DocumentCollection:
+    """Defines the storage of each reading in its own document, as `on_message` always did.
+
+    The documents are stored as they are (the value is not converted, since the Data model of the
+    web application stores it as a string), but the _id of each document is deterministic (see
+    `document_id`), so writing a batch again is idempotent.
+
+    :param collection: collection that the documents are written to
+    """
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    def __repr__(self):
+        return f'DocumentCollection({self.collection.name})'
+
+    def ensure_indexes(self):
+        """Creates the index of the range queries per device and datastream (returns an awaitable with motor)"""
+        return self.collection.create_index([('device_id', ASCENDING), ('datastream_name', ASCENDING),
+                                             ('tstamp', ASCENDING)])
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        documents = [as_document(document) for document in documents]
+        for document in documents:
+            if '_id' not in document:
+                document['_id'] = document_id(document)
+        return self.collection.insert_many(documents, ordered=ordered)
+
+
+class BucketCollection:
+    """Defines the storage of the readings in buckets, one document per (device_id, datastream_name, hour).
+
+    Each bucket holds the readings of its hour, as {"_id": ..., "t": tstamp, "v": value, "c": context}
+    (the _id of a reading being its `document_id`), with the count of the readings, the times of the
+    first and last readings, and the minimum, maximum and sum of the numeric values:
+        {"device_id": ..., "datastream_name": "temp", "hour": 2019-05-06T10:00:00, "count": 2,
+         "first": ..., "last": ..., "min": 21.5, "max": 22.0, "sum": 43.5, "readings": [...]}
+
+    The readings of a batch are grouped by bucket, and each bucket is updated (or created) with a
+    single upsert, so writing a batch is one bulk write whatever the number of readings.
+
+    Writing readings again (such as when a batch is replayed from the spool) does not store them
+    twice: the upsert of a bucket only matches if none of its readings are in the bucket already.
+    If some are, the upsert fails with a duplicate key (on the unique index of the buckets), and
+    the readings of that bucket are written one at a time, each only if it is not in the bucket.
+
+    :param collection: collection of the buckets
+    """
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    def __repr__(self):
+        return f'BucketCollection({self.collection.name})'
+
+    def ensure_indexes(self):
+        """Creates the (unique) index of the buckets, which also serves the range queries per device and datastream"""
+        return self.collection.create_index([('device_id', ASCENDING), ('datastream_name', ASCENDING),
+                                             ('hour', ASCENDING)], unique=True)
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        groups = self.group(documents)
+        try:
+            # Unordered, so that the buckets that fail do not prevent the others from being written
+            return self.collection.bulk_write(self.bucket_updates(groups), ordered=False)
+        except BulkWriteError as exception:
+            if not only_duplicate_keys(exception):
+                raise
+            updates = self.reading_updates(groups, exception)
+            try:
+                return self.collection.bulk_write(updates, ordered=False)
+            except BulkWriteError as exception:
+                if not only_duplicate_keys(exception):
+                    raise
+
+    @staticmethod
+    def group(documents: list) -> list:
+        """Returns the readings of the documents grouped by bucket, as a list of (key, readings)"""
+        buckets = {}
+        for document in map(as_document, documents):
+            key = (document['device_id'], document['datastream_name'], bucket_hour(document['tstamp']))
+            buckets.setdefault(key, []).append(document)
+        return list(buckets.items())
+
+    def bucket_updates(self, groups: list) -> list:
+        """Returns the upserts adding each group of readings to its bucket"""
+        return [self.bucket_update(key, readings) for key, readings in groups]
+
+    def reading_updates(self, groups: list, exception: BulkWriteError) -> list:
+        """Returns the upserts adding the readings of the buckets that failed (with a duplicate key) one at a time
+
+        Those buckets hold some of the readings already, or were created meanwhile by another writer.
+        """
+        errors = exception.details.get('writeErrors', [])
+        return [self.bucket_update(key, [document]) for key, readings in (groups[error['index']] for error in errors)
+                for document in readings]
+
+    @staticmethod
+    def bucket_update(key: tuple, documents: list) -> UpdateOne:
+        """Returns the upsert adding the documents to their bucket, unless one of them is in the bucket already"""
+        device_id, datastream_name, hour = key
+        readings = []
+        values = []
+        for document in documents:
+            value = to_number(document['value'])
+            readings.append({'_id': document.get('_id') or document_id(document), 't': document['tstamp'],
+                             'v': value, 'c': document.get('context', {})})
+            if isinstance(value, float):
+                values.append(value)
+
+        times = [reading['t'] for reading in readings]
+        update = {
+            '$push': {'readings': {'$each': readings}},
+            '$inc': {'count': len(readings)},
+            '$min': {'first': min(times)},
+            '$max': {'last': max(times)},
+        }
+        if values:
+            update['$inc']['sum'] = sum(values)
+            update['$min']['min'] = min(values)
+            update['$max']['max'] = max(values)
+        ids = [reading['_id'] for reading in readings]
+        return UpdateOne({'device_id': device_id, 'datastream_name': datastream_name, 'hour': hour,
+                          'readings._id': {'$nin': ids}}, update, upsert=True)
+
+
+class AsyncBucketCollection(BucketCollection):
+    """Defines the storage of the readings in buckets with an asyncio (motor) collection.
+
+    The bulk writes of motor only fail once they are awaited, so both of them (the upserts of the
+    buckets, then of the readings of the buckets that failed with a duplicate key) are awaited
+    here, within the handling of their errors (see `BucketCollection`).
+
+    :param collection: motor collection of the buckets
+    """
+    def __repr__(self):
+        return f'AsyncBucketCollection({self.collection.name})'
+
+    async def insert_many(self, documents: list, ordered: bool = True):
+        groups = self.group(documents)
+        try:
+            return await self.collection.bulk_write(self.bucket_updates(groups), ordered=False)
+        except BulkWriteError as exception:
+            if not only_duplicate_keys(exception):
+                raise
+            updates = self.reading_updates(groups, exception)
+            try:
+                return await self.collection.bulk_write(updates, ordered=False)
+            except BulkWriteError as exception:
+                if not only_duplicate_keys(exception):
+                    raise
+
+
+class TimeSeriesCollection:
+    """Defines the storage of the readings in a MongoDB (5.0+) time-series collection.
+
+    Each reading is stored as {"tstamp": ..., "meta": {"device_id": ..., "datastream_name": ...},
+    "value": 21.5, "context": {...}}; MongoDB groups the readings of the same meta into buckets itself.
+
+    The _id of a document is kept, but a time-series collection has no unique index on _id, so
+    writing a batch again stores its readings twice: this storage cannot be spooled.
+
+    :param collection: time-series collection (see `create_timeseries_collection`)
+    """
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    def __repr__(self):
+        return f'TimeSeriesCollection({self.collection.name})'
+
+    def ensure_indexes(self):
+        """Creates the index of the range queries per device and datastream (returns an awaitable with motor)"""
+        return self.collection.create_index([('meta.device_id', ASCENDING), ('meta.datastream_name', ASCENDING),
+                                             ('tstamp', ASCENDING)])
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        return self.collection.insert_many([self.reading(as_document(document)) for document in documents],
+                                           ordered=ordered)
+
+    @staticmethod
+    def reading(document: dict) -> dict:
+        """Returns the time-series reading of a telemetry document"""
+        reading = {'tstamp': document['tstamp'],
+                   'meta': {'device_id': document['device_id'], 'datastream_name': document['datastream_name']},
+                   'value': to_number(document['value']),
+                   'context': document.get('context', {})}
+        if '_id' in document:
+            reading['_id'] = document['_id']
+        return reading
+
+
+def create_timeseries_collection(database, name: str):
+    """Creates the time-series collection of the readings (if it does not exist); returns the collection"""
+    try:
+        return database.create_collection(name, timeseries=TIMESERIES_OPTIONS)
+    except CollectionInvalid:
+        return database[name]
+
+
+def storage_for(mode: str, collection, asynchronous: bool = False):
+    """Returns the storage (with `insert_many`) of the telemetry in the collection, for a storage mode
+
+    The collection is used as it is: with pymongo or motor, so this is shared by `open_storage` and
+    `async_service.open_async_storage`, which create the collection and its indexes.
+
+    :param mode: storage mode, one of STORAGE_MODES
+    :param collection: collection of the telemetry (a time-series collection for the timeseries mode)
+    :param asynchronous: flag indicating if the collection is a motor collection, whose `insert_many`
+                         is then a coroutine
+    """
+    if mode == 'documents':
+        return DocumentCollection(collection)
+    if mode == 'buckets':
+        return AsyncBucketCollection(collection) if asynchronous else BucketCollection(collection)
+    if mode == 'timeseries':
+        return TimeSeriesCollection(collection)
+    raise ValueError(f'Unknown storage mode: {mode}')
+
+
+def open_storage(database, name: str, mode: str = 'documents'):
+    """Returns the storage (with `insert_many`) of the telemetry in the collection, after creating its indexes
+
+    :param database: MongoDB database
+    :param name: name of the collection
+    :param mode: storage mode, one of STORAGE_MODES
+    """
+    storage = storage_for(mode, database[name])
+    if mode == 'timeseries':
+        create_timeseries_collection(database, name)
+    storage.ensure_indexes()
+    return storage
+
+
+def migrate(source, storage, batch_size: int = MIGRATION_BATCH_SIZE, start_after=None, progress=None):
+    """Copies the telemetry documents of a collection (such as mqtt_data.Data) to a storage
+
+    The documents are read in the order of their _id, so an interrupted migration is resumed by
+    passing the last _id that was migrated as `start_after`.
+
+    :param source: collection of the documents, one per reading
+    :param storage: storage that the readings are written to (see `open_storage`)
+    :param batch_size: number of documents read and written at a time
+    :param start_after: _id of the last document already migrated, if any
+    :param progress: function called with the number of documents migrated and the last _id, after each batch
+    :return: number of documents migrated, and the _id of the last one
+    """
+    query = {} if start_after is None else {'_id': {'$gt': start_after}}
+    migrated = 0
+    last_id = start_after
+    batch = []
+    for document in source.find(query, batch_size=batch_size).sort('_id', ASCENDING):
+        last_id = document.pop('_id')
+        if 'value' not in document or 'tstamp' not in document:
+            logger.warning('Skipping document without a value or time: %s', last_id)
+            continue
+        batch.append(document)
+        if len(batch) >= batch_size:
+            storage.insert_many(batch, ordered=False)
+            migrated += len(batch)
+            batch = []
+            if progress is not None:
+                progress(migrated, last_id)
+    if batch:
+        storage.insert_many(batch, ordered=False)
+        migrated += len(batch)
+        if progress is not None:
+            progress(migrated, last_id)
+    return migrated, last_id
@@ -0,0 +1,202 @@
+"""
+Specifies the supervisor running several instances of the asyncio ingest service, one per process.
+
+.. module:: supervisor
+    :synopsis: module defining a supervisor starting, restarting and monitoring the ingest instances.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+from .async_service import SERVICE_COUNTERS
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of seconds between the reports of the counters of an instance
+DEFAULT_STATS_INTERVAL = 5.0
+
+# Number of seconds to wait before restarting an instance that stopped unexpectedly
+DEFAULT_RESTART_DELAY = 1.0
+
+# Number of seconds between the checks of the stop event by an instance
+STOP_POLL_INTERVAL = 0.1
+
+
+def run_instance(service_factory, index: int, instances: int, stats, stop, stats_interval: float) -> None:
+    """Runs an instance of the ingest service until the stop event is set (the target of the instance processes)
+
+    :param service_factory: coroutine function returning the service of an instance, called with
+                            (index, instances)
+    :param index: index of the instance (0 to instances - 1)
+    :param instances: number of instances
+    :param stats: queue that the (index, counters) of the instance are put to
+    :param stop: event set to stop the instances
+    :param stats_interval: number of seconds between the reports of the counters
+    """
+    # Ctrl-C stops the supervisor, which then stops the instances (after they write their queued documents)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(service_factory, index, instances, stats, stop, stats_interval))
+
+
+async def _serve(service_factory, index: int, instances: int, stats, stop, stats_interval: float) -> None:
+    service = await service_factory(index, instances)
+    task = asyncio.create_task(service.run())
+    loop = asyncio.get_running_loop()
+    next_report = loop.time() + stats_interval
+    while not task.done():
+        await asyncio.wait({task}, timeout=STOP_POLL_INTERVAL)
+        if stop.is_set():
+            service.stop()
+        if loop.time() >= next_report:
+            stats.put((index, service.counters()))
+            next_report += stats_interval
+    stats.put((index, service.counters()))
+    # Raises the exception of the service, if any (the process then exits with an error)
+    task.result()
+
+
+class Supervisor:
+    """Defines a supervisor running `instances` ingest services, each in its own process.
+
+    The instances share the load either with a shared subscription (MQTT v5, see
+    `async_service.shared_subscription`), the broker delivering each message to a single instance,
+    or by partitioning the devices (`partition=(index, instances)` of the service), every instance
+    receiving all of the messages but storing only those of its devices.  The service of each
+    instance is created in its process by `service_factory`.
+
+    The supervisor restarts the instances that stop unexpectedly (after `restart_delay` seconds),
+    and aggregates the counters that the instances report every `stats_interval` seconds into the
+    totals and throughput of the whole service (`stats`).
+
+    :param service_factory: coroutine function returning the service (such as an `AsyncIngestService`) of
+                            an instance, called with (index, instances); it must be picklable (such as a
+                            module-level function or a `functools.partial`)
+    :param instances: number of instances (processes)
+    :param stats_interval: number of seconds between the reports of the counters of the instances
+    :param restart_delay: number of seconds to wait before restarting an instance that stopped
+    """
+    def __init__(self, service_factory, instances: int = 4, stats_interval: float = DEFAULT_STATS_INTERVAL,
+                 restart_delay: float = DEFAULT_RESTART_DELAY) -> None:
+        self.service_factory = service_factory
+        self.instances = instances
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.restarts = 0
+        self._processes = [None] * instances
+        self._died = [None] * instances
+        self._counters = [dict.fromkeys(SERVICE_COUNTERS, 0) for _ in range(instances)]
+        # Counters of the processes that were restarted
+        self._retired = dict.fromkeys(SERVICE_COUNTERS, 0)
+        self._stats = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._rate_time = None
+        self._rate_received = 0
+        self.messages_per_second = 0.0
+
+    def __repr__(self):
+        return f'Supervisor({self.instances} instances, restarts={self.restarts})'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        """Starts the instances and the thread monitoring them"""
+        self._stop.clear()
+        self._stopped.clear()
+        for index in range(self.instances):
+            self._start_instance(index)
+        self._rate_time = time.monotonic()
+        self._monitor = threading.Thread(target=self._run_monitor, name='ingest-supervisor', daemon=True)
+        self._monitor.start()
+
+    def _start_instance(self, index: int) -> None:
+        process = multiprocessing.Process(target=run_instance, name=f'ingest-instance-{index}', daemon=True,
+                                          args=(self.service_factory, index, self.instances, self._stats,
+                                                self._stop, self.stats_interval))
+        process.start()
+        self._processes[index] = process
+        self._died[index] = None
+        logger.info('Started ingest instance %d (pid %d)', index, process.pid)
+
+    def _run_monitor(self) -> None:
+        while not self._stopped.is_set():
+            self._collect(timeout=STOP_POLL_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stop.is_set():
+                    continue
+                now = time.monotonic()
+                if self._died[index] is None:
+                    self._died[index] = now
+                    logger.warning('Ingest instance %d stopped (exit code %s), restarting in %.1f s', index,
+                                   process.exitcode, self.restart_delay)
+                elif now - self._died[index] >= self.restart_delay:
+                    self._collect()
+                    with self._lock:
+                        for name, value in self._counters[index].items():
+                            self._retired[name] += value
+                        self._counters[index] = dict.fromkeys(SERVICE_COUNTERS, 0)
+                        self.restarts += 1
+                    self._start_instance(index)
+
+    def _collect(self, timeout: float = None) -> None:
+        """Reads the counters reported by the instances"""
+        try:
+            index, counters = self._stats.get(timeout=timeout) if timeout else self._stats.get_nowait()
+            while True:
+                with self._lock:
+                    self._counters[index] = counters
+                index, counters = self._stats.get_nowait()
+        except queue.Empty:
+            pass
+
+    def stats(self) -> dict:
+        """Returns the totals of the counters of the instances, the number of restarts and the messages per second
+
+        The throughput is computed over the time since the previous call.
+        """
+        with self._lock:
+            totals = dict(self._retired)
+            for counters in self._counters:
+                for name, value in counters.items():
+                    totals[name] += value
+            now = time.monotonic()
+            if self._rate_time is not None and now > self._rate_time:
+                self.messages_per_second = (totals['messages_received'] - self._rate_received) / (now - self._rate_time)
+            self._rate_time = now
+            self._rate_received = totals['messages_received']
+        totals['messages_per_second'] = self.messages_per_second
+        totals['instances'] = sum(1 for process in self._processes if process is not None and process.is_alive())
+        totals['restarts'] = self.restarts
+        return totals
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stops the instances (they write their queued documents first) and collects their final counters"""
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    logger.error('Ingest instance %s did not stop, terminating it', process.name)
+                    process.terminate()
+                    process.join()
+        self._stopped.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+        self._collect()
@@ -0,0 +1,170 @@
+"""
+Specifies how the telemetry messages received from the MQTT broker are decoded.
+
+.. module:: telemetry
+    :synopsis: module defining the decoding and validation of telemetry messages.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# Keys of a valid telemetry message (no other key is allowed)
+MESSAGE_KEYS = frozenset(['context', 'value', 'datastream_name'])
+
+# Backends decoding the JSON payloads
+DECODER_BACKENDS = ('json', 'orjson', 'msgspec')
+
+# Maximum number of topics whose device id is cached by a decoder
+TOPIC_CACHE_SIZE = 65536
+
+
+if msgspec is not None:
+    class TelemetryMessage(msgspec.Struct, forbid_unknown_fields=True):
+        """Defines the payload of a telemetry message, validated by msgspec while it is decoded"""
+        context: Any
+        datastream_name: Any
+        value: Any
+
+
+class Telemetry:
+    """Defines a decoded telemetry message.
+
+    :param tstamp: date and time that the message was received
+    :param device_id: id of the device (from the topic)
+    :param datastream_name: name of the datastream
+    :param value: value of the reading
+    :param context: context of the reading (such as the position of the device)
+    """
+    __slots__ = ('tstamp', 'device_id', 'datastream_name', 'value', 'context')
+
+    def __init__(self, tstamp: datetime, device_id: str, datastream_name: str, value, context) -> None:
+        self.tstamp = tstamp
+        self.device_id = device_id
+        self.datastream_name = datastream_name
+        self.value = value
+        self.context = context
+
+    def __repr__(self):
+        return f'Telemetry({self.device_id}/{self.datastream_name}={self.value!r} at {self.tstamp})'
+
+    def __eq__(self, other):
+        if not isinstance(other, Telemetry):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def as_document(self) -> dict:
+        """Returns the document storing the message in MongoDB"""
+        return {'tstamp': self.tstamp, 'device_id': self.device_id, 'value': self.value, 'context': self.context,
+                'datastream_name': self.datastream_name}
+
+
+def as_document(telemetry) -> dict:
+    """Returns the document of a decoded message (a Telemetry record, or already a document)"""
+    return telemetry.as_document() if isinstance(telemetry, Telemetry) else telemetry
+
+
+def topic_device_id(topic: str) -> str:
+    """Returns the device id of a topic such as "telemetry/<device_id>/<datastream_name>", or None if it has none"""
+    start = topic.find('/') + 1
+    if start == 0:
+        return None
+    end = topic.find('/', start)
+    return topic[start:] if end < 0 else topic[start:end]
+
+
+class TelemetryDecoder:
+    """Defines a decoder of the telemetry messages, returning Telemetry records.
+
+    A telemetry message is published to "telemetry/<device_id>/<datastream_name>" with a JSON
+    payload such as:
+        {"context": {"latitude": "12.3", ...}, "datastream_name": "temp", "value": "21.5"}
+
+    The payload is decoded with the standard json module, with orjson, or with msgspec (which
+    validates the keys of the message while decoding it).  The keys are otherwise compared to
+    MESSAGE_KEYS as a set, without building and sorting lists.  The device ids of the topics are
+    cached, up to `cache_size` topics (least recently used first out).
+
+    :param backend: backend decoding the JSON payloads, one of DECODER_BACKENDS
+    :param cache_size: maximum number of topics whose device id is cached
+    """
+    def __init__(self, backend: str = 'json', cache_size: int = TOPIC_CACHE_SIZE) -> None:
+        if backend not in DECODER_BACKENDS:
+            raise ValueError(f'Unknown decoder backend: {backend}')
+        if backend == 'orjson' and orjson is None:
+            raise ImportError('The orjson backend requires orjson')
+        if backend == 'msgspec' and msgspec is None:
+            raise ImportError('The msgspec backend requires msgspec')
+        self.backend = backend
+        self.cache_size = cache_size
+        self._setup()
+
+    def _setup(self) -> None:
+        self.device_id = lru_cache(maxsize=self.cache_size)(topic_device_id)
+        if self.backend == 'msgspec':
+            self._decode = self._decode_msgspec
+            self._loads = msgspec.json.Decoder(TelemetryMessage).decode
+            self._errors = (msgspec.DecodeError,)
+        else:
+            self._decode = self._decode_dict
+            self._loads = orjson.loads if self.backend == 'orjson' else json.loads
+            self._errors = (ValueError,)
+
+    def __repr__(self):
+        return f'TelemetryDecoder({self.backend}, {self.device_id.cache_info()})'
+
+    def __getstate__(self):
+        # The cache and the msgspec decoder are created again (such as in a worker process)
+        return {'backend': self.backend, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    def __call__(self, topic: str, payload: bytes, received: datetime) -> Telemetry:
+        """Returns the record of a telemetry message, or None if the message is not valid
+
+        :param topic: topic that the message was published to
+        :param payload: payload (JSON) of the message
+        :param received: date and time that the message was received
+        """
+        try:
+            fields = self._decode(payload)
+        except self._errors:
+            return None
+        if fields is None:
+            return None
+        datastream_name, value, context = fields
+        if datastream_name == '' or value == '':
+            return None
+        device_id = self.device_id(topic)
+        if device_id is None:
+            return None
+        return Telemetry(received, device_id, datastream_name, value, context)
+
+    def _decode_dict(self, payload: bytes) -> tuple:
+        message = self._loads(payload)
+        if type(message) is not dict or message.keys() != MESSAGE_KEYS:
+            return None
+        return message['datastream_name'], message['value'], message['context']
+
+    def _decode_msgspec(self, payload: bytes) -> tuple:
+        message = self._loads(payload)
+        return message.datastream_name, message.value, message.context
+
+
+# Decoder of the telemetry messages with the standard json module
+decode_telemetry = TelemetryDecoder()
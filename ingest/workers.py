@@ -0,0 +1,217 @@
+"""
+Specifies the workers that decode, validate and store the messages received from the MQTT broker.
+
+.. module:: workers
+    :synopsis: module defining a pool of ingest workers (threads or processes) fed by a queue.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from datetime import datetime
+
+from .telemetry import decode_telemetry
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum number of received messages waiting for a worker
+DEFAULT_MAX_QUEUE = 100000
+
+# Number of messages taken from the queue by a worker process at a time
+PROCESS_BATCH_SIZE = 256
+
+# Maximum number of seconds that a message waits for its batch to be sent to a worker process
+PROCESS_BATCH_DELAY = 0.1
+
+# Maximum number of seconds that the MQTT callback waits for room in the queue before dropping the message
+# (0 never holds up the network loop of the client)
+DEFAULT_PUT_TIMEOUT = 0.0
+
+# Minimum number of seconds between the warnings about the messages dropped
+DROP_WARNING_INTERVAL = 10.0
+
+
+def run_worker(messages, sink_factory, decode, shared_sink=None) -> tuple:
+    """Decodes and stores the messages of the queue until it yields None; returns (stored, invalid)
+
+    Each item of the queue is a list of (topic, payload, received) messages.
+
+    :param messages: queue of the lists of messages
+    :param sink_factory: function returning the sink (with `add` and `close`) that the documents are added to
+    :param decode: function returning the record (Telemetry) of a message (or None if the message is not valid)
+    :param shared_sink: sink shared by the workers (in which case `sink_factory` is not used)
+    """
+    sink = shared_sink if shared_sink is not None else sink_factory()
+    stored = invalid = 0
+    try:
+        while True:
+            batch = messages.get()
+            if batch is None:
+                break
+            for topic, payload, received in batch:
+                try:
+                    document = decode(topic, payload, received)
+                except Exception:
+                    logger.exception('Decoding Exception: %s', topic)
+                    document = None
+                if document is None:
+                    invalid += 1
+                elif sink.add(document):
+                    stored += 1
+    finally:
+        if shared_sink is None:
+            sink.close()
+    return stored, invalid
+
+
+def _run_worker_process(messages, results, sink_factory, decode) -> None:
+    results.put(run_worker(messages, sink_factory, decode))
+
+
+class IngestWorkers:
+    """Defines a pool of workers decoding, validating and storing the received messages.
+
+    The MQTT callback only puts the raw (topic, payload, received) message in a bounded queue,
+    so that the network loop of the client is not held up by decoding or by the database.  The
+    workers take the messages from the queue, decode them and add the documents to a sink (such
+    as a `WriteBehindBuffer`).
+
+    With threads, the workers share a single sink.  With processes, decoding uses several cores;
+    each process then creates its own sink with `sink_factory` (a database client cannot be
+    shared between processes), and the messages are sent to the processes in batches (of up to
+    PROCESS_BATCH_SIZE messages, sent at least every PROCESS_BATCH_DELAY seconds).
+
+    :param sink_factory: function returning the sink (with `add` and `close`) that the documents are added to;
+                         it must be picklable (such as a module-level function or a `functools.partial`)
+                         when using processes
+    :param workers: number of worker threads or processes
+    :param processes: flag indicating if the workers are processes (instead of threads)
+    :param max_queue: maximum number of messages waiting for a worker; putting a message waits while the
+                      queue is full (up to its timeout, such as DEFAULT_PUT_TIMEOUT in the MQTT callback)
+    :param decode: function returning the record (Telemetry) of a message, or None if the message is not valid
+    """
+    def __init__(self, sink_factory, workers: int = 4, processes: bool = False, max_queue: int = DEFAULT_MAX_QUEUE,
+                 decode=decode_telemetry) -> None:
+        self.sink_factory = sink_factory
+        self.workers = workers
+        self.processes = processes
+        self.decode = decode
+        self.messages_received = 0
+        self.messages_dropped = 0
+        self.messages_stored = 0
+        self.messages_invalid = 0
+        self._next_drop_warning = 0.0
+        self._batch_size = PROCESS_BATCH_SIZE if processes else 1
+        self._pending = []
+        self._lock = threading.Lock()
+        self._shared_sink = None
+        self._workers = []
+        self._stopped = threading.Event()
+        self._flusher = None
+        if processes:
+            self._queue = multiprocessing.Queue(max(1, max_queue // self._batch_size))
+            self._results = multiprocessing.Queue()
+        else:
+            self._queue = queue.Queue(max_queue)
+            self._results = queue.Queue()
+
+    def __repr__(self):
+        kind = 'processes' if self.processes else 'threads'
+        return f'IngestWorkers({self.workers} {kind}, received={self.messages_received})'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self) -> None:
+        """Starts the workers"""
+        if self.processes:
+            for index in range(self.workers):
+                worker = multiprocessing.Process(target=_run_worker_process, name=f'ingest-{index}', daemon=True,
+                                                 args=(self._queue, self._results, self.sink_factory, self.decode))
+                worker.start()
+                self._workers.append(worker)
+            self._stopped.clear()
+            self._flusher = threading.Thread(target=self._run_flusher, name='ingest-flusher', daemon=True)
+            self._flusher.start()
+        else:
+            self._shared_sink = self.sink_factory()
+            for index in range(self.workers):
+                worker = threading.Thread(target=self._run_worker_thread, name=f'ingest-{index}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _run_flusher(self) -> None:
+        while not self._stopped.wait(PROCESS_BATCH_DELAY):
+            self.flush()
+
+    def _run_worker_thread(self) -> None:
+        self._results.put(run_worker(self._queue, self.sink_factory, self.decode, self._shared_sink))
+
+    def put(self, topic: str, payload: bytes, received: datetime = None, timeout: float = None) -> bool:
+        """Queues a received message for the workers
+
+        :param topic: topic that the message was published to
+        :param payload: payload of the message
+        :param received: date and time that the message was received (now if None)
+        :param timeout: maximum number of seconds to wait while the queue is full (None to wait until there is room)
+        :return: True if the message was queued, False if it was dropped because the queue stayed full
+        """
+        message = (topic, payload, received or datetime.now())
+        with self._lock:
+            self.messages_received += 1
+            self._pending.append(message)
+            if len(self._pending) < self._batch_size:
+                return True
+            batch, self._pending = self._pending, []
+        return self._put_batch(batch, timeout)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Queues the messages waiting to fill a batch (with processes)"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return not batch or self._put_batch(batch, timeout)
+
+    def _put_batch(self, batch: list, timeout: float = None) -> bool:
+        try:
+            self._queue.put(batch, timeout=timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.messages_dropped += len(batch)
+                dropped = self.messages_dropped
+                now = time.monotonic()
+                warn = now >= self._next_drop_warning
+                if warn:
+                    self._next_drop_warning = now + DROP_WARNING_INTERVAL
+            if warn:
+                logger.warning('Dropped %d messages so far: the queue of the workers is full', dropped)
+            return False
+
+    def close(self) -> None:
+        """Processes all the queued messages, stops the workers and closes the sinks"""
+        if self._flusher is not None:
+            self._stopped.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        for _ in self._workers:
+            self._queue.put(None)
+        for _ in self._workers:
+            stored, invalid = self._results.get()
+            self.messages_stored += stored
+            self.messages_invalid += invalid
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        if self._shared_sink is not None:
+            self._shared_sink.close()
+            self._shared_sink = None
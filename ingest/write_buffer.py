@@ -0,0 +1,271 @@
+"""
+Specifies the buffer that the telemetry documents are written to MongoDB through.
+
+.. module:: write_buffer
+    :synopsis: module defining a write-behind buffer flushing documents with bulk inserts.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import logging
+import time
+from collections import deque
+from threading import Condition, Thread
+
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .spool import SpoolFull, open_spool
+from .storage import IDEMPOTENT_STORAGE_MODES, document_id, documents_written, only_duplicate_keys, open_storage
+from .telemetry import as_document
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of documents written by each bulk insert
+DEFAULT_BATCH_SIZE = 1000
+
+# Maximum number of seconds that a document waits in the buffer before it is written
+DEFAULT_MAX_DELAY = 1.0
+
+# Maximum number of documents held in the buffer; adding a document waits while the buffer is full
+DEFAULT_MAX_PENDING = 100000
+
+# Number of seconds between the attempts to replay the spool while the database is down
+REPLAY_INTERVAL = 5.0
+
+
+class WriteBehindBuffer:
+    """Defines a buffer of documents, written to a collection in the background with bulk inserts.
+
+    Documents are added to the buffer without waiting for the database: a background thread writes
+    them with `insert_many(ordered=False)` whenever `batch_size` documents are waiting, or when the
+    oldest document has waited for `max_delay` seconds.  A failed document (such as a duplicate
+    _id) does not prevent the other documents of its batch from being written.
+
+    The buffer holds at most `max_pending` documents: when it is full, `add` waits for the
+    background thread to write a batch (backpressure), so the memory used stays bounded when the
+    database is slower than the documents arrive.  Closing the buffer writes all of its documents.
+
+    If a batch cannot be written at all (such as when the database is down), the documents are
+    passed to `on_error` if specified, or else dropped, and the error is logged.
+
+    With a `spool`, such a batch is appended to the spool on disk instead, as are the documents
+    added while the buffer is full (rather than waiting); the spool is replayed in the background,
+    a batch at a time between the new batches, once the database accepts writes again.  The
+    documents are given deterministic _ids before they are spooled, so replaying a batch that
+    was partly written does not store its documents twice.
+
+    This class is safe to use from several threads.
+
+    :param collection: collection that the documents are written to
+    :param batch_size: number of documents written by each bulk insert
+    :param max_delay: maximum number of seconds that a document waits before it is written
+    :param max_pending: maximum number of documents held in the buffer
+    :param on_error: function called with the documents and the exception when a batch fails
+    :param spool: spool (see `spool.Spool`) holding the documents that cannot be written or held in memory
+    """
+    def __init__(self, collection, batch_size: int = DEFAULT_BATCH_SIZE, max_delay: float = DEFAULT_MAX_DELAY,
+                 max_pending: int = DEFAULT_MAX_PENDING, on_error=None, spool=None) -> None:
+        self.collection = collection
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, batch_size)
+        self.on_error = on_error
+        self.spool = spool
+        self.documents_added = 0
+        self.documents_written = 0
+        self.documents_failed = 0
+        self.documents_rejected = 0
+        self.batches_written = 0
+        self.documents_spooled = 0
+        self.documents_replayed = 0
+        self._next_replay = time.monotonic()
+        self._documents = deque()
+        self._oldest_time = None
+        self._writing = 0
+        self._flushing = 0
+        self._closed = False
+        self._condition = Condition()
+        self._thread = Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return (f'WriteBehindBuffer(pending={len(self._documents)}, written={self.documents_written}, '
+                f'failed={self.documents_failed})')
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, document: dict, timeout: float = None) -> bool:
+        """Adds a document to the buffer, waiting while the buffer is full
+
+        :param document: document to write to the collection
+        :param timeout: maximum number of seconds to wait while the buffer is full (None to wait until there is room)
+        :return: True if the document was added, False if the buffer stayed full (or is closed)
+        """
+        with self._condition:
+            if self.spool is not None and not self._closed and len(self._documents) >= self.max_pending:
+                if self._spool([document]):
+                    self.documents_added += 1
+                    return True
+            if not self._condition.wait_for(lambda: self._closed or len(self._documents) < self.max_pending,
+                                            timeout) or self._closed:
+                self.documents_rejected += 1
+                return False
+            if not self._documents:
+                self._oldest_time = time.monotonic()
+            self._documents.append(document)
+            self.documents_added += 1
+            if len(self._documents) == 1 or len(self._documents) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until all the documents added so far are written; returns False if the timeout expired"""
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                return self._condition.wait_for(lambda: not self._documents and not self._writing, timeout)
+            finally:
+                self._flushing -= 1
+
+    def close(self) -> None:
+        """Writes all the documents in the buffer, stops the background thread and closes the spool
+
+        The documents left in the spool are replayed by the next buffer using it.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        if self.spool is not None:
+            self.spool.close()
+
+    def _ready(self) -> bool:
+        if not self._documents:
+            return self._closed
+        return (self._closed or self._flushing > 0 or len(self._documents) >= self.batch_size
+                or time.monotonic() - self._oldest_time >= self.max_delay)
+
+    def _wait_time(self):
+        waits = []
+        if self._documents:
+            waits.append(self._oldest_time + self.max_delay)
+        if self.spool is not None and self.spool.pending:
+            waits.append(self._next_replay)
+        return max(0.0, min(waits) - time.monotonic()) if waits else None
+
+    def _replay_due(self) -> bool:
+        return (self.spool is not None and not self._closed and self.spool.pending > 0
+                and time.monotonic() >= self._next_replay)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._ready():
+                    if self._replay_due():
+                        break
+                    self._condition.wait(self._wait_time())
+                if self._closed and not self._documents:
+                    return
+                if not self._ready():
+                    batch = None
+                else:
+                    batch = [self._documents.popleft() for _ in range(min(self.batch_size, len(self._documents)))]
+                    if not self._documents:
+                        self._oldest_time = None
+                self._writing += 1
+                # Documents can be added again
+                self._condition.notify_all()
+
+            try:
+                if batch is None:
+                    self._replay()
+                else:
+                    self._write(batch)
+            finally:
+                with self._condition:
+                    self._writing -= 1
+                    self._condition.notify_all()
+
+    def _write(self, batch: list) -> None:
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            written = len(batch)
+        except BulkWriteError as exception:
+            written = documents_written(exception)
+            logger.warning('Bulk insert of %d documents: %d errors (first: %s)', len(batch),
+                           len(exception.details.get('writeErrors', [])),
+                           (exception.details.get('writeErrors') or [{}])[0].get('errmsg'))
+        except PyMongoError as exception:
+            logger.error('Bulk insert of %d documents failed: %s', len(batch), exception)
+            if self._spool(batch):
+                self._next_replay = time.monotonic() + REPLAY_INTERVAL
+                return
+            self.documents_failed += len(batch)
+            if self.on_error is not None:
+                self.on_error(batch, exception)
+            return
+
+        self.documents_written += written
+        self.documents_failed += len(batch) - written
+        self.batches_written += 1
+
+    def _spool(self, batch: list) -> bool:
+        """Appends documents to the spool; returns False if there is no spool, or it is full"""
+        if self.spool is None:
+            return False
+        documents = []
+        for document in map(as_document, batch):
+            if '_id' not in document:
+                document['_id'] = document_id(document)
+            documents.append(document)
+        try:
+            self.documents_spooled += self.spool.append(documents)
+            return True
+        except SpoolFull as exception:
+            logger.error('%s', exception)
+            return False
+
+    def _replay(self) -> None:
+        """Writes a batch of the spool (documents that were written already are skipped)"""
+        try:
+            self.documents_replayed += self.spool.replay(self._write_replayed, self.batch_size, max_batches=1)
+        except PyMongoError as exception:
+            logger.warning('Replay of the spool failed: %s', exception)
+            self._next_replay = time.monotonic() + REPLAY_INTERVAL
+
+    def _write_replayed(self, batch: list) -> None:
+        try:
+            self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as exception:
+            if not only_duplicate_keys(exception):
+                raise
+
+
+def open_write_buffer(uri: str, database: str, collection: str, storage: str = 'documents', spool: str = None,
+                      spool_options: dict = None, **options) -> WriteBehindBuffer:
+    """Returns a write-behind buffer to a collection of a new MongoDB client (such as in a worker process)
+
+    :param uri: URI (or host:port) of the MongoDB server
+    :param database: name of the database
+    :param collection: name of the collection
+    :param storage: storage mode of the telemetry (see `storage.STORAGE_MODES`)
+    :param spool: directory of the spools (see `spool.open_spool`), or None not to spool the documents; the
+                  storage must be one of IDEMPOTENT_STORAGE_MODES (replaying the spool writes batches again)
+    :param spool_options: options of the spool (segment_size, max_bytes)
+    :param options: options of the buffer (batch_size, max_delay, max_pending, on_error)
+    """
+    if spool is not None and storage not in IDEMPOTENT_STORAGE_MODES:
+        raise ValueError(f'The {storage} storage cannot be spooled (its writes are not idempotent)')
+    if spool is not None:
+        options['spool'] = open_spool(spool, **(spool_options or {}))
+    return WriteBehindBuffer(open_storage(MongoClient(uri)[database], collection, storage), **options)
@@ -0,0 +1,45 @@
+import argparse
+import logging
+from bson import ObjectId
+from pymongo import MongoClient
+from ingest.storage import STORAGE_MODES, MIGRATION_BATCH_SIZE, migrate, open_storage
+
+
+################
+#  PARAMETERS  #
+################
+
+MONGODB_URI = 'mongodb://127.0.0.1:27017'
+DATABASE = 'mqtt_data'
+SOURCE_COLLECTION = 'Data'
+
+
+###################
+#  MAIN FUNCTION  #
+###################
+
+parser = argparse.ArgumentParser(description='Copies the telemetry of mqtt_data.Data (one document per reading) '
+                                             'to hourly buckets or to a time-series collection.')
+parser.add_argument('target', help='name of the collection that the telemetry is copied to')
+parser.add_argument('--storage', choices=STORAGE_MODES, default='buckets', help='storage of the copied telemetry')
+parser.add_argument('--uri', default=MONGODB_URI, help='URI of the MongoDB server')
+parser.add_argument('--database', default=DATABASE, help='name of the database')
+parser.add_argument('--source', default=SOURCE_COLLECTION, help='name of the collection of the readings')
+parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE,
+                    help='number of documents read and written at a time')
+parser.add_argument('--start-after', default=None,
+                    help='_id of the last document already copied (printed during the migration), to resume it')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+if args.target == args.source:
+    parser.error('the target collection must differ from the source collection')
+
+database = MongoClient(args.uri)[args.database]
+storage = open_storage(database, args.target, args.storage)
+start_after = ObjectId(args.start_after) if args.start_after else None
+
+migrated, last_id = migrate(database[args.source], storage, batch_size=args.batch_size, start_after=start_after,
+                            progress=lambda count, last: print("Copied %d documents (last _id: %s)" % (count, last)))
+print("Copied %d documents from %s to %s (%s)" % (migrated, args.source, args.target, args.storage))
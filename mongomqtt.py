@@ -1,12 +1,21 @@
 import paho.mqtt.client as mqtt
 from datetime import datetime
-import json, uuid
+import argparse
+import json, logging, uuid
 from pymongo import MongoClient
 from ast import literal_eval
 from flask import Flask
 from mongoalchemy.document import Document
 from mongoalchemy.fields import *
 #from flask_cqlalchemy import CQLAlchemy
+from functools import partial
+from ingest.workers import IngestWorkers, DEFAULT_MAX_QUEUE, DEFAULT_PUT_TIMEOUT
+from ingest.write_buffer import open_write_buffer, DEFAULT_BATCH_SIZE, DEFAULT_MAX_DELAY, DEFAULT_MAX_PENDING
+from ingest.storage import STORAGE_MODES, IDEMPOTENT_STORAGE_MODES
+from ingest.telemetry import DECODER_BACKENDS, TelemetryDecoder
+import asyncio, signal, sys
+from ingest.rollups import open_rollup_sink, DEFAULT_FLUSH_INTERVAL
+import time
 
 class Data(Document):
 
@@ -18,34 +27,15 @@ class Data(Document):
         datastream_name = StringField(required=True, default='')
 
 
-def on_connect(client, userdata, rc):
+def on_connect(client, userdata, flags, rc):
         print("Connected with result code " + str(rc))
         client.subscribe("#")
 
-def on_message(client, userdata, msg):
-        tstamp=datetime.now()#.isoformat()
-#       print msg.payload
-        try:
-                message = json.loads(msg.payload)
-        except ValueError:
-                return
-        if sorted(["context", "value", "datastream_name"]) != sorted(message.keys()):
-                return
-        device_id = msg.topic.split("/")[1]
-        context = message["context"]
-        value = message["value"]
-        datastream_name = message["datastream_name"]
-        if datastream_name == "" or value == "":
-                return
-
-        #print(str(receiveTime) + ": " + msg.topic + " " + message)
-#       db.sync_db()
-        #Datas.create(value=value, device_id=device_id, tstamp=tstamp, latitude=context["latitude"], longitude=context["longitude"], elevation=context["elevation"])
-#       data.save()
-        post={"tstamp":tstamp, "device_id":device_id, "value":value, "context":context, "datastream_name":datastream_name}
-        #print post
-        collection.insert(post)
-        #session.save(Data(**post))
+def on_message(client, workers, msg):
+        # Only queue the raw message: the workers decode, validate and store it.  This runs in the
+        # network thread of paho, so it never waits long for room in the queue: the message is
+        # dropped (and counted) instead
+        workers.put(msg.topic, msg.payload, datetime.now(), timeout=args.put_timeout)
 
 
 
@@ -55,19 +45,149 @@ session = Session.connect('mqtt_data', host='mongodb://127.0.0.1:27017/mqtt_data
 #print "Connected to DB"
 
 
-# Set up client for MongoDB
-mongoClient=MongoClient("127.0.0.1:27017")
-db=mongoClient.mqtt_data
-collection=db.Data
-print "Connected to DB"
+parser = argparse.ArgumentParser(description='Stores the telemetry messages of the MQTT broker in MongoDB.')
+parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                    help='number of documents written by each bulk insert')
+parser.add_argument('--max-delay', type=float, default=DEFAULT_MAX_DELAY,
+                    help='maximum number of seconds that a message waits before it is written')
+parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                    help='maximum number of messages waiting to be written')
+parser.add_argument('--workers', type=int, default=4, help='number of workers decoding and storing the messages')
+parser.add_argument('--processes', action='store_true', help='run the workers in processes instead of threads')
+parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                    help='maximum number of received messages waiting for a worker')
+parser.add_argument('--put-timeout', type=float, default=DEFAULT_PUT_TIMEOUT,
+                    help='maximum number of seconds that a received message waits for room in the queue of the '
+                         'workers before it is dropped')
+parser.add_argument('--storage', choices=STORAGE_MODES, default='documents',
+                    help='storage of the telemetry: one document per reading, hourly buckets per device and '
+                         'datastream, or a time-series collection (MongoDB 5.0+)')
+parser.add_argument('--spool', default=None,
+                    help='directory of the on-disk spool holding the messages while MongoDB is slow or down')
+parser.add_argument('--spool-size', type=int, default=1024,
+                    help='maximum disk space used by the spool of each worker, in MB')
+parser.add_argument('--rollups', action='store_true',
+                    help='keep the count, min, max and mean per device and datastream at 1 minute and 1 hour, '
+                         'in the Data_rollup_1m and Data_rollup_1h collections')
+parser.add_argument('--rollup-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+                    help='number of seconds between the writes of the rollups')
+parser.add_argument('--decoder', choices=DECODER_BACKENDS, default='json',
+                    help='backend decoding the JSON payloads (orjson and msgspec are faster)')
+parser.add_argument('--asyncio', action='store_true',
+                    help='run an asyncio service (aiomqtt and motor, Python 3.8+) instead of the paho client and the '
+                         'workers')
+parser.add_argument('--concurrency', type=int, default=None,
+                    help='number of bulk writes in flight at the same time (with --asyncio)')
+parser.add_argument('--pool-size', type=int, default=None,
+                    help='maximum number of connections to MongoDB (with --asyncio)')
+parser.add_argument('--instances', type=int, default=1,
+                    help='number of processes running the asyncio service, monitored by a supervisor')
+parser.add_argument('--partitioning', choices=['shared', 'hash'], default='shared',
+                    help='how the instances share the messages: an MQTT v5 shared subscription, or each instance '
+                         'receiving all of the messages and storing those of its partition of the devices')
+parser.add_argument('--stats-interval', type=float, default=None,
+                    help='number of seconds between the throughput reports of the instances')
+args = parser.parse_args()
+if args.spool is not None and args.storage not in IDEMPOTENT_STORAGE_MODES:
+        parser.error('--spool requires --storage %s' % ' or '.join(IDEMPOTENT_STORAGE_MODES))
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+if args.asyncio:
+        # The asyncio service needs Python 3.8+ (and aiomqtt and motor): it is only imported when it is used,
+        # so the paho client and the workers keep running on Python 3.6
+        if sys.version_info < (3, 8):
+                parser.error('--asyncio requires Python 3.8 or later')
+        from ingest.async_service import AsyncIngestService, mqtt_connector, open_async_rollups, \
+                open_async_storage, shared_subscription, DEFAULT_CONCURRENCY, DEFAULT_POOL_SIZE
+        from ingest.supervisor import Supervisor, DEFAULT_STATS_INTERVAL
+        if args.concurrency is None:
+                args.concurrency = DEFAULT_CONCURRENCY
+        if args.pool_size is None:
+                args.pool_size = DEFAULT_POOL_SIZE
+        if args.stats_interval is None:
+                args.stats_interval = DEFAULT_STATS_INTERVAL
+
+
+async def create_service(index=0, instances=1):
+        # Asyncio service: one task receives the messages, the writes share the connection pool of motor
+        storage = await open_async_storage("127.0.0.1:27017", "mqtt_data", "Data", storage=args.storage,
+                                           pool_size=args.pool_size)
+        # The rollups create their indexes (with pymongo) in a thread, not on the event loop
+        rollups = await open_async_rollups("127.0.0.1:27017", "mqtt_data", "Data",
+                                           flush_interval=args.rollup_interval) if args.rollups else None
+        shared = instances > 1 and args.partitioning == 'shared'
+        return AsyncIngestService(mqtt_connector("127.0.0.1", 1883, "user1", "password", mqtt5=shared), storage,
+                                  topic=shared_subscription("#", "ingest") if shared else "#",
+                                  partition=(index, instances) if instances > 1 and not shared else None,
+                                  concurrency=args.concurrency, batch_size=args.batch_size,
+                                  max_delay=args.max_delay, max_queue=args.max_queue,
+                                  decode=TelemetryDecoder(args.decoder), rollups=rollups)
+
+async def run_service():
+        service = await create_service()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, service.stop)
+        await service.run()
+        print("Received %d messages: %d stored, %d invalid, %d failed, %d reconnects" % (
+                service.messages_received, service.documents_written, service.messages_invalid,
+                service.documents_failed, service.reconnects))
+
+def run_supervisor():
+        # Instances of the asyncio service, one per process, restarted if they stop
+        supervisor = Supervisor(create_service, instances=args.instances, stats_interval=args.stats_interval)
+        supervisor.start()
+        try:
+                while True:
+                        time.sleep(args.stats_interval)
+                        stats = supervisor.stats()
+                        print("%d instances: %.0f messages/s, %d received, %d stored, %d failed, %d restarts" % (
+                                stats['instances'], stats['messages_per_second'], stats['messages_received'],
+                                stats['documents_written'], stats['documents_failed'], stats['restarts']))
+        except KeyboardInterrupt:
+                pass
+        finally:
+                supervisor.stop()
+                stats = supervisor.stats()
+                print("Received %d messages: %d stored, %d invalid, %d failed, %d restarts" % (
+                        stats['messages_received'], stats['documents_written'], stats['messages_invalid'],
+                        stats['documents_failed'], stats['restarts']))
+
+if args.asyncio and args.instances > 1:
+        run_supervisor()
+        raise SystemExit(0)
+if args.asyncio:
+        asyncio.run(run_service())
+        raise SystemExit(0)
+
+# Workers decoding the messages and writing them to MongoDB in bulk (each worker process
+# has its own client for MongoDB; worker threads share a single buffer)
+sink_factory = partial(open_write_buffer, "127.0.0.1:27017", "mqtt_data", "Data", storage=args.storage,
+                       spool=args.spool, spool_options={'max_bytes': args.spool_size * 1024 * 1024},
+                       batch_size=args.batch_size, max_delay=args.max_delay, max_pending=args.max_pending)
+if args.rollups:
+        sink_factory = partial(open_rollup_sink, sink_factory, "127.0.0.1:27017", "mqtt_data", "Data",
+                               flush_interval=args.rollup_interval)
+workers = IngestWorkers(sink_factory, workers=args.workers, processes=args.processes, max_queue=args.max_queue,
+                        decode=TelemetryDecoder(args.decoder))
+workers.start()
+print("Connected to DB")
 
 # Initialize the client that should connect to the Mosquitto broker
-client = mqtt.Client()
+client = mqtt.Client(userdata=workers)
 client.on_connect = on_connect
 client.on_message = on_message
 client.username_pw_set("user1", "password")
 client.connect("127.0.0.1", 1883, 60)
 
-# Blocking loop to the Mosquitto broker
-client.loop_forever()
-
+# Blocking loop to the Mosquitto broker; the queued messages are written on exit
+try:
+        client.loop_forever()
+except KeyboardInterrupt:
+        client.disconnect()
+finally:
+        workers.close()
+        print("Received %d messages: %d stored, %d invalid, %d dropped" % (
+                workers.messages_received, workers.messages_stored, workers.messages_invalid,
+                workers.messages_dropped))
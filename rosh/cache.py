@@ -0,0 +1,113 @@
+"""
+Specifies a persistent cache of the files that have been scanned in previous runs.
+
+.. module:: cache
+    :synopsis: module defining an on-disk (SQLite) cache of the scanned files.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import os
+import sqlite3
+import time
+
+
+# Version of the cache schema; a cache with a different version is rebuilt
+CACHE_SCHEMA_VERSION = 1
+
+# Default maximum number of files kept in the cache
+DEFAULT_MAX_ENTRIES = 1000000
+
+# Number of pending writes that are committed together
+WRITE_BATCH_SIZE = 1000
+
+
+class ScanCache:
+    """Defines an on-disk cache of the files scanned from the source directories.
+
+    The cache stores the date that each file was created and its file type, so that the metadata
+    of a file only needs to be extracted again if the file changed since the previous run.  Each
+    entry is keyed by the path of the file and validated against the size, the modification time
+    and the inode of the file; if any of them changed, the entry is invalid and is replaced.
+
+    The cache is limited to `max_entries` files; when it is closed, the files that were seen the
+    longest time ago are removed.
+
+    :param cache_path: path of the SQLite database file used for the cache
+    :param max_entries: maximum number of files kept in the cache
+    :param rebuild: flag indicating if the existing contents of the cache should be discarded
+    """
+    def __init__(self, cache_path: str, max_entries: int = DEFAULT_MAX_ENTRIES, rebuild: bool = False) -> None:
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pending_writes = []
+        self._pending_hits = []
+        self._connection = sqlite3.connect(cache_path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if rebuild or version != CACHE_SCHEMA_VERSION:
+            self._connection.execute('DROP TABLE IF EXISTS files')
+            self._connection.execute(f'PRAGMA user_version={CACHE_SCHEMA_VERSION}')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                                 'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, '
+                                 'date_created TEXT, file_type TEXT, last_seen REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS files_last_seen ON files (last_seen)')
+        self._connection.commit()
+
+    def __repr__(self):
+        return f'{self.cache_path}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, filename: str, stat_result: os.stat_result):
+        """Returns the cached (date_created, file_type) of the file, or None if not cached or outdated"""
+        row = self._connection.execute('SELECT size, mtime_ns, inode, date_created, file_type '
+                                       'FROM files WHERE path = ?', (filename,)).fetchone()
+        if row is None or row[:3] != (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._pending_hits.append((time.time(), filename))
+        if len(self._pending_hits) >= WRITE_BATCH_SIZE:
+            self.flush()
+        return row[3], row[4]
+
+    def store(self, filename: str, stat_result: os.stat_result, date_created: str, file_type: str) -> None:
+        """Stores the date that the file was created and its file type in the cache"""
+        self._pending_writes.append((filename, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino,
+                                     date_created, file_type, time.time()))
+        if len(self._pending_writes) >= WRITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the pending changes to the cache"""
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                         self._pending_writes)
+            self._connection.executemany('UPDATE files SET last_seen = ? WHERE path = ?', self._pending_hits)
+        self._pending_writes = []
+        self._pending_hits = []
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self) -> None:
+        """Writes the pending changes, removes the oldest files above the size limit and closes the cache"""
+        if self._connection is None:
+            return
+
+        self.flush()
+        with self._connection:
+            self._connection.execute('DELETE FROM files WHERE path IN ('
+                                     'SELECT path FROM files ORDER BY last_seen DESC LIMIT -1 OFFSET ?)',
+                                     (self.max_entries,))
+        self._connection.close()
+        self._connection = None
@@ -0,0 +1,160 @@
+"""
+Specifies the backend used to copy the contents of a file to its destination.
+
+.. module:: copy_backend
+    :synopsis: module defining a copy backend using in-kernel copies and reflinks when available.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# ioctl request to clone (reflink) a file on filesystems such as btrfs and XFS (FICLONE from linux/fs.h)
+FICLONE = 0x40049409
+
+# Size of the buffer used by the buffered copy (and of each in-kernel copy request)
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Errors indicating that a copy strategy is not supported for the source and destination files,
+# so the next copy strategy should be tried
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL,
+                      errno.ENOTTY, errno.EBADF, errno.ETXTBSY, errno.EPERM}
+
+# Errors indicating that a copy strategy is not supported at all (by the operating system)
+UNAVAILABLE_ERRNOS = {errno.ENOSYS}
+
+
+def copy_with_copy_file_range(source_fd: int, destination_fd: int, size: int) -> None:
+    """Copies the file within the kernel with copy_file_range (Linux 4.5+)"""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(source_fd, destination_fd, min(COPY_BUFFER_SIZE, size - offset),
+                                    offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+    if offset < size:
+        raise OSError(errno.EINVAL, 'copy_file_range copied fewer bytes than the size of the file')
+
+
+def copy_with_sendfile(source_fd: int, destination_fd: int, size: int) -> None:
+    """Copies the file within the kernel with sendfile (Linux 2.6.33+ for regular files)"""
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, 'sendfile is not available')
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(destination_fd, source_fd, offset, min(COPY_BUFFER_SIZE, size - offset))
+        if sent == 0:
+            break
+        offset += sent
+    if offset < size:
+        raise OSError(errno.EINVAL, 'sendfile copied fewer bytes than the size of the file')
+
+
+def copy_with_reflink(source_fd: int, destination_fd: int, size: int) -> None:
+    """Clones the file (the copy shares the data blocks of the source) on btrfs and XFS"""
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'ioctl is not available')
+    fcntl.ioctl(destination_fd, FICLONE, source_fd)
+
+
+def copy_with_buffer(source_fd: int, destination_fd: int, size: int) -> None:
+    """Copies the file through a large buffer in userspace"""
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(source_fd, 'rb', buffering=0, closefd=False) as source, \
+            open(destination_fd, 'wb', buffering=0, closefd=False) as destination:
+        while True:
+            read = source.readinto(buffer)
+            if not read:
+                break
+            written = 0
+            while written < read:
+                written += destination.write(view[written:read])
+
+
+# Copy strategies in the order that they are tried by default
+COPY_STRATEGIES = {
+    'copy_file_range': copy_with_copy_file_range,
+    'sendfile': copy_with_sendfile,
+    'reflink': copy_with_reflink,
+    'buffered': copy_with_buffer,
+}
+
+
+class CopyBackend:
+    """Defines how the contents of a file are copied to the destination.
+
+    The copy strategies are tried in order until one of them succeeds: a strategy that is not
+    supported for the source and destination (such as an in-kernel copy between filesystems, or a
+    reflink on a filesystem without reflinks) falls back to the next strategy.  A strategy that is
+    not available on this system is not tried again.
+
+    As with `shutil.copy2`, the permission bits, the access and modification times and the flags
+    of the source file are copied to the destination after the contents.
+
+    :param strategies: names of the copy strategies (from COPY_STRATEGIES) to try, in order
+    """
+    def __init__(self, strategies=None) -> None:
+        self.strategies = list(strategies or COPY_STRATEGIES)
+        for strategy in self.strategies:
+            if strategy not in COPY_STRATEGIES:
+                raise ValueError(f'Unknown copy strategy: {strategy}')
+        self._unavailable_strategies = set()
+
+    def __repr__(self):
+        return f'CopyBackend({self.strategies})'
+
+    def copy(self, source: str, destination: str) -> int:
+        """Copies the file (contents and metadata) to the destination, like `shutil.copy2`
+
+        :param source: path of the file to copy
+        :param destination: path of the new file (not of its directory)
+        :return: number of bytes copied
+        """
+        size = self._copy_contents(source, destination)[1]
+        shutil.copystat(source, destination)
+        return size
+
+    def copy_contents(self, source: str, destination: str) -> str:
+        """Copies the contents of the file to the destination; returns the name of the strategy used"""
+        return self._copy_contents(source, destination)[0]
+
+    def _copy_contents(self, source: str, destination: str) -> tuple:
+        """Copies the contents of the file to the destination; returns (strategy used, bytes copied)"""
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            source_fd = source_file.fileno()
+            destination_fd = destination_file.fileno()
+            size = os.fstat(source_fd).st_size
+
+            last_exception = None
+            for strategy in self.strategies:
+                if strategy in self._unavailable_strategies:
+                    continue
+                try:
+                    COPY_STRATEGIES[strategy](source_fd, destination_fd, size)
+                    return strategy, size
+                except OSError as exception:
+                    if exception.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    if exception.errno in UNAVAILABLE_ERRNOS:
+                        self._unavailable_strategies.add(strategy)
+                    last_exception = exception
+                    # Discard anything written by the failed strategy before trying the next one
+                    os.ftruncate(destination_fd, 0)
+                    os.lseek(destination_fd, 0, os.SEEK_SET)
+                    os.lseek(source_fd, 0, os.SEEK_SET)
+
+        raise last_exception or OSError(errno.ENOTSUP, f'No copy strategy could copy {source}')
+
+
+DEFAULT_COPY_BACKEND = CopyBackend()
@@ -0,0 +1,71 @@
+"""
+Specifies the patterns used to find the date that a file was created in its name or folder name.
+
+.. module:: date_patterns
+    :synopsis: module defining a registry of compiled date patterns for file and folder names.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import re
+from datetime import date
+
+
+# Dates outside of this range of years are considered to be numbers that are not dates
+MINIMUM_YEAR = 1990
+MAXIMUM_YEAR = date.today().year + 1
+
+# Compiled date patterns, in the order that they are tried
+DATE_PATTERNS = []
+
+
+def register_date_pattern(pattern: str, index: int = None) -> None:
+    """Adds a date pattern to the registry.
+
+    The pattern is a regular expression with the named groups 'year', 'month' and 'day'; it is
+    searched for (not only matched at the start) in the file or folder name.
+
+    :param pattern: regular expression of the date pattern
+    :param index: position of the pattern in the registry (by default, the pattern is tried last)
+    """
+    compiled_pattern = re.compile(pattern)
+    if not {'year', 'month', 'day'} <= set(compiled_pattern.groupindex):
+        raise ValueError(f'Date pattern must define the year, month and day groups: {pattern}')
+
+    if index is None:
+        DATE_PATTERNS.append(compiled_pattern)
+    else:
+        DATE_PATTERNS.insert(index, compiled_pattern)
+
+
+def parse_date(name: str) -> str:
+    """Returns the date (in format of "yyyy-mm-dd") found in the file or folder name, or '' if none"""
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(name):
+            year, month, day = int(match.group('year')), int(match.group('month')), int(match.group('day'))
+            if valid_date(year, month, day):
+                return f'{year:04d}-{month:02d}-{day:02d}'
+    return ''
+
+
+def valid_date(year: int, month: int, day: int) -> bool:
+    """Returns if the year, month and day are a valid date in the range of supported years"""
+    if not MINIMUM_YEAR <= year <= MAXIMUM_YEAR:
+        return False
+    try:
+        date(year, month, day)
+    except ValueError:
+        return False
+    return True
+
+
+# Name starting with the date, such as "2018-08-22", "2018_08_23" or "2019-05-04_12-54-13_IMG_3413.JPG"
+register_date_pattern(r'^(?P<year>\d{4})(?P<separator>[-_. ]?)(?P<month>\d{2})(?P=separator)(?P<day>\d{2})(?!\d)')
+
+# Date (yyyymmdd) embedded in the name by phones and apps, such as "IMG_20180822_123456.jpg",
+# "PXL_20230101_101010123.jpg", "VID_20190101_120000.mp4" or WhatsApp's "IMG-20190101-WA0001.jpg"
+register_date_pattern(r'(?<![0-9])(?P<year>(?:19|20)\d{2})(?P<month>[01]\d)(?P<day>[0-3]\d)(?![0-9])')
+
+# Date with separators embedded in the name, such as "Screenshot_2019-05-06-10-11-12.png",
+# "Photo 2019-05-06 10 11 12.jpg" or "signal-2020-01-01-101010.jpg"
+register_date_pattern(r'(?<![0-9])(?P<year>(?:19|20)\d{2})(?P<separator>[-_.])(?P<month>[01]\d)(?P=separator)'
+                      r'(?P<day>[0-3]\d)(?![0-9])')
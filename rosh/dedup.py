@@ -0,0 +1,187 @@
+"""
+Specifies an index of the contents of the destination directories used to detect duplicate files.
+
+.. module:: dedup
+    :synopsis: module defining a content-hash index of the files in the destination directories.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import hashlib
+import os
+from threading import RLock
+
+
+# Number of bytes hashed from the start and from the end of a file for the partial hash
+PARTIAL_HASH_SIZE = 64 * 1024
+
+# Size of the blocks read when computing the full hash of a file
+FULL_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class _Entry:
+    """Defines a file in the index; the hashes are only computed when they are needed.
+
+    The hashes are computed from `hash_path`, which is the file that a copy is made from while the
+    file at `path` is still being copied.
+    """
+    __slots__ = ('path', 'size', 'hash_path', 'partial_hash', 'full_hash')
+
+    def __init__(self, path: str, size: int, hash_path: str = None) -> None:
+        self.path = path
+        self.size = size
+        self.hash_path = hash_path or path
+        self.partial_hash = None
+        self.full_hash = None
+
+    def get_partial_hash(self) -> bytes:
+        if self.partial_hash is None:
+            self.partial_hash = partial_hash(self.hash_path, self.size)
+        return self.partial_hash
+
+    def get_full_hash(self) -> bytes:
+        if self.size <= 2 * PARTIAL_HASH_SIZE:
+            # The partial hash already covers the whole contents of the file
+            return self.get_partial_hash()
+        if self.full_hash is None:
+            self.full_hash = full_hash(self.hash_path)
+        return self.full_hash
+
+
+def partial_hash(filename: str, size: int) -> bytes:
+    """Returns a hash of the size, the first block and the last block of the file"""
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    with open(filename, 'rb') as file:
+        digest.update(file.read(PARTIAL_HASH_SIZE))
+        if size > PARTIAL_HASH_SIZE:
+            file.seek(max(PARTIAL_HASH_SIZE, size - PARTIAL_HASH_SIZE))
+            digest.update(file.read(PARTIAL_HASH_SIZE))
+    return digest.digest()
+
+
+def full_hash(filename: str) -> bytes:
+    """Returns a hash of the whole contents of the file"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(FULL_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+class DedupIndex:
+    """Defines an index of the contents of the files in the destination directories.
+
+    A file is considered to be a duplicate of a file in the index if it has the same contents,
+    regardless of its name or of the dated directory it is located in.  The files are keyed on
+    their size; a partial hash (of the first and last blocks) is only computed for files with the
+    same size, and a full hash only for files with the same partial hash.
+
+    The destination directories are scanned (without reading the files) the first time that the
+    index is used.  The index is updated as files are copied, and is safe to use from several
+    threads.
+
+    :param directories: destination directories whose files are indexed
+    """
+    def __init__(self, directories) -> None:
+        self.directories = list(directories)
+        self._entries_by_size = None
+        self._entries_by_path = {}
+        self._lock = RLock()
+
+    def __repr__(self):
+        return f'DedupIndex({self.directories})'
+
+    def __len__(self):
+        with self._lock:
+            self._build()
+            return len(self._entries_by_path)
+
+    def _build(self) -> None:
+        """Scans the destination directories to index the size of each file"""
+        if self._entries_by_size is not None:
+            return
+
+        self._entries_by_size = {}
+        pending_directories = [directory for directory in self.directories if os.path.isdir(directory)]
+        while pending_directories:
+            with os.scandir(pending_directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_directories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        self._add_entry(_Entry(entry.path, entry.stat(follow_symlinks=False).st_size))
+
+    def _add_entry(self, entry: _Entry) -> None:
+        self._entries_by_size.setdefault(entry.size, []).append(entry)
+        self._entries_by_path[entry.path] = entry
+
+    def find_duplicate(self, filename: str) -> str:
+        """Returns the path of a file in the index with the same contents as the file (or '' if none)"""
+        new_entry = _Entry(filename, os.path.getsize(filename))
+        with self._lock:
+            self._build()
+            candidates = list(self._entries_by_size.get(new_entry.size, []))
+        return self._find_duplicate(new_entry, candidates)
+
+    @staticmethod
+    def _find_duplicate(new_entry: _Entry, candidates) -> str:
+        """Returns the path of the candidate with the same contents as the new entry (or '' if none)
+
+        The files are hashed without holding the lock of the index, so that hashing a large file does
+        not block the other threads.
+        """
+        for candidate in candidates:
+            if candidate.path == new_entry.path:
+                continue
+            try:
+                if (candidate.get_partial_hash() == new_entry.get_partial_hash() and
+                        candidate.get_full_hash() == new_entry.get_full_hash()):
+                    return candidate.path
+            except OSError:
+                # The indexed file was removed (or cannot be read), so it cannot be a duplicate
+                continue
+        return ''
+
+    def add_unless_duplicate(self, filename: str, target: str) -> str:
+        """Adds the target of copying the file to the index, unless the file is a duplicate
+
+        The files of the same size are compared without holding the lock of the index.  The target is
+        only added once no file of the same size was added in the meantime (otherwise, those files
+        are compared too), so that two identical files copied at the same time are not both copied.
+
+        :param filename: file that will be copied
+        :param target: path that the file will be copied to
+        :return: path of the file in the index with the same contents, or '' if the target was added
+        """
+        new_entry = _Entry(filename, os.path.getsize(filename))
+        compared = set()
+        while True:
+            with self._lock:
+                self._build()
+                candidates = [entry for entry in self._entries_by_size.get(new_entry.size, [])
+                              if entry not in compared]
+                if not candidates:
+                    target_entry = _Entry(target, new_entry.size, hash_path=filename)
+                    target_entry.partial_hash = new_entry.partial_hash
+                    target_entry.full_hash = new_entry.full_hash
+                    self._add_entry(target_entry)
+                    return ''
+
+            duplicate = self._find_duplicate(new_entry, candidates)
+            if duplicate:
+                return duplicate
+            compared.update(candidates)
+
+    def add(self, filename: str) -> None:
+        """Adds a file to the index"""
+        with self._lock:
+            self._build()
+            if filename not in self._entries_by_path:
+                self._add_entry(_Entry(filename, os.path.getsize(filename)))
+
+    def remove(self, filename: str) -> None:
+        """Removes a file from the index (such as when copying the file failed)"""
+        with self._lock:
+            self._build()
+            entry = self._entries_by_path.pop(filename, None)
+            if entry is not None:
+                self._entries_by_size[entry.size].remove(entry)
@@ -0,0 +1,110 @@
+"""
+Specifies the dated destination directories that the files are copied to.
+
+.. module:: destination
+    :synopsis: module defining a cache of the destination directories and of their contents.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import logging
+import os
+from threading import Lock
+
+
+logger = logging.getLogger(__name__)
+
+
+class DestinationDirectories:
+    """Defines the destination directories (.../yyyy/yyyy-mm-dd) used while copying files.
+
+    Each destination directory is created (if needed) and listed only once, the first time that
+    it is used or when all the destination directories are prepared up front.  The names of the
+    files in each destination directory are kept in memory, so checking if a file exists in the
+    destination directory does not access the filesystem; the names are updated as files are
+    copied.  This matters on network drives, where each access is a round-trip to the server.
+
+    This class is safe to use from several threads.
+    """
+    def __init__(self) -> None:
+        self._listings = {}
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f'DestinationDirectories({sorted(self._listings)})'
+
+    def __len__(self):
+        return len(self._listings)
+
+    def prepare(self, directories) -> None:
+        """Creates and lists all of the destination directories in one pass"""
+        for directory in sorted(set(directories)):
+            self.ensure(directory)
+
+    def ensure(self, directory: str) -> set:
+        """Creates the destination directory if it does not exist; returns the names of its files"""
+        listing = self._listings.get(directory)
+        if listing is not None:
+            return listing
+
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is None:
+                listing = set()
+                try:
+                    with os.scandir(directory) as entries:
+                        listing.update(entry.name for entry in entries)
+                except FileNotFoundError:
+                    logger.debug('Destination directory does NOT exist: %s', directory)
+                    try:
+                        os.makedirs(directory, exist_ok=True)
+                    except OSError as exception:
+                        logger.warning('Mkdir Exception: %s', exception)
+                except OSError as exception:
+                    logger.warning('Listing Exception: %s', exception)
+                self._listings[directory] = listing
+        return listing
+
+    def contains(self, directory: str, filename: str) -> bool:
+        """Returns if the file exists in the destination directory"""
+        return filename in self.ensure(directory)
+
+    def add(self, directory: str, filename: str) -> None:
+        """Records that the file was copied to the destination directory"""
+        listing = self.ensure(directory)
+        with self._lock:
+            listing.add(filename)
+
+    def add_unless_exists(self, directory: str, filename: str) -> bool:
+        """Reserves the name of a file about to be copied; returns False if the file exists already
+
+        The check and the reservation are done together, so that two files with the same name copied
+        at the same time are not both copied.  The name should be discarded if the copy fails.
+        """
+        listing = self.ensure(directory)
+        with self._lock:
+            if filename in listing:
+                return False
+            listing.add(filename)
+            return True
+
+    def reserve_unique(self, directory: str, filename: str) -> str:
+        """Reserves a name that does not exist yet for a file about to be copied, and returns it
+
+        The name is the name of the file if it is free, otherwise the name with the first free
+        counter appended (such as "IMG_0001_1.JPG").  The name should be discarded if the copy fails.
+        """
+        listing = self.ensure(directory)
+        stem, extension = os.path.splitext(filename)
+        counter = 0
+        with self._lock:
+            while filename in listing:
+                counter += 1
+                filename = f'{stem}_{counter}{extension}'
+            listing.add(filename)
+        return filename
+
+    def discard(self, directory: str, filename: str) -> None:
+        """Releases the name of a file that was reserved but not copied"""
+        listing = self.ensure(directory)
+        with self._lock:
+            listing.discard(filename)
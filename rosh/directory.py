@@ -6,8 +6,24 @@ Specifies a directory containing pictures and videos to be processed.
 
 .. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
 """
+import logging
 import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore
+from .cache import ScanCache
+from .dedup import DedupIndex
+from .destination import DestinationDirectories
 from .file import File
+from .instrumentation import Metrics, ProgressLine
+from .metadata import extract_creation_dates
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of pending copies per thread when the files are copied by a pool of threads
+PENDING_COPIES_PER_WORKER = 4
 
 
 class Directory:
@@ -18,49 +34,171 @@ class Directory:
     are separate destination directories for pictures and videos.
 
     The constructor checks that the path for the source directory and the path for the two
-    destination directories (pictures and videos) are valid.  Next, all the files based on
-    the source directory and its sub-directories are identified and sorted.  Finally, the
-    parameters about the copy operation for this class are initialized to zeros.
+    destination directories (pictures and videos) are valid, and initializes the parameters
+    about the copy operation for this class to zeros.
+
+    The files in the source directory and its sub-directories are discovered lazily: when the
+    files are copied, each file is copied as soon as it is found, so the copy starts right away
+    and the list of all the files is never built.  Accessing `files` builds (and keeps) the list
+    of all the files instead.
 
     :param source_directory: path of this directory
     :param picture_destination_directory: directory where the picture files will be attempted to be
                                           copied to
     :param video_destination_directory: directory where the video files will be attempted to be
                                         copied to
+    :param cache_path: path of the scan cache storing the date that each file was created, so that
+                       unchanged files are not scanned again (no cache is used if not specified)
+    :param rebuild_cache: flag indicating if the existing contents of the scan cache should be discarded
+    :param metadata_workers: number of processes used to extract the metadata of the files without a
+                             date in their path; if more than 0, the metadata of all those files is
+                             extracted in a separate stage, after all the files are found and before
+                             any file is copied (otherwise, it is extracted as each file is found)
+    :param metadata_batch_size: number of files sent to a metadata process at a time
+    :param metadata_timeout: maximum number of seconds to extract the metadata of each file with hachoir
+    :param metrics: counters and stage durations (walk, classify, metadata, mkdir, copy) of this directory
     """
-    def __init__(self, directory_path, picture_destination_directory, video_destination_directory) -> None:
+    def __init__(self, directory_path, picture_destination_directory, video_destination_directory,
+                 cache_path: str = None, rebuild_cache: bool = False, metadata_workers: int = 0,
+                 metadata_batch_size: int = 32, metadata_timeout: float = 60.0) -> None:
         self.directory_path = File.check_directory_name(directory_path)
         self.picture_destination_directory = File.check_directory_name(picture_destination_directory)
         self.video_destination_directory = File.check_directory_name(video_destination_directory)
+        self.cache_path = cache_path
+        self.rebuild_cache = rebuild_cache
+        self.metadata_workers = metadata_workers
+        self.metadata_batch_size = metadata_batch_size
+        self.metadata_timeout = metadata_timeout
+        self.number_of_files = 0
         self.number_of_picture_files = 0
         self.number_of_video_files = 0
-        self.files = self.collect_all_files()
         self.files_copied = 0
         self.files_not_copied = 0
+        self.metrics = Metrics()
+        self._files = None
 
     def __repr__(self):
         return f'{self.directory_path}'
 
+    @property
+    def files(self):
+        """List of all the files in the source directory and its sub-directories (built on first access)"""
+        if self._files is None:
+            self._files = self.collect_all_files()
+        return self._files
+
     def collect_all_files(self):
         """Returns a list of all the files in the source directory and its sub-directories"""
-        all_files = []
-        for root, _, files in os.walk(self.directory_path):
-            for file in files:
-                picture_extensions = ['jpg', 'jpeg']
-                videos_extensions = ['mov']
-
-                __, file_extension = os.path.splitext(file)
-                if file_extension.lstrip('.').lower() in picture_extensions:
-                    all_files.append(File(os.path.join(root, file), self.picture_destination_directory))
-                    self.number_of_picture_files += 1
-                elif file_extension.lstrip('.').lower() in videos_extensions:
-                    all_files.append(File(os.path.join(root, file), self.video_destination_directory))
-                    self.number_of_video_files += 1
-                else:
-                    print('File is not supported: {file}')
-
+        all_files = list(self.iter_files())
+        if self.metadata_workers > 0:
+            self.extract_metadata(all_files)
         return all_files
 
+    def extract_metadata(self, files) -> None:
+        """Extracts the date that each file needing metadata was created, using a pool of processes
+
+        The files are sent to the processes in batches.  If the pool of processes fails, the metadata
+        of the remaining files is extracted in this process instead.
+        """
+        pending_files = [file for file in files if file.needs_metadata]
+        if not pending_files:
+            return
+
+        batches = [pending_files[index:index + self.metadata_batch_size]
+                   for index in range(0, len(pending_files), self.metadata_batch_size)]
+        cache = ScanCache(self.cache_path) if self.cache_path else None
+        try:
+            with ProcessPoolExecutor(max_workers=self.metadata_workers) as executor:
+                futures = {executor.submit(extract_creation_dates,
+                                           [file.filename_with_path for file in batch],
+                                           self.metadata_timeout): batch
+                           for batch in batches}
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    try:
+                        results = future.result()
+                    except (BrokenProcessPool, OSError) as exception:
+                        logger.warning('Metadata Exception: %s', exception)
+                        results = extract_creation_dates([file.filename_with_path for file in batch],
+                                                         self.metadata_timeout)
+
+                    for file, (date_created, seconds, used_hachoir) in zip(batch, results):
+                        file.set_date_created(date_created)
+                        self.metrics.observe('metadata', seconds)
+                        if used_hachoir:
+                            self.metrics.increment('metadata_hachoir')
+                        if cache is not None:
+                            cache.store(file.filename_with_path, os.stat(file.filename_with_path),
+                                        file.date_created, file.file_type)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def iter_files(self):
+        """Yields each of the files in the source directory and its sub-directories as it is found
+
+        The number of files (total, pictures and videos) are counted as the files are found.  If a
+        metadata stage is used (`metadata_workers`), the files needing metadata are yielded without
+        a date and without a destination directory (see `extract_metadata`).
+        """
+        defer_metadata = self.metadata_workers > 0
+        self.number_of_files = 0
+        self.number_of_picture_files = 0
+        self.number_of_video_files = 0
+        cache = ScanCache(self.cache_path, rebuild=self.rebuild_cache) if self.cache_path else None
+        try:
+            walker = os.walk(self.directory_path)
+            while True:
+                with self.metrics.timer('walk'):
+                    next_directory = next(walker, None)
+                if next_directory is None:
+                    break
+
+                root, _, files = next_directory
+                for file in files:
+                    picture_extensions = ['jpg', 'jpeg']
+                    videos_extensions = ['mov']
+
+                    __, file_extension = os.path.splitext(file)
+                    if file_extension.lstrip('.').lower() in picture_extensions:
+                        new_file = self.create_file(os.path.join(root, file), self.picture_destination_directory,
+                                                    cache, self.metrics, defer_metadata)
+                        self.number_of_picture_files += 1
+                    elif file_extension.lstrip('.').lower() in videos_extensions:
+                        new_file = self.create_file(os.path.join(root, file), self.video_destination_directory,
+                                                    cache, self.metrics, defer_metadata)
+                        self.number_of_video_files += 1
+                    else:
+                        logger.debug('File is not supported: %s', file)
+                        self.metrics.increment('files_unsupported')
+                        continue
+
+                    self.number_of_files += 1
+                    self.metrics.increment('files_found')
+                    yield new_file
+        finally:
+            if cache is not None:
+                cache.close()
+
+    @staticmethod
+    def create_file(filename: str, destination_directory: str, cache: ScanCache = None,
+                    metrics: Metrics = None, defer_metadata: bool = False) -> File:
+        """Returns a new File, using the date that it was created from the scan cache if it is unchanged"""
+        if cache is None:
+            return File(filename, destination_directory, metrics=metrics, defer_metadata=defer_metadata)
+
+        stat_result = os.stat(filename)
+        cached = cache.lookup(filename, stat_result)
+        if cached is not None:
+            if metrics is not None:
+                metrics.increment('cache_hits')
+            return File(filename, destination_directory, date_created=cached[0], metrics=metrics)
+
+        new_file = File(filename, destination_directory, metrics=metrics, defer_metadata=defer_metadata)
+        if not new_file.needs_metadata:
+            cache.store(filename, stat_result, new_file.date_created, new_file.file_type)
+        return new_file
+
     def print_summary(self) -> None:
         """Prints a summary of the directory to the console"""
         print('Directory Summary:')
@@ -68,20 +206,105 @@ class Directory:
         print(f'Directory path: {self.directory_path}')
         print(f'Destination path (Pictures): {self.picture_destination_directory}')
         print(f'Destination path (Videos): {self.video_destination_directory}')
-        print(f'Number of files: {len(self.files)}')
+        print(f'Number of files: {self.number_of_files}')
         print(f'Number of Picture files: {self.number_of_picture_files}')
         print(f'Number of Video files: {self.number_of_video_files}')
         print('Number of files copied: {}'.format(self.files_copied))
         print('Number of files not copied: {}'.format(self.files_not_copied))
 
-    def copy_files(self):
-        """Copies all of the picture and video files to the applicable destination directories"""
-        for file in self.files:
-            file.copy_to_destination_directory()
+    def copy_files(self, max_workers: int = 1, max_copies_per_destination: int = 0,
+                   deduplicate: bool = False, progress: bool = False) -> None:
+        """Copies all of the picture and video files to the applicable destination directories
+
+        If the list of files has not been built yet (and no metadata stage is used), the files are
+        copied as they are discovered, and each destination directory is created and listed the first
+        time that it is used.  Otherwise, all of the destination directories are created and listed
+        before copying the files.  Either way, checking if a file exists in its destination directory
+        does not access the filesystem.
 
-        for file in self.files:
-            if file.copy_successful:
-                self.files_copied += 1
-            else:
-                self.files_not_copied += 1
+        By default, the files are copied one after another.  When `max_workers` is greater than one,
+        the files are copied by a pool of threads so that the latency of each copy (especially to a
+        network drive) overlaps with the other copies.
 
+        :param max_workers: number of threads used to copy the files (1 copies the files serially)
+        :param max_copies_per_destination: maximum number of concurrent copies to each of the
+                                           destination directories (pictures or videos); 0 means
+                                           that the number of copies is only limited by `max_workers`
+        :param deduplicate: flag indicating if the files should be compared by contents (instead of by
+                            name) to the files in the destination directories, so that renamed
+                            duplicates are not copied and different files with the same name are
+                            copied with a new name
+        :param progress: flag indicating if a progress line should be updated while copying the files
+        """
+        if progress:
+            with ProgressLine(self.metrics):
+                self.copy_files(max_workers, max_copies_per_destination, deduplicate)
+            return
+
+        destinations = DestinationDirectories()
+        if self._files is not None or self.metadata_workers > 0:
+            files = self.files
+            with self.metrics.timer('mkdir'):
+                destinations.prepare(file.destination_directory for file in files if file.valid_file_type())
+        else:
+            files = self.iter_files()
+
+        dedup_index = None
+        if deduplicate:
+            dedup_index = DedupIndex([self.picture_destination_directory, self.video_destination_directory])
+
+        if max_workers <= 1:
+            for file in files:
+                file.copy_to_destination_directory(dedup_index, destinations)
+                self._count_copy_result(file)
+        else:
+            self._copy_files_in_parallel(files, max_workers, max_copies_per_destination, dedup_index, destinations)
+
+    def _count_copy_result(self, file: File) -> None:
+        """Updates the number of files copied (or not copied) with the copy result of the file"""
+        if file.copy_successful:
+            self.files_copied += 1
+            self.metrics.increment('files_copied')
+        else:
+            self.files_not_copied += 1
+            self.metrics.increment('files_not_copied')
+
+    def _copy_files_in_parallel(self, files, max_workers: int, max_copies_per_destination: int,
+                                dedup_index: DedupIndex = None, destinations: DestinationDirectories = None) -> None:
+        """Copies the files using a pool of threads, limiting the concurrent copies per destination
+
+        The number of pending copies is bounded, so that the files are not discovered (much) faster
+        than they are copied.  Two files copied at the same time never get the same target, since each
+        file reserves the name of its target in `destinations` before it is copied.
+        """
+        if destinations is None:
+            destinations = DestinationDirectories()
+        destination_limits = {}
+        if max_copies_per_destination > 0:
+            for destination in (self.picture_destination_directory, self.video_destination_directory):
+                destination_limits[destination] = BoundedSemaphore(max_copies_per_destination)
+
+        def _copy_file(file):
+            destination_limit = destination_limits.get(file.base_destination_directory)
+
+            if destination_limit is not None:
+                destination_limit.acquire()
+            try:
+                file.copy_to_destination_directory(dedup_index, destinations)
+            finally:
+                if destination_limit is not None:
+                    destination_limit.release()
+            return file
+
+        def _count_completed(futures):
+            for future in futures:
+                self._count_copy_result(future.result())
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for file in files:
+                pending.add(executor.submit(_copy_file, file))
+                if len(pending) >= max_workers * PENDING_COPIES_PER_WORKER:
+                    completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    _count_completed(completed)
+            _count_completed(wait(pending).done)
@@ -6,9 +6,24 @@ Specifies a file (picture or video) to be processed.
 
 .. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
 """
-import subprocess
+import logging
 import os
-from shutil import copy2
+from contextlib import contextmanager
+from .copy_backend import DEFAULT_COPY_BACKEND
+from .date_patterns import parse_date
+from .dedup import DedupIndex
+from .destination import DestinationDirectories
+from .instrumentation import Metrics
+from .metadata import read_creation_date, read_creation_date_with_hachoir
+
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def _no_timer():
+    """Context manager that does nothing (contextlib.nullcontext needs Python 3.7)"""
+    yield
 
 
 class File:
@@ -32,17 +47,40 @@ class File:
     :param copy_successful: flag indicating if the copy from the source directory
                             to the destination directory was successful
     :param file_type: string indicating if the file is a picture or video
+    :param duplicate_of: path of the file with the same contents in the destination directories,
+                         if the file was not copied because it is a duplicate
+    :param copy_backend: backend used to copy the file (in-kernel copy, reflink or buffered copy),
+                         shared by all the files unless replaced
+    :param metrics: metrics (counters and stage durations) that this file is recorded in, if any
     """
-    def __init__(self, filename_with_path: str, destination_directory: str = '') -> None:
-        """Initialize the parameters for the file."""
+    copy_backend = DEFAULT_COPY_BACKEND
+
+    def __init__(self, filename_with_path: str, destination_directory: str = '', date_created: str = None,
+                 metrics: Metrics = None, defer_metadata: bool = False) -> None:
+        """Initialize the parameters for the file.
+
+        If the date that the file was created is already known (such as from a previous scan), it
+        can be specified with `date_created` so that it is not extracted again.
+
+        If `defer_metadata` is set and the date is not in the path of the file, the metadata is not
+        extracted: `needs_metadata` is set instead, and the date must be set later with
+        `set_date_created` (such as by a separate metadata stage handling many files at once).
+        """
+        self.metrics = metrics
         self.filename_with_path = filename_with_path
         self.base_destination_directory = File.check_directory_name(destination_directory)
         self.destination_directory = ''
         self.copy_successful = False
+        self.duplicate_of = ''
         self.file_type = File.check_file_extension(filename_with_path)
         self.date_created = ''
+        self.needs_metadata = False
         if self.valid_file_type():
-            self.extract_date_created()
+            if date_created is None:
+                self.extract_date_created(defer_metadata)
+            else:
+                self.date_created = date_created
+                self.set_destination_directory()
 
     def __repr__(self):
         return f'{self.filename_with_path}'
@@ -67,6 +105,12 @@ class File:
             return 'Video'
         return ''
 
+    def timer(self, stage: str):
+        """Returns a context manager recording the duration of the stage in the metrics (if any)"""
+        if self.metrics is None:
+            return _no_timer()
+        return self.metrics.timer(stage)
+
     def valid_file_type(self) -> bool:
         """Returns if this file is a valid media (picture or video) file"""
         return self.file_type == 'Picture' or self.file_type == 'Video'
@@ -80,7 +124,8 @@ class File:
         print(f'    Date created: { self.date_created }')
         print(f'    Copy successful: { self.copy_successful }')
 
-    def copy_to_destination_directory(self):
+    def copy_to_destination_directory(self, dedup_index: DedupIndex = None,
+                                      destinations: DestinationDirectories = None):
         """Copy the file from the source directory to the destination directories (picture or video).
 
         First, this method first checks if the destination directory exists.  If it does not, then the
@@ -89,55 +134,131 @@ class File:
         Second, this method checks if the file exists in the destination directory.  If it does not,
         then the file is copied to the destination directory.
 
+        If a `dedup_index` is specified, the second step checks the contents of the file instead: the
+        file is only copied if no file in the index has the same contents.  If another file with the
+        same name (but different contents) exists in the destination directory, the file is copied
+        with a new name (such as "IMG_0001_1.JPG").
+
+        If `destinations` is specified, the destination directory is only created and listed the first
+        time that it is used, and the existence checks use that listing instead of the filesystem.  The
+        name of the file is reserved in the listing before the file is copied, so files copied at the
+        same time (by several threads) never get the same name.
+
+        :param dedup_index: index of the contents of the files in the destination directories
+        :param destinations: destination directories (and their contents) shared by the files being copied
         """
         if self.valid_file_type():
-            if not os.path.isdir(self.destination_directory):
-                print('Destination directory does NOT exist!')
-                try:
-                    os.makedirs(self.destination_directory)
-                except OSError as exception:
-                    print(f'Mkdir Exception: {str(exception)}')
-
-            if not os.path.isfile(os.path.join(self.destination_directory, os.path.basename(self.filename_with_path))):
-                print('\tFile is NOT located in the destination directory!')
-                print(f'Copying {os.path.basename(self.filename_with_path)} to {self.destination_directory}')
-                try:
-                    copy2(self.filename_with_path, self.destination_directory)
-                    self.copy_successful = True
-                except OSError as exception:
-                    print(f'Copy2 Exception: {str(exception)}')
+            with self.timer('mkdir'):
+                if destinations is not None:
+                    destinations.ensure(self.destination_directory)
+                elif not os.path.isdir(self.destination_directory):
+                    logger.debug('Destination directory does NOT exist: %s', self.destination_directory)
+                    try:
+                        os.makedirs(self.destination_directory, exist_ok=True)
+                    except OSError as exception:
+                        logger.warning('Mkdir Exception: %s', exception)
+
+            filename = os.path.basename(self.filename_with_path)
+            if dedup_index is not None:
+                self.copy_unless_duplicate(dedup_index, destinations)
+            elif destinations is not None and destinations.add_unless_exists(self.destination_directory, filename):
+                logger.debug('Copying %s to %s', filename, self.destination_directory)
+                if not self.copy_to(os.path.join(self.destination_directory, filename)):
+                    destinations.discard(self.destination_directory, filename)
+            elif destinations is None and not self.exists_in_destination_directory(filename):
+                logger.debug('Copying %s to %s', filename, self.destination_directory)
+                self.copy_to(os.path.join(self.destination_directory, filename))
             else:
-                print('File exists in the destination directory.')
+                logger.debug('File exists in the destination directory: %s', self.filename_with_path)
                 self.copy_successful = False
         else:
-            print(f'Not copying file... file type is not a Picture or Video!')
+            logger.debug('Not copying file... file type is not a Picture or Video: %s', self.filename_with_path)
+
+    def copy_to(self, destination: str) -> bool:
+        """Copy the file to the destination (path of the new file) with the copy backend; returns if successful"""
+        try:
+            with self.timer('copy'):
+                size = self.copy_backend.copy(self.filename_with_path, destination)
+            self.copy_successful = True
+        except OSError as exception:
+            logger.warning('Copy Exception: %s', exception)
+            return False
+
+        if self.metrics is not None:
+            self.metrics.increment('bytes_copied', size)
+        return True
+
+    def exists_in_destination_directory(self, filename: str, destinations: DestinationDirectories = None) -> bool:
+        """Returns if a file with the specified name exists in the destination directory"""
+        if destinations is not None:
+            return destinations.contains(self.destination_directory, filename)
+        return os.path.isfile(os.path.join(self.destination_directory, filename))
+
+    def copy_unless_duplicate(self, dedup_index: DedupIndex, destinations: DestinationDirectories = None) -> None:
+        """Copy the file to the destination directory unless a file with the same contents is in the index"""
+        target = self.unique_destination_filename(destinations)
+        try:
+            self.duplicate_of = dedup_index.add_unless_duplicate(self.filename_with_path, target)
+        except OSError as exception:
+            logger.warning('Dedup Exception: %s', exception)
+            self.release_destination_filename(target, destinations)
+            return
+
+        if self.duplicate_of:
+            logger.debug('File %s is a duplicate of %s', self.filename_with_path, self.duplicate_of)
+            self.release_destination_filename(target, destinations)
+            self.copy_successful = False
+            if self.metrics is not None:
+                self.metrics.increment('files_duplicate')
+            return
+
+        logger.debug('Copying %s to %s', os.path.basename(self.filename_with_path), target)
+        if not self.copy_to(target):
+            self.release_destination_filename(target, destinations)
+            dedup_index.remove(target)
+
+    def unique_destination_filename(self, destinations: DestinationDirectories = None) -> str:
+        """Returns a path in the destination directory, for this file, that does not exist yet
+
+        If `destinations` is specified, the name is reserved in its listing, so no other file gets
+        the same path (see `release_destination_filename` if the file is not copied).
+        """
+        filename = os.path.basename(self.filename_with_path)
+        if destinations is not None:
+            return os.path.join(self.destination_directory,
+                                destinations.reserve_unique(self.destination_directory, filename))
+
+        stem, extension = os.path.splitext(filename)
+        counter = 0
+        while self.exists_in_destination_directory(filename):
+            counter += 1
+            filename = f'{stem}_{counter}{extension}'
+        return os.path.join(self.destination_directory, filename)
+
+    def release_destination_filename(self, target: str, destinations: DestinationDirectories = None) -> None:
+        """Releases the path reserved by `unique_destination_filename` for a file that is not copied"""
+        if destinations is not None:
+            destinations.discard(self.destination_directory, os.path.basename(target))
 
     def extract_creation_data_from_metadata(self) -> str:
-        """Extract the date that the file was created by reading the metadata"""
-        extracted_date = ''
-
-        out = subprocess.run(f'hachoir-metadata {self.filename_with_path}',
-                             shell=True,
-                             encoding='ascii',
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        print(out.returncode)
-        print('-------')
-
-        if out.returncode == 0:
-            line_dictionary = out.stdout.split('\n')
-            for line in line_dictionary:
-                print(line)
-                if line.lstrip(' -').startswith('Creation date'):
-                    extracted_date = line[17:27]
-                    print(f'Found date_created ({extracted_date}) metadata!')
-                    break
-        else:
-            print('Error! Running hachoir-metadata returned non-zero value!')
+        """Extract the date that the file was created by reading the metadata
+
+        The metadata is first read directly from the header of the file (EXIF for pictures and
+        the 'mvhd' atom for videos).  Only if that fails, `hachoir-metadata` is run to extract it.
+        """
+        extracted_date = read_creation_date(self.filename_with_path)
+        if extracted_date:
+            return extracted_date
 
-        return extracted_date
+        return self.extract_creation_data_from_hachoir()
 
-    def extract_date_created(self):
+    def extract_creation_data_from_hachoir(self) -> str:
+        """Extract the date that the file was created by running `hachoir-metadata` on the file"""
+        if self.metrics is not None:
+            self.metrics.increment('metadata_hachoir')
+        return read_creation_date_with_hachoir(self.filename_with_path)
+
+    def extract_date_created(self, defer_metadata: bool = False):
         """Extract the date that this file was created for determining the destination directory
 
         This method checks for the date that this file was created in the following order:
@@ -145,19 +266,40 @@ class File:
             2. Check if the data is in the file name
             3. Check if the data is in the metadata for the file
 
+        The dates in the folder name and in the file name are found using the registry of date
+        patterns (see `date_patterns`), such as "2018-08-22", "2018_08_23" or "IMG_20180822_123456".
+
         If the date cannot be found from these three options, then the destination directory
         is set to 'Date Unknown'.
+
+        :param defer_metadata: flag indicating if the third option should be left for later, in which
+                               case `needs_metadata` is set and the destination directory is not set
         """
-        directories = self.filename_with_path.split('/')
-        directories = [directory for directory in directories if directory != '']
+        with self.timer('classify'):
+            self.date_created = File.extract_date_from_path(self.filename_with_path)
+        if self.date_created == '':
+            if defer_metadata:
+                self.needs_metadata = True
+                return
+            with self.timer('metadata'):
+                self.date_created = self.extract_creation_data_from_metadata()
 
-        if directories[-2].startswith('20'):
-            self.date_created = directories[-2][:10].replace('_', '-')
-        elif directories[-1].startswith('20'):
-            self.date_created = directories[-1][:10].replace('_', '-')
-        else:
-            self.date_created = self.extract_creation_data_from_metadata()
+        self.set_destination_directory()
+
+    def set_date_created(self, date_created: str) -> None:
+        """Set the date that this file was created (such as from the metadata) and the destination directory"""
+        self.date_created = date_created
+        self.needs_metadata = False
+        self.set_destination_directory()
+
+    @staticmethod
+    def extract_date_from_path(filename_with_path: str) -> str:
+        """Returns the date found in the folder name or else in the file name (or '' if none)"""
+        folder_name = os.path.basename(os.path.dirname(filename_with_path))
+        return parse_date(folder_name) or parse_date(os.path.basename(filename_with_path))
 
+    def set_destination_directory(self) -> None:
+        """Set the destination directory based on the date that this file was created"""
         if self.date_created == '':
             self.destination_directory = os.path.join(self.base_destination_directory, 'Date_Unknown')
         else:
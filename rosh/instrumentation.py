@@ -0,0 +1,182 @@
+"""
+Specifies the counters and timings recorded while importing pictures and videos.
+
+.. module:: instrumentation
+    :synopsis: module defining the metrics (counters, histograms, progress) of an import run.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+
+# Stages of the import for which the durations are recorded
+STAGES = ('walk', 'classify', 'metadata', 'mkdir', 'copy')
+
+# Percentiles included in the report of each histogram
+REPORT_PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    """Defines a histogram of durations, using buckets whose bounds are powers of two microseconds.
+
+    The histogram has a fixed size (64 buckets) regardless of the number of durations recorded, and
+    the percentiles are estimated with the upper bound of the bucket they fall in.
+    """
+    def __init__(self) -> None:
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def __repr__(self):
+        return f'Histogram(count={self.count}, total={self.total:.6f})'
+
+    def record(self, seconds: float) -> None:
+        """Records a duration (in seconds)"""
+        self.buckets[min(63, int(seconds * 1000000).bit_length())] += 1
+        self.count += 1
+        self.total += seconds
+        if self.minimum is None or seconds < self.minimum:
+            self.minimum = seconds
+        if self.maximum is None or seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, percent: float) -> float:
+        """Returns an estimate (upper bound) of the percentile of the durations, in seconds"""
+        if self.count == 0:
+            return 0.0
+        threshold = self.count * percent / 100
+        cumulative = 0
+        for index, bucket in enumerate(self.buckets):
+            cumulative += bucket
+            if cumulative >= threshold:
+                return min(self.maximum, (1 << index) / 1000000)
+        return self.maximum
+
+    def report(self) -> dict:
+        """Returns a summary of the histogram (durations in milliseconds)"""
+        summary = {
+            'count': self.count,
+            'total_s': round(self.total, 6),
+            'mean_ms': round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            'min_ms': round((self.minimum or 0.0) * 1000, 3),
+            'max_ms': round((self.maximum or 0.0) * 1000, 3),
+        }
+        for percent in REPORT_PERCENTILES:
+            summary[f'p{percent}_ms'] = round(self.percentile(percent) * 1000, 3)
+        return summary
+
+
+class Metrics:
+    """Defines the counters and the histograms of the stage durations of an import run.
+
+    The stages are the ones listed in STAGES: walking the source directory, classifying (and dating
+    from the path) each file, extracting the metadata, creating the destination directories and
+    copying the files.  This class is safe to use from several threads.
+    """
+    def __init__(self) -> None:
+        self.start_time = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f'Metrics({self.counters})'
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """Increments a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Records the duration of a stage for one file"""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Context manager recording the duration of the enclosed stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def report(self) -> dict:
+        """Returns the report of the import run (counters, throughput and stage durations)"""
+        with self._lock:
+            elapsed = max(time.time() - self.start_time, 1e-9)
+            return {
+                'elapsed_s': round(elapsed, 3),
+                'counters': dict(self.counters),
+                'files_per_s': round(self.counters.get('files_copied', 0) / elapsed, 3),
+                'bytes_per_s': round(self.counters.get('bytes_copied', 0) / elapsed, 3),
+                'stages': {stage: self.histograms.get(stage, Histogram()).report()
+                           for stage in STAGES + tuple(sorted(set(self.histograms) - set(STAGES)))},
+            }
+
+    def write_report(self, filename: str) -> None:
+        """Writes the report of the import run to a JSON file"""
+        with open(filename, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def progress_line(self) -> str:
+        """Returns a one-line summary of the progress of the import run"""
+        with self._lock:
+            elapsed = max(time.time() - self.start_time, 1e-9)
+            files_found = self.counters.get('files_found', 0)
+            files_copied = self.counters.get('files_copied', 0)
+            files_not_copied = self.counters.get('files_not_copied', 0)
+            megabytes = self.counters.get('bytes_copied', 0) / (1024 * 1024)
+        return (f'found: {files_found}  copied: {files_copied}  not copied: {files_not_copied}  '
+                f'{megabytes:.1f} MB ({megabytes / elapsed:.1f} MB/s, {files_copied / elapsed:.1f} files/s)')
+
+
+class ProgressLine:
+    """Defines a progress line, rewritten in place periodically while the import is running.
+
+    :param metrics: metrics of the import run
+    :param interval: number of seconds between updates of the progress line
+    :param stream: stream that the progress line is written to
+    """
+    def __init__(self, metrics: Metrics, interval: float = 1.0, stream=None) -> None:
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self._stopped = Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        """Starts updating the progress line in a background thread"""
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name='progress', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops updating the progress line, after writing it a last time"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.stream.write('\r' + self.metrics.progress_line() + '\n')
+        self.stream.flush()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.stream.write('\r' + self.metrics.progress_line())
+            self.stream.flush()
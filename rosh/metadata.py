@@ -0,0 +1,254 @@
+"""
+Extracts the creation date of a picture or video directly from the header of the file.
+
+.. module:: metadata
+    :synopsis: module for reading the creation date from JPEG (EXIF) and QuickTime (MOV) files.
+
+.. moduleauthor:: Roshni Kasliwal <kasliwalroshni27@gmail.com>
+"""
+import logging
+import os
+import struct
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+
+# Number of bytes read from the start of a JPEG file (the EXIF segment is limited to 64 KB)
+JPEG_HEADER_SIZE = 64 * 1024
+
+# Maximum number of bytes of the 'moov' atom that are read when searching for the 'mvhd' atom
+QUICKTIME_MOOV_READ_SIZE = 16 * 1024
+
+# Maximum number of top-level atoms that are skipped before giving up on a QuickTime file
+QUICKTIME_MAX_ATOMS = 64
+
+EXIF_TAG_DATE_TIME = 0x0132
+EXIF_TAG_EXIF_IFD_POINTER = 0x8769
+EXIF_TAG_DATE_TIME_ORIGINAL = 0x9003
+EXIF_TAG_DATE_TIME_DIGITIZED = 0x9004
+
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_creation_date(filename: str) -> str:
+    """Returns the date (in format of "yyyy-mm-dd") that the file was created based on its header.
+
+    Only the first bytes of the file are read: the EXIF segment for JPEG files and the atom headers
+    for QuickTime files.  An empty string is returned if the date could not be found.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            signature = file.read(12)
+            file.seek(0)
+            if signature.startswith(b'\xff\xd8'):
+                return read_jpeg_creation_date(file)
+            if signature[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'):
+                return read_quicktime_creation_date(file)
+    except (OSError, IndexError, ValueError, OverflowError, struct.error):
+        pass
+
+    return ''
+
+
+def read_creation_date_with_hachoir(filename: str, timeout: float = None) -> str:
+    """Returns the date (in format of "yyyy-mm-dd") that the file was created by running `hachoir-metadata`
+
+    :param filename: path of the file
+    :param timeout: maximum number of seconds that `hachoir-metadata` can run for (no limit if None)
+    """
+    extracted_date = ''
+
+    try:
+        out = subprocess.run(['hachoir-metadata', filename],
+                             encoding='ascii',
+                             errors='replace',
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning('Error! Running hachoir-metadata timed out after %s seconds for %s', timeout, filename)
+        return extracted_date
+    except OSError as exception:
+        logger.warning('Error! Running hachoir-metadata failed for %s: %s', filename, exception)
+        return extracted_date
+
+    if out.returncode == 0:
+        line_dictionary = out.stdout.split('\n')
+        for line in line_dictionary:
+            if line.lstrip(' -').startswith('Creation date'):
+                extracted_date = line[17:27]
+                logger.debug('Found date_created (%s) metadata: %s', extracted_date, filename)
+                break
+    else:
+        logger.warning('Error! Running hachoir-metadata returned non-zero value (%d) for %s',
+                       out.returncode, filename)
+
+    return extracted_date
+
+
+def extract_creation_dates(filenames, timeout: float = None) -> list:
+    """Returns the creation date of each of the files, reading the header first and then using hachoir
+
+    This function is run by the worker processes of the metadata stage, for a batch of files.
+
+    :param filenames: paths of the files
+    :param timeout: maximum number of seconds that `hachoir-metadata` can run for, for each file
+    :return: list of (date_created, duration in seconds, flag indicating if hachoir was used) for each file
+    """
+    results = []
+    for filename in filenames:
+        start = time.perf_counter()
+        extracted_date = read_creation_date(filename)
+        used_hachoir = not extracted_date
+        if used_hachoir:
+            extracted_date = read_creation_date_with_hachoir(filename, timeout)
+        results.append((extracted_date, time.perf_counter() - start, used_hachoir))
+    return results
+
+
+def read_jpeg_creation_date(file) -> str:
+    """Returns the date that a JPEG file was created based on the EXIF DateTimeOriginal tag"""
+    data = file.read(JPEG_HEADER_SIZE)
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return ''
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0xDA:
+            # Start of scan, so there are no more metadata segments
+            return ''
+        segment_length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        segment = data[offset + 4:offset + 2 + segment_length]
+        if marker == 0xE1 and segment.startswith(b'Exif\x00\x00'):
+            return _parse_exif_date(segment[6:])
+        offset += 2 + segment_length
+
+    return ''
+
+
+def _parse_exif_date(tiff: bytes) -> str:
+    """Returns the creation date from the TIFF structure of an EXIF segment"""
+    if tiff[:2] == b'II':
+        byte_order = '<'
+    elif tiff[:2] == b'MM':
+        byte_order = '>'
+    else:
+        return ''
+
+    ifd0_offset = struct.unpack(byte_order + 'I', tiff[4:8])[0]
+    ifd0 = _read_ifd(tiff, ifd0_offset, byte_order)
+
+    dates = []
+    if EXIF_TAG_EXIF_IFD_POINTER in ifd0:
+        exif_offset = struct.unpack(byte_order + 'I', ifd0[EXIF_TAG_EXIF_IFD_POINTER][2])[0]
+        exif_ifd = _read_ifd(tiff, exif_offset, byte_order)
+        dates.append(exif_ifd.get(EXIF_TAG_DATE_TIME_ORIGINAL))
+        dates.append(exif_ifd.get(EXIF_TAG_DATE_TIME_DIGITIZED))
+    dates.append(ifd0.get(EXIF_TAG_DATE_TIME))
+
+    for entry in dates:
+        if entry is None:
+            continue
+        extracted_date = _format_exif_date(_read_ascii_value(tiff, entry, byte_order))
+        if extracted_date:
+            return extracted_date
+
+    return ''
+
+
+def _read_ifd(tiff: bytes, offset: int, byte_order: str) -> dict:
+    """Returns the entries of an image file directory (IFD) as {tag: (type, count, value/offset)}"""
+    entries = {}
+    if offset + 2 > len(tiff):
+        return entries
+    number_of_entries = struct.unpack(byte_order + 'H', tiff[offset:offset + 2])[0]
+    for index in range(number_of_entries):
+        start = offset + 2 + index * 12
+        if start + 12 > len(tiff):
+            break
+        tag, value_type, count = struct.unpack(byte_order + 'HHI', tiff[start:start + 8])
+        entries[tag] = (value_type, count, tiff[start + 8:start + 12])
+    return entries
+
+
+def _read_ascii_value(tiff: bytes, entry: tuple, byte_order: str) -> str:
+    """Returns the string stored in an ASCII IFD entry"""
+    _, count, value = entry
+    if count <= 4:
+        raw = value[:count]
+    else:
+        value_offset = struct.unpack(byte_order + 'I', value)[0]
+        raw = tiff[value_offset:value_offset + count]
+    return raw.split(b'\x00', 1)[0].decode('ascii', errors='ignore')
+
+
+def _format_exif_date(exif_date: str) -> str:
+    """Converts an EXIF date ("yyyy:mm:dd hh:mm:ss") to the format "yyyy-mm-dd"."""
+    try:
+        return datetime.strptime(exif_date[:10], '%Y:%m:%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return ''
+
+
+def read_quicktime_creation_date(file) -> str:
+    """Returns the date that a QuickTime file was created based on the 'mvhd' atom
+
+    The top-level atoms are walked by reading their headers and seeking over their contents, so
+    the media data is never read even when the 'moov' atom is located at the end of the file.
+    """
+    file_size = os.fstat(file.fileno()).st_size
+    position = 0
+    for _ in range(QUICKTIME_MAX_ATOMS):
+        if position + 8 > file_size:
+            break
+        file.seek(position)
+        atom_size, atom_type, header_size = _read_atom_header(file, file_size - position)
+        if atom_size < header_size:
+            break
+        if atom_type == b'moov':
+            moov = file.read(min(atom_size - header_size, QUICKTIME_MOOV_READ_SIZE))
+            return _parse_mvhd_date(moov)
+        position += atom_size
+
+    return ''
+
+
+def _read_atom_header(file, remaining_size: int) -> tuple:
+    """Returns the size, type and header size of the atom at the current position of the file"""
+    header = file.read(8)
+    atom_size, atom_type = struct.unpack('>I4s', header)
+    header_size = 8
+    if atom_size == 1:
+        atom_size = struct.unpack('>Q', file.read(8))[0]
+        header_size = 16
+    elif atom_size == 0:
+        atom_size = remaining_size
+    return atom_size, atom_type, header_size
+
+
+def _parse_mvhd_date(moov: bytes) -> str:
+    """Returns the creation date stored in the 'mvhd' atom of the contents of a 'moov' atom"""
+    offset = 0
+    while offset + 8 <= len(moov):
+        atom_size, atom_type = struct.unpack('>I4s', moov[offset:offset + 8])
+        if atom_type == b'mvhd':
+            version = moov[offset + 8]
+            if version == 1:
+                creation_time = struct.unpack('>Q', moov[offset + 12:offset + 20])[0]
+            else:
+                creation_time = struct.unpack('>I', moov[offset + 12:offset + 16])[0]
+            if creation_time == 0:
+                return ''
+            return (QUICKTIME_EPOCH + timedelta(seconds=creation_time)).strftime('%Y-%m-%d')
+        if atom_size < 8:
+            break
+        offset += atom_size
+
+    return ''
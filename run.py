@@ -1,3 +1,6 @@
+import argparse
+import logging
+import os
 from rosh.directory import Directory
 
 
@@ -8,13 +11,35 @@ from rosh.directory import Directory
 SOURCE_DIRECTORY = '/Users/rosh/Pictures/temp_phone_pictures'
 DESTINATION_DIRECTORY_PICTURES = '/Users/rosh/Pictures/temp_backup_pictures'
 DESTINATION_DIRECTORY_VIDEOS = '/Users/rosh/Movies/temp_backup_videos'
+SCAN_CACHE_PATH = os.path.expanduser('~/.rosh_scan_cache.sqlite3')
 
 
 ###################
 #  MAIN FUNCTION  #
 ###################
 
-new_directory = Directory(SOURCE_DIRECTORY, DESTINATION_DIRECTORY_PICTURES, DESTINATION_DIRECTORY_VIDEOS)
-new_directory.copy_files()
+parser = argparse.ArgumentParser(description='Copies pictures and videos to dated destination directories.')
+parser.add_argument('--cache', default=SCAN_CACHE_PATH, help='path of the scan cache')
+parser.add_argument('--no-cache', action='store_true', help='scan all of the files without using the scan cache')
+parser.add_argument('--rebuild-cache', action='store_true', help='discard the scan cache and scan all of the files')
+parser.add_argument('--deduplicate', action='store_true',
+                    help='compare the files by contents (instead of by name) to the destination directories')
+parser.add_argument('--workers', type=int, default=1, help='number of threads used to copy the files')
+parser.add_argument('--metadata-workers', type=int, default=0,
+                    help='number of processes used to extract the metadata of the undated files (0 = no separate stage)')
+parser.add_argument('--progress', action='store_true', help='show a progress line while copying the files')
+parser.add_argument('--report', default=None, help='path of the JSON report (counters and stage timings)')
+parser.add_argument('--verbose', action='store_true', help='log the details about each file')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(levelname)s %(message)s')
+
+new_directory = Directory(SOURCE_DIRECTORY, DESTINATION_DIRECTORY_PICTURES, DESTINATION_DIRECTORY_VIDEOS,
+                          cache_path=None if args.no_cache else args.cache,
+                          rebuild_cache=args.rebuild_cache,
+                          metadata_workers=args.metadata_workers)
+new_directory.copy_files(max_workers=args.workers, deduplicate=args.deduplicate, progress=args.progress)
 new_directory.print_summary()
+if args.report:
+    new_directory.metrics.write_report(args.report)
 
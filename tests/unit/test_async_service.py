@@ -0,0 +1,321 @@
+"""
+This file (test_async_service.py) contains the unit tests for the AsyncIngestService class in the async_service.py file.
+"""
+import pytest
+import sys
+
+if sys.version_info < (3, 8):
+    pytest.skip('the asyncio ingest service requires Python 3.8 or later', allow_module_level=True)
+
+from datetime import datetime
+from ingest.async_service import AsyncIngestService, Backoff, ingest_service, open_async_rollups
+from ingest.rollups import RollupAggregator
+from ingest.storage import storage_for
+from ingest.telemetry import decode_telemetry
+from pymongo.errors import AutoReconnect, BulkWriteError
+import asyncio
+import json
+import mongomock
+import threading
+
+
+def payload(value, datastream_name='temp'):
+    return json.dumps({'context': {}, 'datastream_name': datastream_name, 'value': value}).encode()
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeBroker:
+    """MQTT broker publishing the queued messages to the connected client, and refusing the first connections"""
+    def __init__(self, refused=0):
+        self.refused = refused
+        self.connections = 0
+        self.subscriptions = []
+        self.messages = asyncio.Queue()
+
+    def publish(self, topic, payload):
+        self.messages.put_nowait(FakeMessage(topic, payload))
+
+    def disconnect(self):
+        self.messages.put_nowait(None)
+
+    def connect(self):
+        return FakeClient(self)
+
+
+class FakeClient:
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def __aenter__(self):
+        self.broker.connections += 1
+        if self.broker.connections <= self.broker.refused:
+            raise ConnectionRefusedError('connection refused')
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def subscribe(self, topic):
+        self.broker.subscriptions.append(topic)
+
+    @property
+    async def messages(self):
+        while True:
+            message = await self.broker.messages.get()
+            if message is None:
+                raise ConnectionResetError('connection lost')
+            yield message
+
+
+class FakeCollection:
+    """Async collection storing the documents, whose bulk inserts wait until they are released"""
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.documents = []
+        self.released = asyncio.Event()
+        self.released.set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def insert_many(self, documents, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('not primary')
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await self.released.wait()
+            self.documents.extend(documents)
+        finally:
+            self.in_flight -= 1
+
+
+class FakeMotorCollection:
+    """Async collection (such as motor) whose bulk writes only fail once they are awaited"""
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        self.bulk_writes = 0
+
+    async def bulk_write(self, requests, ordered=True):
+        self.bulk_writes += 1
+        return self.collection.bulk_write(requests, ordered=ordered)
+
+
+class PartlyFailingCollection:
+    """Async collection failing to insert the documents at some indexes of each batch"""
+    def __init__(self, failed):
+        self.failed = failed
+
+    async def insert_many(self, documents, ordered=True):
+        raise BulkWriteError({'writeErrors': [{'index': index, 'code': 121, 'errmsg': 'invalid'}
+                                              for index in self.failed],
+                              'nInserted': len(documents) - len(self.failed)})
+
+
+def fast_backoff():
+    return Backoff(initial=0.001, maximum=0.01)
+
+
+async def wait_until(condition, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition() and loop.time() < deadline:
+        await asyncio.sleep(0.005)
+    assert condition()
+
+
+def test_messages_are_decoded_and_written():
+    """
+    GIVEN an ingest service connected to a broker
+    WHEN valid and invalid messages are published, and the service is stopped
+    THEN check that the valid messages are written and the invalid ones counted
+    """
+    async def scenario():
+        broker = FakeBroker()
+        collection = FakeCollection()
+        async with ingest_service(broker.connect, collection, concurrency=2, batch_size=10,
+                                  max_delay=0.01, backoff=fast_backoff) as service:
+            for index in range(25):
+                broker.publish('telemetry/device1/temp', payload(str(index)))
+            broker.publish('telemetry/device1/temp', b'not json')
+            await wait_until(lambda: service.messages_received == 26)
+        return broker, collection, service
+
+    broker, collection, service = asyncio.run(scenario())
+    assert broker.subscriptions == ['#']
+    assert sorted(int(telemetry.value) for telemetry in collection.documents) == list(range(25))
+    assert collection.documents[0].device_id == 'device1'
+    assert service.documents_written == 25
+    assert service.messages_invalid == 1
+
+
+def test_reconnects_with_backoff():
+    """
+    GIVEN a broker refusing the first two connections, and dropping the connection later
+    WHEN the ingest service runs
+    THEN check that it reconnects and keeps receiving the messages
+    """
+    async def scenario():
+        broker = FakeBroker(refused=2)
+        collection = FakeCollection()
+        async with ingest_service(broker.connect, collection, max_delay=0.01, backoff=fast_backoff) as service:
+            broker.publish('telemetry/device1/temp', payload('1'))
+            await wait_until(lambda: service.messages_received == 1)
+            broker.disconnect()
+            broker.publish('telemetry/device1/temp', payload('2'))
+            await wait_until(lambda: service.messages_received == 2)
+        return broker, collection, service
+
+    broker, collection, service = asyncio.run(scenario())
+    assert broker.connections == 4
+    assert service.reconnects == 3
+    assert len(collection.documents) == 2
+
+
+def test_concurrent_writes():
+    """
+    GIVEN an ingest service with a concurrency of 4 and a database that does not answer yet
+    WHEN many messages are received
+    THEN check that 4 bulk writes are in flight at the same time, and all documents are written once released
+    """
+    async def scenario():
+        broker = FakeBroker()
+        collection = FakeCollection()
+        collection.released.clear()
+        async with ingest_service(broker.connect, collection, concurrency=4, batch_size=5,
+                                  max_delay=0.01, backoff=fast_backoff) as service:
+            for index in range(100):
+                broker.publish('telemetry/device1/temp', payload(str(index)))
+            await wait_until(lambda: collection.in_flight == 4)
+            collection.released.set()
+            await wait_until(lambda: service.messages_received == 100)
+        return collection, service
+
+    collection, service = asyncio.run(scenario())
+    assert collection.max_in_flight == 4
+    assert len(collection.documents) == 100
+
+
+def test_bulk_writes_are_retried_after_losing_the_connection():
+    """
+    GIVEN a database losing the connection for the first two bulk writes
+    WHEN documents are written
+    THEN check that the write is retried until it succeeds
+    """
+    async def scenario():
+        service = AsyncIngestService(FakeBroker().connect, FakeCollection(failures=2), backoff=fast_backoff)
+        await service._write([{'value': 1.0}])
+        return service
+
+    service = asyncio.run(scenario())
+    assert service.documents_written == 1
+    assert service.storage.documents == [{'value': 1.0}]
+
+
+def test_rollups_are_flushed_when_the_service_stops():
+    """
+    GIVEN an ingest service with rollups that are not flushed in the background
+    WHEN messages are received and the service is stopped
+    THEN check that the rollups of the messages are written
+    """
+    async def scenario():
+        broker = FakeBroker()
+        async with ingest_service(broker.connect, FakeCollection(), max_delay=0.01, backoff=fast_backoff,
+                                  rollups=rollups) as service:
+            for index in range(10):
+                broker.publish('telemetry/device1/temp', payload(str(index)))
+            await wait_until(lambda: service.messages_received == 10)
+
+    database = mongomock.MongoClient().mqtt_data
+    rollups = RollupAggregator(database, 'Data', flush_interval=None)
+    asyncio.run(scenario())
+    # The messages are received now, possibly across the end of an hour
+    hours = list(database.Data_rollup_1h.find())
+    assert sum(rollup['count'] for rollup in hours) == 10
+    assert sum(rollup['sum'] for rollup in hours) == 45.0
+    assert min(rollup['min'] for rollup in hours) == 0.0
+
+
+def test_buckets_written_again_are_not_lost():
+    """
+    GIVEN an ingest service writing to buckets through an async collection
+    WHEN the same batch is written twice (the second time failing with a duplicate key), then a new reading
+    THEN check that each reading is stored once, and that none of them are counted as failed
+    """
+    async def scenario():
+        service = AsyncIngestService(FakeBroker().connect, storage_for('buckets', buckets, asynchronous=True),
+                                     backoff=fast_backoff)
+        batch = [decode_telemetry('telemetry/device1/temp', payload(str(index)), received) for index in range(3)]
+        await service._write(batch)
+        await service._write(batch)
+        await service._write([decode_telemetry('telemetry/device1/temp', payload('3'), received)])
+        return service
+
+    collection = mongomock.MongoClient().mqtt_data.Buckets
+    storage_for('buckets', collection).ensure_indexes()
+    buckets = FakeMotorCollection(collection)
+    received = datetime(2019, 5, 6, 10, 5)
+    service = asyncio.run(scenario())
+    assert buckets.bulk_writes == 4
+    assert service.documents_written == 7
+    assert service.documents_failed == 0
+    bucket = collection.find_one()
+    assert bucket['count'] == 4
+    assert len(bucket['readings']) == 4
+
+
+def test_only_the_documents_written_are_rolled_up():
+    """
+    GIVEN an ingest service with rollups, and a database failing to insert some documents of a batch
+    WHEN a batch is written
+    THEN check that only the values of the documents written are added to the rollups
+    """
+    async def scenario():
+        service = AsyncIngestService(FakeBroker().connect, PartlyFailingCollection(failed=[1]), backoff=fast_backoff,
+                                     rollups=rollups)
+        await service._write([decode_telemetry('telemetry/device1/temp', payload(str(value)), received)
+                              for value in (1, 2, 3)])
+        return service
+
+    rollups = RollupAggregator(mongomock.MongoClient().mqtt_data, 'Data', flush_interval=None)
+    received = datetime(2019, 5, 6, 10, 5)
+    service = asyncio.run(scenario())
+    assert service.documents_written == 2
+    assert service.documents_failed == 1
+    assert rollups.values_added == 2
+    rollups.flush()
+    assert rollups.collections['1m'].find_one()['sum'] == 4.0
+
+
+def test_rollups_are_opened_in_a_thread_and_closed_when_the_service_stops(monkeypatch):
+    """
+    GIVEN rollups writing in the background, opened for the service
+    WHEN the service is stopped
+    THEN check that their indexes were created outside of the event loop, and that the rollups are closed
+    """
+    def create_index(self, keys, **options):
+        threads.append(threading.current_thread())
+        return create_index_in_mongomock(self, keys, **options)
+
+    async def scenario():
+        rollups = await open_async_rollups('127.0.0.1:27017', 'mqtt_data', 'Data', flush_interval=60)
+        async with ingest_service(FakeBroker().connect, FakeCollection(), max_delay=0.01, backoff=fast_backoff,
+                                  rollups=rollups):
+            pass
+        return rollups
+
+    threads = []
+    client = mongomock.MongoClient()
+    create_index_in_mongomock = mongomock.collection.Collection.create_index
+    monkeypatch.setattr(mongomock.collection.Collection, 'create_index', create_index)
+    monkeypatch.setattr('ingest.async_service.MongoClient', lambda uri: client)
+    rollups = asyncio.run(scenario())
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+    assert rollups._thread is None
@@ -0,0 +1,32 @@
+"""
+This file (test_benchmarks.py) contains the smoke tests for the entry points of the benchmarks.
+"""
+import os
+import pytest
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                              'benchmarks')
+
+
+@pytest.mark.parametrize('script, arguments', [
+    ('captcha_benchmark.py', ['--count', '4', '--workers', '1']),
+    ('captcha_encoder_benchmark.py', ['--count', '4']),
+    ('copy_backend_benchmark.py', ['--files', '1', '--size', '1', '--tmpdir', '{tmpdir}']),
+    ('copy_benchmark.py', ['--files', '20', '--size', '1024', '--workers', '2', '--tmpdir', '{tmpdir}']),
+    ('date_patterns_benchmark.py', ['--names', '100']),
+    ('metadata_benchmark.py', ['--files', '2', '--size', '1024']),
+    ('telemetry_benchmark.py', ['--count', '100', '--devices', '5']),
+])
+def test_benchmark_runs(tmpdir, script, arguments):
+    """
+    GIVEN a benchmark script
+    WHEN it is run with a small workload
+    THEN check that it completes and reports its results
+    """
+    arguments = [argument.format(tmpdir=str(tmpdir)) for argument in arguments]
+    result = subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, script)] + arguments,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout
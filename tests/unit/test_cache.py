@@ -0,0 +1,102 @@
+"""
+This file (test_cache.py) contains the unit tests for the ScanCache class in the cache.py file.
+"""
+from rosh.cache import ScanCache
+from rosh.directory import Directory
+from rosh.file import File
+import os
+
+
+def test_cache_lookup_and_store(tmpdir):
+    """
+    GIVEN a new scan cache
+    WHEN a file is stored in the cache
+    THEN check that the file is found in the cache after the cache is re-opened
+    """
+    picture = tmpdir.join('IMG_0001.JPG')
+    picture.write_binary(b'picture')
+    cache_path = str(tmpdir.join('cache.sqlite3'))
+
+    with ScanCache(cache_path) as cache:
+        assert cache.lookup(str(picture), os.stat(str(picture))) is None
+        cache.store(str(picture), os.stat(str(picture)), '2019-05-06', 'Picture')
+
+    with ScanCache(cache_path) as cache:
+        assert cache.lookup(str(picture), os.stat(str(picture))) == ('2019-05-06', 'Picture')
+        assert cache.hits == 1
+        assert cache.misses == 0
+
+
+def test_cache_modified_file_is_invalid(tmpdir):
+    """
+    GIVEN a scan cache containing a file
+    WHEN the file is modified
+    THEN check that the cached entry for the file is no longer used
+    """
+    picture = tmpdir.join('IMG_0001.JPG')
+    picture.write_binary(b'picture')
+    cache_path = str(tmpdir.join('cache.sqlite3'))
+
+    with ScanCache(cache_path) as cache:
+        cache.store(str(picture), os.stat(str(picture)), '2019-05-06', 'Picture')
+
+    picture.write_binary(b'modified picture')
+    with ScanCache(cache_path) as cache:
+        assert cache.lookup(str(picture), os.stat(str(picture))) is None
+        assert cache.misses == 1
+
+
+def test_cache_rebuild_and_size_limit(tmpdir):
+    """
+    GIVEN a scan cache containing files
+    WHEN the cache is limited in size or rebuilt
+    THEN check that the oldest files are removed or that all the files are removed
+    """
+    cache_path = str(tmpdir.join('cache.sqlite3'))
+    stat_result = os.stat(str(tmpdir))
+
+    with ScanCache(cache_path, max_entries=3) as cache:
+        for index in range(5):
+            cache.store(f'/pictures/IMG_{index:04d}.JPG', stat_result, '2019-05-06', 'Picture')
+            cache.flush()
+
+    with ScanCache(cache_path) as cache:
+        assert len(cache) == 3
+        assert cache.lookup('/pictures/IMG_0000.JPG', stat_result) is None
+        assert cache.lookup('/pictures/IMG_0004.JPG', stat_result) == ('2019-05-06', 'Picture')
+
+    with ScanCache(cache_path, rebuild=True) as cache:
+        assert len(cache) == 0
+
+
+def test_directory_with_cache_skips_unchanged_files(tmpdir, monkeypatch):
+    """
+    GIVEN a directory of undated files that was scanned with a scan cache
+    WHEN the directory is scanned a second time
+    THEN check that the metadata is not extracted again for the unchanged files
+    """
+    source = tmpdir.mkdir('source')
+    source.join('IMG_0001.JPG').write_binary(b'picture')
+    source.join('IMG_0002.MOV').write_binary(b'video')
+    cache_path = str(tmpdir.join('cache.sqlite3'))
+    extracted = []
+
+    def fake_extract_creation_data_from_metadata(self):
+        extracted.append(self.filename_with_path)
+        return '2019-05-06'
+
+    monkeypatch.setattr(File, 'extract_creation_data_from_metadata', fake_extract_creation_data_from_metadata)
+
+    Directory(str(source), str(tmpdir.join('Pictures')), str(tmpdir.join('Videos')), cache_path=cache_path).files
+    assert len(extracted) == 2
+
+    new_directory = Directory(str(source), str(tmpdir.join('Pictures')), str(tmpdir.join('Videos')),
+                              cache_path=cache_path)
+    assert len(extracted) == 2
+    assert [file.date_created for file in new_directory.files] == ['2019-05-06', '2019-05-06']
+    assert all(file.destination_directory.endswith(os.path.join('2019', '2019-05-06'))
+               for file in new_directory.files)
+
+    Directory(str(source), str(tmpdir.join('Pictures')), str(tmpdir.join('Videos')),
+              cache_path=cache_path, rebuild_cache=True).files
+    assert len(extracted) == 4
@@ -0,0 +1,65 @@
+"""
+This file (test_copy_backend.py) contains the unit tests for the CopyBackend class in the copy_backend.py file.
+"""
+from rosh.copy_backend import CopyBackend, COPY_STRATEGIES
+import errno
+import os
+import pytest
+
+
+@pytest.mark.parametrize('strategy', ['copy_file_range', 'sendfile', 'buffered'])
+def test_copy_with_strategy(tmpdir, strategy):
+    """
+    GIVEN a copy backend with a single copy strategy
+    WHEN a file is copied to a destination directory
+    THEN check that the contents and the modification time of the file are copied, and its size returned
+    """
+    if strategy == 'copy_file_range' and not hasattr(os, 'copy_file_range'):
+        pytest.skip('copy_file_range is not available')
+    if strategy == 'sendfile' and not hasattr(os, 'sendfile'):
+        pytest.skip('sendfile is not available')
+
+    contents = os.urandom(3 * 1024 * 1024 + 17)
+    video = tmpdir.join('IMG_0036.MOV')
+    video.write_binary(contents)
+    os.utime(str(video), (1546956400, 1546956400))
+    destination = tmpdir.mkdir('Videos')
+
+    copy_backend = CopyBackend([strategy])
+    try:
+        assert copy_backend.copy_contents(str(video), str(destination.join('contents.MOV'))) == strategy
+    except OSError as exception:
+        pytest.skip(f'{strategy} is not supported on this filesystem: {exception}')
+    new_file = str(destination.join('IMG_0036.MOV'))
+    assert copy_backend.copy(str(video), new_file) == len(contents)
+    assert destination.join('IMG_0036.MOV').read_binary() == contents
+    assert os.stat(new_file).st_mtime == 1546956400
+
+
+def test_copy_falls_back_to_next_strategy(tmpdir, monkeypatch):
+    """
+    GIVEN a copy backend whose first copy strategy is not supported
+    WHEN a file is copied
+    THEN check that the next copy strategy is used and that no partial contents are left
+    """
+    def unsupported_copy(source_fd, destination_fd, size):
+        os.write(destination_fd, b'partial')
+        raise OSError(errno.EXDEV, 'Cross-device link')
+
+    monkeypatch.setitem(COPY_STRATEGIES, 'copy_file_range', unsupported_copy)
+    picture = tmpdir.join('IMG_0001.JPG')
+    picture.write_binary(b'picture contents')
+
+    copy_backend = CopyBackend(['copy_file_range', 'buffered'])
+    assert copy_backend.copy_contents(str(picture), str(tmpdir.join('copy.JPG'))) == 'buffered'
+    assert tmpdir.join('copy.JPG').read_binary() == b'picture contents'
+
+
+def test_copy_backend_unknown_strategy():
+    """
+    GIVEN a list of copy strategies containing an unknown strategy
+    WHEN the copy backend is created
+    THEN check that a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        CopyBackend(['rsync'])
@@ -0,0 +1,72 @@
+"""
+This file (test_date_patterns.py) contains the unit tests for the date_patterns.py file.
+"""
+from rosh import date_patterns
+from rosh.date_patterns import parse_date, register_date_pattern
+from rosh.file import File
+import pytest
+
+
+@pytest.mark.parametrize('name, expected_date', [
+    ('2018-08-22', '2018-08-22'),
+    ('2018_08_23', '2018-08-23'),
+    ('2019-05-04_12-54-13_IMG_3413.JPG', '2019-05-04'),
+    ('20190504_125413.jpg', '2019-05-04'),
+    ('IMG_20180822_123456.jpg', '2018-08-22'),
+    ('PXL_20230101_101010123.jpg', '2023-01-01'),
+    ('VID_20190101_120000.MOV', '2019-01-01'),
+    ('IMG-20190311-WA0007.jpg', '2019-03-11'),
+    ('Screenshot_2019-05-06-10-11-12.jpg', '2019-05-06'),
+    ('WhatsApp Image 2020-02-29 at 10.11.12.jpeg', '2020-02-29'),
+])
+def test_parse_date(name, expected_date):
+    """
+    GIVEN a file or folder name containing a date
+    WHEN the date is parsed from the name
+    THEN check the date is found and formatted as "yyyy-mm-dd"
+    """
+    assert parse_date(name) == expected_date
+
+
+@pytest.mark.parametrize('name', [
+    'IMG_0016.JPG',
+    'iPhone8',
+    '2019 Vacation',
+    'IMG_20181322_123456.jpg',
+    'IMG_20190230_123456.jpg',
+    'DSC_120190101.JPG',
+    '2019-05.jpg',
+])
+def test_parse_date_no_valid_date(name):
+    """
+    GIVEN a file or folder name without a valid date
+    WHEN the date is parsed from the name
+    THEN check that no date is found
+    """
+    assert parse_date(name) == ''
+
+
+def test_register_date_pattern(monkeypatch):
+    """
+    GIVEN a new date pattern (dd.mm.yyyy)
+    WHEN the date pattern is registered
+    THEN check the date is found in a name using the new date pattern
+    """
+    monkeypatch.setattr(date_patterns, 'DATE_PATTERNS', list(date_patterns.DATE_PATTERNS))
+    assert parse_date('Party 31.12.2019') == ''
+    register_date_pattern(r'(?P<day>\d{2})\.(?P<month>\d{2})\.(?P<year>\d{4})')
+    assert parse_date('Party 31.12.2019') == '2019-12-31'
+
+    with pytest.raises(ValueError):
+        register_date_pattern(r'(?P<year>\d{4})')
+
+
+def test_extract_date_from_path():
+    """
+    GIVEN the path of a file
+    WHEN the date is extracted from the path
+    THEN check the date in the folder name is used before the date in the file name
+    """
+    assert File.extract_date_from_path('/Users/me/Pictures/2019_05_06/IMG_20180822_123456.jpg') == '2019-05-06'
+    assert File.extract_date_from_path('/Users/me/Pictures/iPhone8/IMG_20180822_123456.jpg') == '2018-08-22'
+    assert File.extract_date_from_path('IMG_0016.JPG') == ''
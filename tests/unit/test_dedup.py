@@ -0,0 +1,158 @@
+"""
+This file (test_dedup.py) contains the unit tests for the DedupIndex class in the dedup.py file.
+"""
+from rosh.dedup import DedupIndex, PARTIAL_HASH_SIZE
+from rosh.directory import Directory
+from rosh.file import File
+import rosh.dedup
+import os
+import threading
+
+
+def test_find_duplicate_renamed_file(tmpdir):
+    """
+    GIVEN an index of a destination directory
+    WHEN a file with the same contents but a different name is checked
+    THEN check that the file is found to be a duplicate
+    """
+    library = tmpdir.mkdir('Pictures').mkdir('2019').mkdir('2019-05-06')
+    contents = os.urandom(4 * PARTIAL_HASH_SIZE)
+    library.join('IMG_0001.JPG').write_binary(contents)
+    new_picture = tmpdir.join('renamed.JPG')
+    new_picture.write_binary(contents)
+
+    dedup_index = DedupIndex([str(tmpdir.join('Pictures'))])
+    assert len(dedup_index) == 1
+    assert dedup_index.find_duplicate(str(new_picture)) == str(library.join('IMG_0001.JPG'))
+
+
+def test_find_duplicate_same_partial_hash(tmpdir):
+    """
+    GIVEN an index of a destination directory
+    WHEN a file with the same size, first and last blocks (but different contents) is checked
+    THEN check that the file is not found to be a duplicate
+    """
+    library = tmpdir.mkdir('Pictures')
+    contents = bytearray(os.urandom(4 * PARTIAL_HASH_SIZE))
+    library.join('IMG_0001.JPG').write_binary(bytes(contents))
+    contents[2 * PARTIAL_HASH_SIZE] ^= 0xFF
+    new_picture = tmpdir.join('IMG_0002.JPG')
+    new_picture.write_binary(bytes(contents))
+
+    dedup_index = DedupIndex([str(library)])
+    assert dedup_index.find_duplicate(str(new_picture)) == ''
+
+
+def test_add_unless_duplicate(tmpdir):
+    """
+    GIVEN an empty index
+    WHEN the same file is added twice
+    THEN check that the second addition is found to be a duplicate of the first one
+    """
+    picture = tmpdir.join('IMG_0001.JPG')
+    picture.write_binary(os.urandom(1024))
+
+    dedup_index = DedupIndex([str(tmpdir.join('Pictures'))])
+    assert dedup_index.add_unless_duplicate(str(picture), '/Pictures/IMG_0001.JPG') == ''
+    assert dedup_index.add_unless_duplicate(str(picture), '/Pictures/IMG_0002.JPG') == '/Pictures/IMG_0001.JPG'
+    dedup_index.remove('/Pictures/IMG_0001.JPG')
+    assert dedup_index.find_duplicate(str(picture)) == ''
+
+
+def test_copy_files_with_deduplication(tmpdir):
+    """
+    GIVEN a directory containing a renamed duplicate and a different picture with an existing name
+    WHEN the files are copied with deduplication
+    THEN check that the duplicate is skipped and the different picture is copied with a new name
+    """
+    destination = tmpdir.mkdir('Pictures').mkdir('2019').mkdir('2019-05-06')
+    existing = os.urandom(2048)
+    destination.join('IMG_0001.JPG').write_binary(existing)
+
+    source = tmpdir.mkdir('source').mkdir('2019_05_06')
+    source.join('IMG_0001.JPG').write_binary(os.urandom(2048))
+    source.join('IMG_0100.JPG').write_binary(existing)
+    source.join('IMG_0101.JPG').write_binary(existing)
+
+    new_directory = Directory(str(tmpdir.join('source')), str(tmpdir.join('Pictures')), str(tmpdir.join('Videos')))
+    new_directory.copy_files(deduplicate=True)
+    assert new_directory.files_copied == 1
+    assert new_directory.files_not_copied == 2
+    assert sorted(os.listdir(str(destination))) == ['IMG_0001.JPG', 'IMG_0001_1.JPG']
+    assert destination.join('IMG_0001_1.JPG').read_binary() == source.join('IMG_0001.JPG').read_binary()
+
+
+def test_copy_to_destination_directory_duplicate(tmpdir):
+    """
+    GIVEN a picture file whose contents are already in the index
+    WHEN the file is copied with the index
+    THEN check that the file is not copied and the duplicate is recorded
+    """
+    source = tmpdir.mkdir('2019_05_06')
+    source.join('IMG_0001.JPG').write_binary(b'picture')
+    source.join('IMG_0002.JPG').write_binary(b'picture')
+    dedup_index = DedupIndex([str(tmpdir.join('Pictures'))])
+
+    first_file = File(str(source.join('IMG_0001.JPG')), str(tmpdir.join('Pictures')))
+    first_file.copy_to_destination_directory(dedup_index)
+    second_file = File(str(source.join('IMG_0002.JPG')), str(tmpdir.join('Pictures')))
+    second_file.copy_to_destination_directory(dedup_index)
+    assert first_file.copy_successful == True
+    assert second_file.copy_successful == False
+    assert second_file.duplicate_of == os.path.join(first_file.destination_directory, 'IMG_0001.JPG')
+
+
+def test_files_are_hashed_without_holding_the_index(tmpdir, monkeypatch):
+    """
+    GIVEN an index, and a file of the same size as an indexed file being hashed by another thread
+    WHEN a file of another size is added while the hash is computed
+    THEN check that the addition does not wait for the hash
+    """
+    picture = tmpdir.join('IMG_0001.JPG')
+    picture.write_binary(os.urandom(1024))
+    same_size = tmpdir.join('IMG_0002.JPG')
+    same_size.write_binary(os.urandom(1024))
+    other_size = tmpdir.join('IMG_0003.JPG')
+    other_size.write_binary(os.urandom(2048))
+    dedup_index = DedupIndex([str(tmpdir.join('Pictures'))])
+    dedup_index.add(str(picture))
+
+    hashing = threading.Event()
+    release = threading.Event()
+    partial_hash = rosh.dedup.partial_hash
+
+    def slow_partial_hash(filename, size):
+        hashing.set()
+        release.wait(5)
+        return partial_hash(filename, size)
+    monkeypatch.setattr(rosh.dedup, 'partial_hash', slow_partial_hash)
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+        dedup_index.add_unless_duplicate(str(same_size), '/Pictures/IMG_0002.JPG')))
+    thread.start()
+    assert hashing.wait(5)
+    assert dedup_index.add_unless_duplicate(str(other_size), '/Pictures/IMG_0003.JPG') == ''
+    assert not release.is_set()
+    release.set()
+    thread.join()
+    assert results == ['']
+    assert len(dedup_index) == 3
+
+
+def test_copy_files_with_the_same_name_in_parallel(tmpdir):
+    """
+    GIVEN files with the same name and date but different contents
+    WHEN they are copied with deduplication by a pool of threads
+    THEN check that each file is copied, with its own name
+    """
+    source = tmpdir.mkdir('source')
+    for index in range(8):
+        source.mkdir(f'camera{index}').mkdir('2019_05_06').join('IMG_0001.JPG').write_binary(os.urandom(1024))
+    new_directory = Directory(str(tmpdir.join('source')),  # Source Directory
+                              str(tmpdir.join('Pictures')),  # Destination Directory (Pictures)
+                              str(tmpdir.join('Videos')))    # Destination Directory (Videos)
+    new_directory.copy_files(max_workers=8, deduplicate=True)
+    assert new_directory.files_copied == 8
+    assert sorted(os.listdir(str(tmpdir.join('Pictures', '2019', '2019-05-06')))) == \
+        ['IMG_0001.JPG'] + [f'IMG_0001_{index}.JPG' for index in range(1, 8)]
@@ -0,0 +1,77 @@
+"""
+This file (test_destination.py) contains the unit tests for the DestinationDirectories class in the destination.py file.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from rosh.destination import DestinationDirectories
+from rosh.file import File
+import os
+
+
+def test_prepare_creates_and_lists_directories(tmpdir):
+    """
+    GIVEN destination directories that partly exist
+    WHEN the destination directories are prepared
+    THEN check that the missing directories are created and the existing files are listed
+    """
+    existing = tmpdir.mkdir('2019').mkdir('2019-05-06')
+    existing.join('IMG_0001.JPG').write('picture')
+    missing = os.path.join(str(tmpdir), '2019', '2019-05-07')
+
+    destinations = DestinationDirectories()
+    destinations.prepare([str(existing), missing, str(existing)])
+    assert len(destinations) == 2
+    assert os.path.isdir(missing)
+    assert destinations.contains(str(existing), 'IMG_0001.JPG')
+    assert not destinations.contains(missing, 'IMG_0001.JPG')
+
+
+def test_contains_does_not_access_the_filesystem(tmpdir):
+    """
+    GIVEN a destination directory that was listed
+    WHEN files are added to (or removed from) the directory afterwards
+    THEN check that only the files recorded by the class are considered to exist
+    """
+    directory = tmpdir.mkdir('2019-05-06')
+    destinations = DestinationDirectories()
+    destinations.ensure(str(directory))
+    directory.join('IMG_0001.JPG').write('picture')
+    assert not destinations.contains(str(directory), 'IMG_0001.JPG')
+    destinations.add(str(directory), 'IMG_0002.JPG')
+    assert destinations.contains(str(directory), 'IMG_0002.JPG')
+
+
+def test_copy_to_destination_directory_with_destinations(tmpdir):
+    """
+    GIVEN a picture file and the destination directories
+    WHEN the file is copied twice using the destination directories
+    THEN check that the file is copied only the first time
+    """
+    source = tmpdir.mkdir('2019_05_06')
+    source.join('IMG_0001.JPG').write('picture')
+    destinations = DestinationDirectories()
+
+    new_file = File(str(source.join('IMG_0001.JPG')), str(tmpdir.join('Pictures')))
+    new_file.copy_to_destination_directory(destinations=destinations)
+    assert new_file.copy_successful == True
+    assert destinations.contains(new_file.destination_directory, 'IMG_0001.JPG')
+
+    new_file = File(str(source.join('IMG_0001.JPG')), str(tmpdir.join('Pictures')))
+    new_file.copy_to_destination_directory(destinations=destinations)
+    assert new_file.copy_successful == False
+
+
+def test_names_are_reserved_once(tmpdir):
+    """
+    GIVEN a destination directory containing a file
+    WHEN the same name is reserved by several threads at the same time, and one reservation is discarded
+    THEN check that each thread gets its own name, and that the discarded name is free again
+    """
+    directory = tmpdir.mkdir('2019-05-06')
+    directory.join('IMG_0001.JPG').write('picture')
+    destinations = DestinationDirectories()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        names = list(executor.map(lambda _: destinations.reserve_unique(str(directory), 'IMG_0001.JPG'), range(16)))
+    assert sorted(names) == sorted(f'IMG_0001_{index}.JPG' for index in range(1, 17))
+    assert not destinations.add_unless_exists(str(directory), 'IMG_0001_3.JPG')
+    destinations.discard(str(directory), 'IMG_0001_3.JPG')
+    assert destinations.add_unless_exists(str(directory), 'IMG_0001_3.JPG')
@@ -1,13 +1,17 @@
 """
 This file (test_directory.py) contains the unit tests for the Directory class in the directory.py file.
 """
-from bild.directory import Directory
+from rosh.directory import Directory
+from rosh.metadata import extract_creation_dates
 import os
 import pytest
 
 
 FIXTURE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_files', '')
 
+# Process running the tests (unlike the processes of the metadata stage)
+TEST_PROCESS = os.getpid()
+
 
 def test_new_directory_nominal():
     """
@@ -72,3 +76,145 @@ def test_new_directory_without_date(datafiles, tmpdir):
         assert new_directory.files_copied == 0
         assert new_directory.files_not_copied == 2
 
+
+
+def test_copy_files_in_parallel(tmpdir):
+    """
+    GIVEN a new directory containing the date in the directory name
+    WHEN the files are copied using a pool of threads
+    THEN check that the files are all copied and the copy results are counted correctly
+    """
+    source = tmpdir.mkdir('source').mkdir('2019_05_06')
+    for index in range(20):
+        source.join(f'IMG_{index:04d}.JPG').write_binary(os.urandom(1024))
+    source.join('IMG_9999.MOV').write_binary(os.urandom(1024))
+    backup_pictures = tmpdir.mkdir('Pictures')
+    backup_videos = tmpdir.mkdir('Videos')
+    new_directory = Directory(str(tmpdir.join('source')),  # Source Directory
+                              str(backup_pictures),        # Destination Directory (Pictures)
+                              str(backup_videos))          # Destination Directory (Videos)
+    new_directory.copy_files(max_workers=4, max_copies_per_destination=2)
+    assert new_directory.files_copied == 21
+    assert new_directory.files_not_copied == 0
+    assert len(backup_pictures.join('2019', '2019-05-06').listdir()) == 20
+    assert len(backup_videos.join('2019', '2019-05-06').listdir()) == 1
+
+    # Try copying the files a second time to confirm that none are copied
+    new_directory.files_copied = 0
+    new_directory.files_not_copied = 0
+    new_directory.copy_files(max_workers=4)
+    assert new_directory.files_copied == 0
+    assert new_directory.files_not_copied == 21
+
+
+def test_copy_files_while_discovering(tmpdir):
+    """
+    GIVEN a new directory whose list of files has not been built
+    WHEN the files are copied
+    THEN check that the files are copied as they are discovered and that the summary is counted
+    """
+    source = tmpdir.mkdir('source').mkdir('2019_05_06')
+    for index in range(10):
+        source.join(f'IMG_{index:04d}.JPG').write_binary(os.urandom(1024))
+    source.join('IMG_9999.MOV').write_binary(os.urandom(1024))
+    source.join('notes.txt').write('not a picture')
+    new_directory = Directory(str(tmpdir.join('source')),  # Source Directory
+                              str(tmpdir.join('Pictures')),  # Destination Directory (Pictures)
+                              str(tmpdir.join('Videos')))    # Destination Directory (Videos)
+    assert new_directory.number_of_files == 0
+    new_directory.copy_files()
+    assert new_directory._files is None
+    assert new_directory.number_of_files == 11
+    assert new_directory.number_of_picture_files == 10
+    assert new_directory.number_of_video_files == 1
+    assert new_directory.files_copied == 11
+    assert new_directory.files_not_copied == 0
+
+    new_directory.files_copied = 0
+    new_directory.copy_files(max_workers=4)
+    assert new_directory._files is None
+    assert new_directory.number_of_files == 11
+    assert new_directory.files_copied == 0
+    assert new_directory.files_not_copied == 11
+
+
+def test_files_are_yielded_as_they_are_found(tmpdir):
+    """
+    GIVEN a new directory with files in several sub-directories
+    WHEN the first file is taken from the files found
+    THEN check that it is yielded before the other files are found
+    """
+    source = tmpdir.mkdir('source')
+    for name in ('2019_05_06', '2019_05_07', '2019_05_08'):
+        source.mkdir(name).join('IMG_0001.JPG').write_binary(os.urandom(1024))
+    new_directory = Directory(str(source),                  # Source Directory
+                              str(tmpdir.join('Pictures')),  # Destination Directory (Pictures)
+                              str(tmpdir.join('Videos')))    # Destination Directory (Videos)
+    files = new_directory.iter_files()
+    next(files)
+    assert new_directory.number_of_files == 1
+    assert len(list(files)) == 2
+    assert new_directory.number_of_files == 3
+
+
+def test_metadata_stage(tmpdir):
+    """
+    GIVEN a new directory without the date in the directory name, using a metadata stage
+    WHEN the files are copied
+    THEN check that the metadata is extracted by the pool of processes before the files are copied
+    """
+    source = tmpdir.mkdir('source')
+    source.join('IMG_0001.JPG').write_binary(os.urandom(1024))
+    source.join('IMG_20190506_101112.JPG').write_binary(os.urandom(1024))
+    new_directory = Directory(str(source),                  # Source Directory
+                              str(tmpdir.join('Pictures')),  # Destination Directory (Pictures)
+                              str(tmpdir.join('Videos')),    # Destination Directory (Videos)
+                              metadata_workers=2,
+                              metadata_batch_size=1)
+    new_directory.copy_files()
+    assert new_directory.files_copied == 2
+    assert all(not file.needs_metadata for file in new_directory.files)
+    assert sorted(file.date_created for file in new_directory.files) == ['', '2019-05-06']
+    assert tmpdir.join('Pictures', 'Date_Unknown', 'IMG_0001.JPG').check()
+    assert new_directory.metrics.report()['stages']['metadata']['count'] == 1
+
+
+def crash_metadata_process(filenames, timeout):
+    """Ends the metadata process abruptly, breaking its pool (but extracts the metadata in the process of the tests)"""
+    if os.getpid() != TEST_PROCESS:
+        os._exit(1)
+    return extract_creation_dates(filenames, timeout)
+
+
+def test_metadata_stage_falls_back_when_the_processes_fail(tmpdir, monkeypatch, caplog):
+    """
+    GIVEN a new directory without the date in the directory name, using a metadata stage
+    WHEN the processes of the metadata stage crash
+    THEN check that the metadata is extracted in this process instead (with the timeout of the stage, counting
+         its durations and hachoir runs), and that the files are copied
+    """
+    def read_creation_date_with_hachoir(filename, timeout=None):
+        timeouts.append(timeout)
+        return ''
+
+    timeouts = []
+    monkeypatch.setattr('rosh.directory.extract_creation_dates', crash_metadata_process)
+    monkeypatch.setattr('rosh.metadata.read_creation_date_with_hachoir', read_creation_date_with_hachoir)
+    source = tmpdir.mkdir('source')
+    source.join('IMG_0001.JPG').write_binary(os.urandom(1024))
+    source.join('IMG_0002.JPG').write_binary(os.urandom(1024))
+    new_directory = Directory(str(source),                  # Source Directory
+                              str(tmpdir.join('Pictures')),  # Destination Directory (Pictures)
+                              str(tmpdir.join('Videos')),    # Destination Directory (Videos)
+                              metadata_workers=2,
+                              metadata_batch_size=1,
+                              metadata_timeout=5.0)
+    new_directory.copy_files()
+    assert new_directory.files_copied == 2
+    assert all(not file.needs_metadata for file in new_directory.files)
+    assert len(tmpdir.join('Pictures', 'Date_Unknown').listdir()) == 2
+    assert 'Metadata Exception' in caplog.text
+    assert timeouts == [5.0, 5.0]
+    report = new_directory.metrics.report()
+    assert report['stages']['metadata']['count'] == 2
+    assert report['counters']['metadata_hachoir'] == 2
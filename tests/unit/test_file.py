@@ -1,7 +1,7 @@
 """
 This file (test_file.py) contains the unit tests for the File class in the file.py file.
 """
-from bild.file import File
+from rosh.file import File
 import os
 import pytest
 
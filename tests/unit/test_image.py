@@ -0,0 +1,341 @@
+"""
+This file (test_image.py) contains the unit tests for the image.py file.
+"""
+from io import BytesIO
+from PIL import Image
+from image import CaptchaPool, CaptchaPoolError, ImageCaptcha, WheezyCaptcha
+import image
+import os
+import pytest
+import random
+import threading
+import time
+
+FONT = image.DEFAULT_FONTS[0]
+
+
+class CountingCaptcha:
+    """CAPTCHA writing its text and the number of images generated by its instance (in the worker process)"""
+    def __init__(self):
+        self.generated = 0
+
+    def seed(self, seed=None):
+        pass
+
+    def generate(self, chars, format='png'):
+        self.generated += 1
+        return BytesIO(('%s:%d:%d' % (chars, os.getpid(), self.generated)).encode())
+
+
+class FailingCaptcha(CountingCaptcha):
+    def generate(self, chars, format='png'):
+        raise OSError('cannot open resource')
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_pool_workers_keep_their_captcha():
+    """
+    GIVEN a pool of CAPTCHAs generated by one worker process
+    WHEN it is filled with several batches
+    THEN check that the worker generates all of them with the same CAPTCHA (and so the same glyph cache)
+    """
+    with CaptchaPool(CountingCaptcha(), queue_depth=8, low_watermark=1, workers=1, batch_size=2) as pool:
+        wait_until(lambda: pool.qsize() == 8)
+        items = [pool.get() for _ in range(8)]
+    counts = sorted(int(data.decode().split(':')[2]) for _, data in items)
+    assert counts == list(range(1, 9))
+    assert pool.errors == 0
+
+
+def test_pool_backs_off_and_raises_after_consecutive_failures():
+    """
+    GIVEN a pool of CAPTCHAs whose worker processes fail to generate them
+    WHEN its batches keep failing
+    THEN check that they are retried with a growing delay, and that get raises once too many failed
+    """
+    with CaptchaPool(FailingCaptcha(), queue_depth=2, workers=1, batch_size=2, retry_delay=0.05,
+                     max_failures=3) as pool:
+        wait_until(lambda: pool.failures >= 3)
+        assert pool._retry_at - time.monotonic() > 0.05
+        with pytest.raises(CaptchaPoolError) as excinfo:
+            pool.get()
+    assert isinstance(excinfo.value.__cause__, OSError)
+    assert pool.errors >= 3
+
+
+def test_pool_generates_in_the_caller_before_too_many_failures(monkeypatch):
+    """
+    GIVEN a pool of CAPTCHAs that is not started, after a failed batch
+    WHEN a CAPTCHA is taken
+    THEN check that it is generated in the calling thread
+    """
+    pool = CaptchaPool(CountingCaptcha(), max_failures=2)
+    pool._on_failure(OSError('cannot open resource'), 0)
+    text, data = pool.get()
+    assert data.decode().startswith(text + ':')
+    assert image.MAX_RETRY_DELAY >= pool._retry_at - time.monotonic() > 0
+
+
+def test_seeded_captchas_are_identical():
+    """
+    GIVEN two ImageCaptcha with the same seed
+    WHEN the same texts are generated by both
+    THEN check that the images are byte-identical
+    """
+    first = ImageCaptcha(fonts=[FONT], seed=20181022, noise=True)
+    second = ImageCaptcha(fonts=[FONT], seed=20181022, noise=True)
+    for text in ['ABCD', 'X7Y2Z9', 'CAPTCHA1']:
+        assert first.generate(text).getvalue() == second.generate(text).getvalue()
+
+
+def test_seeding_a_captcha_leaves_the_random_module_alone():
+    """
+    GIVEN a WheezyCaptcha and an ImageCaptcha
+    WHEN they are seeded
+    THEN check that the random numbers of the random module are not changed
+    """
+    random.seed(1)
+    expected = random.random()
+    random.seed(1)
+    WheezyCaptcha(fonts=[FONT]).seed(2)
+    ImageCaptcha(fonts=[FONT]).seed(2)
+    assert random.random() == expected
+    assert WheezyCaptcha(seed=3)._random.random() == random.Random(3).random()
+
+
+def glyph_bytes(c, font):
+    glyph, _ = image.render_glyph(c, font, (0, 0, 0))
+    return glyph.size[0] * glyph.size[1] * 5
+
+
+def test_glyph_cache_hits_and_misses():
+    """
+    GIVEN a glyph cache
+    WHEN a character is taken twice, in two colors of the same bucket, and in a color of another bucket
+    THEN check that the glyph is rendered once per color bucket, and counted as a miss then hits
+    """
+    font = image.FONT_REGISTRY.get(FONT, 42)
+    cache = image.GlyphCache()
+    glyph, mask = cache.get('A', font, (10, 20, 30))
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.get('A', font, (12, 22, 32)) == (glyph, mask)
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.get('A', font, (200, 20, 30))
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+
+def test_glyph_cache_evicts_the_least_recently_used_glyphs():
+    """
+    GIVEN a glyph cache with room for two glyphs
+    WHEN three glyphs are cached, after the first one is taken again
+    THEN check that the second one (the least recently used) is evicted
+    """
+    font = image.FONT_REGISTRY.get(FONT, 42)
+    cache = image.GlyphCache(max_bytes=glyph_bytes('A', font) * 2)
+    cache.get('A', font, (0, 0, 0))
+    cache.get('A', font, (0, 0, 0))
+    cache.get('A', font, (100, 100, 100))
+    cache.get('A', font, (0, 0, 0))
+    cache.get('A', font, (200, 200, 200))
+    assert len(cache) == 2
+    cache.get('A', font, (0, 0, 0))
+    assert cache.hits == 3
+    cache.get('A', font, (100, 100, 100))
+    assert cache.misses == 4
+
+
+def test_glyph_cache_stays_within_its_byte_budget():
+    """
+    GIVEN a glyph cache smaller than a few glyphs, and one smaller than a glyph
+    WHEN many glyphs are cached
+    THEN check that the bytes cached never exceed the budget, and that a glyph larger than the budget is not cached
+    """
+    font = image.FONT_REGISTRY.get(FONT, 50)
+    budget = glyph_bytes('W', font) * 3
+    cache = image.GlyphCache(max_bytes=budget)
+    for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+        cache.get(c, font, (0, 0, 0))
+        assert cache.size_bytes <= budget
+    assert 0 < len(cache) < 26
+
+    tiny = image.GlyphCache(max_bytes=10)
+    tiny.get('W', font, (0, 0, 0))
+    assert (len(tiny), tiny.size_bytes) == (0, 0)
+    cache.clear()
+    assert (len(cache), cache.size_bytes) == (0, 0)
+
+
+@pytest.mark.skipif(image.numpy is None, reason='numpy is not installed')
+@pytest.mark.parametrize('noise', [False, True])
+@pytest.mark.parametrize('text', ['A', 'ABCD', 'X7Y2Z9', 'CAPTCHA1'])
+def test_numpy_and_pil_backends_agree(text, noise):
+    """
+    GIVEN an ImageCaptcha with the pil backend and one with the numpy backend, with the same seed
+    WHEN the same text is generated by both
+    THEN check that the images have the same size and mode, and that at most 1% of their pixels differ by more
+         than 10 levels
+    """
+    pil = ImageCaptcha(fonts=[FONT], seed=7, noise=noise, backend='pil').generate_image(text)
+    array = ImageCaptcha(fonts=[FONT], seed=7, noise=noise, backend='numpy').generate_image(text)
+    assert (array.size, array.mode) == (pil.size, pil.mode)
+    difference = abs(image.numpy.asarray(pil, dtype=int) - image.numpy.asarray(array, dtype=int)).max(axis=2)
+    assert (difference > 10).mean() <= 0.01
+    assert difference.mean() < 1
+
+
+@pytest.mark.parametrize('profile', sorted(image.ENCODER_PROFILES))
+def test_encoder_profiles_round_trip(profile):
+    """
+    GIVEN a CAPTCHA image
+    WHEN it is encoded with an encoder profile
+    THEN check that the data opens as an image of the format of the profile, of the size of the CAPTCHA
+    """
+    data, size = ImageCaptcha(fonts=[FONT], seed=7).generate_bytes('ABCD', profile)
+    assert size == len(data)
+    decoded = Image.open(BytesIO(data))
+    assert decoded.format == image.ENCODER_PROFILES[profile]['format'].upper()
+    assert decoded.size == (160, 60)
+    decoded.load()
+    if 'colors' in image.ENCODER_PROFILES[profile]:
+        assert decoded.mode == 'P'
+        assert len(decoded.getcolors()) <= image.ENCODER_PROFILES[profile]['colors']
+
+
+def test_encoder_buffers_are_not_shared_between_threads():
+    """
+    GIVEN images encoded in two threads at the same time
+    WHEN each thread encodes several images
+    THEN check that each thread reuses its own buffer, and that every image is encoded correctly
+    """
+    images = [Image.new('RGB', (160, 60), (index * 40, 0, 0)) for index in range(4)]
+    barrier = threading.Barrier(2)
+    buffers = {}
+    results = {}
+    reused = {}
+
+    def encode(name):
+        barrier.wait()
+        results[name] = [image.encode_image(im)[0] for im in images]
+        buffers[name] = image._buffers.out
+        results[name].append(image.encode_image(images[0])[0])
+        reused[name] = image._buffers.out is buffers[name]
+
+    threads = [threading.Thread(target=encode, args=(name,)) for name in ('first', 'second')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert buffers['first'] is not buffers['second']
+    assert reused == {'first': True, 'second': True}
+    for name in ('first', 'second'):
+        colors = [Image.open(BytesIO(data)).getpixel((0, 0)) for data in results[name]]
+        assert colors == [(index * 40, 0, 0) for index in range(4)] + [(0, 0, 0)]
+
+
+@pytest.mark.parametrize('backend', image.BACKENDS)
+@pytest.mark.parametrize('size', [(160, 60), (320, 120)])
+@pytest.mark.parametrize('text', ['W', 'W' * 12])
+def test_glyphs_are_laid_out_in_the_size_of_the_captcha(monkeypatch, text, size, backend):
+    """
+    GIVEN an ImageCaptcha of a size
+    WHEN a text of one character, and one much wider than the CAPTCHA, is generated
+    THEN check that the glyphs are placed within its width and that the image has its size, without being resized
+    """
+    if backend == 'numpy' and image.numpy is None:
+        pytest.skip('numpy is not installed')
+    width, height = size
+    resized = []
+    resize = Image.Image.resize
+
+    def record_resize(im, new_size, *args, **kwargs):
+        resized.append(new_size)
+        return resize(im, new_size, *args, **kwargs)
+    monkeypatch.setattr(Image.Image, 'resize', record_resize)
+
+    font_sizes = tuple(int(font_size * height / 60) for font_size in image.DEFAULT_FONT_SIZES)
+    captcha = ImageCaptcha(width=width, height=height, fonts=[FONT], font_sizes=font_sizes, seed=7, backend=backend)
+    for seed in range(10):
+        captcha.seed(seed)
+        placements = captcha.layout_glyphs(text, (0, 0, 0, 255))
+        assert len(placements) == len(text)
+        assert min(x for _, _, x, _ in placements) >= 0
+        assert max(x + image.glyph_size(glyph)[0] for glyph, _, x, _ in placements) <= width
+        assert captcha.generate_image(text).size == size
+    assert size not in resized
+
+
+def test_fonts_are_loaded_once_per_process(monkeypatch):
+    """
+    GIVEN a font registry
+    WHEN the same font file and size are taken several times, from several ImageCaptcha
+    THEN check that the font is loaded once, and shared
+    """
+    loaded = []
+    truetype = image.truetype
+
+    def record_truetype(path, size):
+        loaded.append((path, size))
+        return truetype(path, size)
+    monkeypatch.setattr(image, 'truetype', record_truetype)
+    registry = image.FontRegistry()
+    monkeypatch.setattr(image, 'FONT_REGISTRY', registry)
+
+    assert registry.get(FONT, 42) is registry.get(FONT, 42)
+    first = ImageCaptcha(fonts=[FONT], font_sizes=(42, 50))
+    second = ImageCaptcha(fonts=[FONT], font_sizes=(42, 50))
+    assert first.truefonts == second.truefonts
+    assert sorted(loaded) == [(FONT, 42), (FONT, 50)]
+
+
+def test_prewarm_loads_the_fonts_in_each_size():
+    """
+    GIVEN an empty font registry
+    WHEN it is prewarmed with the default fonts and sizes
+    THEN check that it holds each font in each size, and returns them
+    """
+    registry = image.FontRegistry()
+    fonts = registry.prewarm()
+    assert len(registry) == len(image.DEFAULT_FONTS) * len(image.DEFAULT_FONT_SIZES)
+    assert fonts == tuple(registry.get(FONT, size) for size in image.DEFAULT_FONT_SIZES)
+    registry.clear()
+    assert len(registry) == 0
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='os.register_at_fork is not available')
+def test_fonts_prewarmed_before_forking_are_reused_by_the_child(monkeypatch):
+    """
+    GIVEN the font registry of the process, prewarmed, with its lock held by another thread
+    WHEN the process is forked
+    THEN check that the child reuses the prewarmed fonts, and can load other fonts (its lock is released)
+    """
+    loaded = []
+    truetype = image.truetype
+
+    def record_truetype(path, size):
+        loaded.append((path, size))
+        return truetype(path, size)
+    monkeypatch.setattr(image, 'truetype', record_truetype)
+    image.FONT_REGISTRY.prewarm([FONT], (43,))
+    before = len(loaded)
+
+    read, write = os.pipe()
+    with image.FONT_REGISTRY._lock:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                reused = image.FONT_REGISTRY.get(FONT, 43) is not None and len(loaded) == before
+                image.FONT_REGISTRY.get(FONT, 44)
+                os.write(write, b'1' if reused and len(loaded) == before + 1 else b'0')
+            finally:
+                os._exit(0)
+    os.close(write)
+    with os.fdopen(read, 'rb') as child:
+        result = child.read()
+    os.waitpid(pid, 0)
+    assert result == b'1'
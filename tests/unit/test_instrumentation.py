@@ -0,0 +1,71 @@
+"""
+This file (test_instrumentation.py) contains the unit tests for the instrumentation.py file.
+"""
+from rosh.directory import Directory
+from rosh.instrumentation import Histogram, Metrics, ProgressLine, STAGES
+import io
+import json
+import os
+
+
+def test_histogram_percentiles():
+    """
+    GIVEN a new histogram
+    WHEN durations are recorded
+    THEN check the count, the total and the percentile estimates
+    """
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.record(0.001)
+    histogram.record(0.5)
+    assert histogram.count == 100
+    assert abs(histogram.total - 0.599) < 1e-9
+    assert 0.001 <= histogram.percentile(50) < 0.002
+    assert histogram.percentile(100) == 0.5
+    assert histogram.report()['max_ms'] == 500.0
+
+
+def test_metrics_report(tmpdir):
+    """
+    GIVEN new metrics
+    WHEN counters are incremented and stages are timed
+    THEN check the JSON report contains the counters and all the stages
+    """
+    metrics = Metrics()
+    metrics.increment('files_copied')
+    metrics.increment('bytes_copied', 1024)
+    with metrics.timer('copy'):
+        pass
+
+    metrics.write_report(str(tmpdir.join('report.json')))
+    report = json.loads(tmpdir.join('report.json').read())
+    assert report['counters'] == {'files_copied': 1, 'bytes_copied': 1024}
+    assert list(report['stages']) == list(STAGES)
+    assert report['stages']['copy']['count'] == 1
+    assert report['stages']['walk']['count'] == 0
+
+
+def test_directory_records_metrics(tmpdir):
+    """
+    GIVEN a new directory containing the date in the directory name
+    WHEN the files are copied with a progress line
+    THEN check the counters and the stage durations are recorded
+    """
+    source = tmpdir.mkdir('source').mkdir('2019_05_06')
+    for index in range(5):
+        source.join(f'IMG_{index:04d}.JPG').write_binary(os.urandom(100))
+    new_directory = Directory(str(tmpdir.join('source')), str(tmpdir.join('Pictures')), str(tmpdir.join('Videos')))
+    stream = io.StringIO()
+    with ProgressLine(new_directory.metrics, interval=0.01, stream=stream):
+        new_directory.copy_files()
+
+    report = new_directory.metrics.report()
+    assert report['counters']['files_found'] == 5
+    assert report['counters']['files_copied'] == 5
+    assert report['counters']['bytes_copied'] == 500
+    assert report['stages']['copy']['count'] == 5
+    assert report['stages']['classify']['count'] == 5
+    assert report['stages']['walk']['count'] >= 2
+    assert report['stages']['metadata']['count'] == 0
+    assert stream.getvalue().endswith('\n')
+    assert 'copied: 5' in stream.getvalue()
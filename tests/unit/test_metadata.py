@@ -0,0 +1,123 @@
+"""
+This file (test_metadata.py) contains the unit tests for the metadata.py file.
+"""
+from rosh.metadata import extract_creation_dates, read_creation_date
+import struct
+
+
+def build_jpeg(date_time_original: bytes = b'2014:05:25 10:11:12', byte_order: str = '<') -> bytes:
+    """Returns the bytes of a minimal JPEG file with an EXIF segment containing DateTimeOriginal"""
+    tiff_header = (b'II' if byte_order == '<' else b'MM') + struct.pack(byte_order + 'HI', 42, 8)
+    # IFD0: one entry pointing to the EXIF IFD (located right after IFD0)
+    exif_ifd_offset = 8 + 2 + 12 + 4
+    ifd0 = struct.pack(byte_order + 'H', 1)
+    ifd0 += struct.pack(byte_order + 'HHII', 0x8769, 4, 1, exif_ifd_offset)
+    ifd0 += struct.pack(byte_order + 'I', 0)
+    # EXIF IFD: one ASCII entry whose value is stored right after the IFD
+    value = date_time_original + b'\x00'
+    value_offset = exif_ifd_offset + 2 + 12 + 4
+    exif_ifd = struct.pack(byte_order + 'H', 1)
+    exif_ifd += struct.pack(byte_order + 'HHII', 0x9003, 2, len(value), value_offset)
+    exif_ifd += struct.pack(byte_order + 'I', 0)
+    exif = b'Exif\x00\x00' + tiff_header + ifd0 + exif_ifd + value
+    app1 = b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif
+    return b'\xff\xd8' + app1 + b'\xff\xda\x00\x02' + b'\x00' * 64 + b'\xff\xd9'
+
+
+def build_atom(atom_type: bytes, contents: bytes) -> bytes:
+    """Returns the bytes of a QuickTime atom"""
+    return struct.pack('>I4s', len(contents) + 8, atom_type) + contents
+
+
+def build_mov(creation_time: int = 3629800000, moov_at_end: bool = False) -> bytes:
+    """Returns the bytes of a minimal QuickTime file with a 'mvhd' atom"""
+    mvhd = build_atom(b'mvhd', struct.pack('>B3sII', 0, b'\x00\x00\x00', creation_time, creation_time) + b'\x00' * 88)
+    moov = build_atom(b'moov', mvhd)
+    ftyp = build_atom(b'ftyp', b'qt  \x00\x00\x02\x00qt  ')
+    mdat = build_atom(b'mdat', b'\x00' * 4096)
+    if moov_at_end:
+        return ftyp + mdat + moov
+    return ftyp + moov + mdat
+
+
+def test_read_creation_date_jpeg(tmpdir):
+    """
+    GIVEN a JPEG file containing the EXIF DateTimeOriginal tag
+    WHEN the creation date is read from the header of the file
+    THEN check the creation date extracted is correct
+    """
+    picture = tmpdir.join('IMG_0016.JPG')
+    picture.write_binary(build_jpeg())
+    assert read_creation_date(str(picture)) == '2014-05-25'
+
+
+def test_read_creation_date_jpeg_big_endian(tmpdir):
+    """
+    GIVEN a JPEG file containing big-endian ("MM") EXIF data
+    WHEN the creation date is read from the header of the file
+    THEN check the creation date extracted is correct
+    """
+    picture = tmpdir.join('IMG_1019.JPG')
+    picture.write_binary(build_jpeg(b'2017:02:11 08:00:00', byte_order='>'))
+    assert read_creation_date(str(picture)) == '2017-02-11'
+
+
+def test_read_creation_date_jpeg_invalid_date(tmpdir):
+    """
+    GIVEN a JPEG file whose EXIF DateTimeOriginal tag is not set
+    WHEN the creation date is read from the header of the file
+    THEN check that no creation date is extracted
+    """
+    picture = tmpdir.join('IMG_0001.JPG')
+    picture.write_binary(build_jpeg(b'0000:00:00 00:00:00'))
+    assert read_creation_date(str(picture)) == ''
+
+
+def test_read_creation_date_mov(tmpdir):
+    """
+    GIVEN a QuickTime file containing a 'mvhd' atom
+    WHEN the creation date is read from the header of the file
+    THEN check the creation date extracted is correct
+    """
+    video = tmpdir.join('IMG_0036.MOV')
+    video.write_binary(build_mov())
+    assert read_creation_date(str(video)) == '2019-01-08'
+
+
+def test_read_creation_date_mov_moov_at_end(tmpdir):
+    """
+    GIVEN a QuickTime file whose 'moov' atom is located after the media data
+    WHEN the creation date is read from the header of the file
+    THEN check the creation date extracted is correct
+    """
+    video = tmpdir.join('IMG_0037.MOV')
+    video.write_binary(build_mov(moov_at_end=True))
+    assert read_creation_date(str(video)) == '2019-01-08'
+
+
+def test_read_creation_date_unsupported_file(tmpdir):
+    """
+    GIVEN a file that is neither a JPEG nor a QuickTime file
+    WHEN the creation date is read from the header of the file
+    THEN check that no creation date is extracted
+    """
+    text_file = tmpdir.join('notes.txt')
+    text_file.write('2019-05-06 is not metadata')
+    assert read_creation_date(str(text_file)) == ''
+    assert read_creation_date(str(tmpdir.join('missing.JPG'))) == ''
+
+
+def test_extract_creation_dates(tmpdir):
+    """
+    GIVEN a batch of files with and without metadata
+    WHEN the creation dates are extracted for the batch
+    THEN check the creation date and whether hachoir was needed are returned for each file
+    """
+    picture = tmpdir.join('IMG_0016.JPG')
+    picture.write_binary(build_jpeg())
+    video = tmpdir.join('IMG_0036.MOV')
+    video.write_binary(build_mov())
+
+    results = extract_creation_dates([str(picture), str(video)], timeout=5)
+    assert [(date_created, used_hachoir) for date_created, _, used_hachoir in results] == [
+        ('2014-05-25', False), ('2019-01-08', False)]
@@ -0,0 +1,158 @@
+"""
+This file (test_rollups.py) contains the unit tests for the rollups.py file.
+"""
+from datetime import datetime
+from ingest.rollups import RollupAggregator, RollupSink, period_start, read_rollups, RESOLUTIONS
+from ingest.telemetry import Telemetry
+from pymongo.errors import AutoReconnect, BulkWriteError
+import mongomock
+
+
+def reading(minute, second, value, device_id='device1', datastream_name='temp'):
+    return Telemetry(datetime(2019, 5, 6, 10, minute, second, 250000), device_id, datastream_name, value, {})
+
+
+class ListSink:
+    def __init__(self, full=False):
+        self.documents = []
+        self.closed = False
+        self.full = full
+
+    def add(self, document, timeout=None):
+        if self.full:
+            return False
+        self.documents.append(document)
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def test_period_start():
+    """
+    GIVEN a date and time
+    WHEN the start of its minute and hour are computed
+    THEN check that the smaller units are truncated
+    """
+    tstamp = datetime(2019, 5, 6, 10, 11, 12, 345)
+    assert period_start(tstamp, RESOLUTIONS['1m']) == datetime(2019, 5, 6, 10, 11)
+    assert period_start(tstamp, RESOLUTIONS['1h']) == datetime(2019, 5, 6, 10)
+
+
+def test_rollups_per_minute_and_hour():
+    """
+    GIVEN rollups of the telemetry
+    WHEN numeric and non-numeric values of two datastreams over two minutes are added and flushed
+    THEN check the count, minimum, maximum and mean of each minute and hour
+    """
+    database = mongomock.MongoClient().mqtt_data
+    with RollupAggregator(database, 'Data', flush_interval=None) as rollups:
+        for minute, second, value in [(11, 0, '21.5'), (11, 30, '22.5'), (11, 59, 20), (12, 5, '23')]:
+            assert rollups.add(reading(minute, second, value))
+        assert rollups.add(reading(11, 10, '40', datastream_name='humidity'))
+        assert not rollups.add(reading(11, 20, 'on'))
+        assert len(rollups) == 5
+    assert rollups.values_skipped == 1
+
+    minutes = list(read_rollups(database.Data_rollup_1m, 'device1', 'temp'))
+    assert [(rollup['period'].minute, rollup['count'], rollup['min'], rollup['max'], rollup['mean'])
+            for rollup in minutes] == [(11, 3, 20.0, 22.5, 64.0 / 3), (12, 1, 23.0, 23.0, 23.0)]
+    hours = list(read_rollups(database.Data_rollup_1h, 'device1', 'temp', start=datetime(2019, 5, 6, 10)))
+    assert len(hours) == 1
+    assert (hours[0]['count'], hours[0]['min'], hours[0]['max'], hours[0]['mean']) == (4, 20.0, 23.0, 21.75)
+    assert database.Data_rollup_1h.count_documents({'datastream_name': 'humidity'}) == 1
+
+
+def test_flushes_are_added_to_the_stored_rollups():
+    """
+    GIVEN rollups already written for a minute (such as by another worker process)
+    WHEN more values of the minute are added and flushed
+    THEN check that the stored rollup covers all of the values
+    """
+    database = mongomock.MongoClient().mqtt_data
+    rollups = RollupAggregator(database, 'Data', resolutions=['1m'], flush_interval=None)
+    rollups.add(reading(11, 0, 10))
+    rollups.flush()
+    rollups.add(reading(11, 1, 30))
+    rollups.add(reading(11, 2, 20))
+    rollups.close()
+    [rollup] = read_rollups(database.Data_rollup_1m, 'device1', 'temp', end=datetime(2019, 5, 6, 11))
+    assert (rollup['count'], rollup['min'], rollup['max'], rollup['mean']) == (3, 10.0, 30.0, 20.0)
+
+
+def test_rollups_are_kept_when_they_cannot_be_written(monkeypatch):
+    """
+    GIVEN rollups whose collection cannot be reached
+    WHEN they are flushed, more values are added, and they are flushed again once the database is back
+    THEN check that none of the values are lost
+    """
+    database = mongomock.MongoClient().mqtt_data
+    rollups = RollupAggregator(database, 'Data', resolutions=['1m'], flush_interval=None)
+    rollups.add(reading(11, 0, 10))
+
+    def fail(*args, **kwargs):
+        raise AutoReconnect('connection refused')
+    monkeypatch.setattr(rollups.collections['1m'], 'bulk_write', fail)
+    assert not rollups.flush()
+    rollups.add(reading(11, 1, 30))
+    monkeypatch.undo()
+    assert rollups.flush()
+    [rollup] = read_rollups(database.Data_rollup_1m, 'device1', 'temp')
+    assert (rollup['count'], rollup['min'], rollup['max']) == (2, 10.0, 30.0)
+
+
+def test_rollup_sink():
+    """
+    GIVEN a sink with rollups, flushed periodically
+    WHEN documents are added and the sink is closed
+    THEN check that the documents are added to the inner sink and the rollups written
+    """
+    database = mongomock.MongoClient().mqtt_data
+    inner = ListSink()
+    sink = RollupSink(inner, RollupAggregator(database, 'Data', flush_interval=0.01))
+    for second in range(10):
+        assert sink.add(reading(11, second, second))
+    sink.close()
+    assert len(inner.documents) == 10 and inner.closed
+    assert database.Data_rollup_1m.find_one()['count'] == 10
+
+
+def test_only_the_rollups_that_failed_are_written_again(monkeypatch):
+    """
+    GIVEN rollups of two datastreams, and a bulk write failing for the second one only
+    WHEN they are flushed, and flushed again once the database is back
+    THEN check that the rollup written by the first flush is not counted twice
+    """
+    database = mongomock.MongoClient().mqtt_data
+    rollups = RollupAggregator(database, 'Data', resolutions=['1m'], flush_interval=None)
+    rollups.add(reading(11, 0, 10))
+    rollups.add(reading(11, 0, 40, datastream_name='humidity'))
+    collection = rollups.collections['1m']
+    bulk_write = collection.bulk_write
+
+    def fail_second(requests, ordered=True):
+        bulk_write(requests[:1], ordered=ordered)
+        raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}],
+                              'nInserted': 0, 'nUpserted': 1})
+    monkeypatch.setattr(collection, 'bulk_write', fail_second)
+    assert not rollups.flush()
+    assert len(rollups) == 1
+    monkeypatch.undo()
+    assert rollups.flush()
+    assert rollups.rollups_written == 2
+    assert [rollup['count'] for rollup in read_rollups(collection, 'device1', 'temp')] == [1]
+    assert [rollup['count'] for rollup in read_rollups(collection, 'device1', 'humidity')] == [1]
+
+
+def test_rollup_sink_skips_the_documents_refused():
+    """
+    GIVEN a sink with rollups, whose inner sink is full
+    WHEN a document is added
+    THEN check that it is refused and not added to the rollups
+    """
+    database = mongomock.MongoClient().mqtt_data
+    sink = RollupSink(ListSink(full=True), RollupAggregator(database, 'Data', flush_interval=None))
+    assert not sink.add(reading(11, 0, 10))
+    assert len(sink.rollups) == 0
+    sink.close()
+    assert database.Data_rollup_1m.count_documents({}) == 0
@@ -0,0 +1,173 @@
+"""
+This file (test_spool.py) contains the unit tests for the spool.py file, and the spooling of the WriteBehindBuffer class.
+"""
+from datetime import datetime
+from ingest.spool import RECORD_HEADER, Spool, SpoolFull, open_spool
+from ingest.storage import BucketCollection, DocumentCollection, document_id
+from ingest.telemetry import Telemetry
+from ingest.write_buffer import WriteBehindBuffer
+from pymongo.errors import AutoReconnect
+import mongomock
+import os
+import pytest
+import time
+
+SEGMENT_SIZE = 1024
+
+
+def telemetry(count, start=0):
+    return [{'tstamp': datetime(2019, 5, 6, 10, 0, index % 60), 'device_id': 'device1', 'datastream_name': 'temp',
+             'value': str(index), 'context': {'latitude': '12.3'}} for index in range(start, start + count)]
+
+
+class FlakyCollection:
+    """Collection that cannot be reached until it is told to recover"""
+    def __init__(self, collection):
+        self.collection = collection
+        self.down = True
+
+    def insert_many(self, documents, ordered=True):
+        if self.down:
+            raise AutoReconnect('connection refused')
+        return self.collection.insert_many(documents, ordered=ordered)
+
+
+def test_append_and_replay_across_segments(tmpdir):
+    """
+    GIVEN a spool with small segments
+    WHEN documents filling several segments are appended, and replayed in batches
+    THEN check that they are replayed in order, and that the segments replayed are removed
+    """
+    with Spool(str(tmpdir), segment_size=SEGMENT_SIZE, max_bytes=10 * SEGMENT_SIZE) as spool:
+        documents = telemetry(30)
+        assert spool.append(documents) == 30
+        assert len(spool) == 30
+        assert spool.disk_usage > SEGMENT_SIZE
+        replayed = []
+        assert spool.replay(replayed.append, batch_size=7) == 30
+        assert [document for batch in replayed for document in batch] == documents
+        assert [len(batch) for batch in replayed] == [7, 7, 7, 7, 2]
+        assert len(spool) == 0
+        assert spool.disk_usage == SEGMENT_SIZE
+
+
+def test_failed_replay_is_resumed_after_reopening(tmpdir):
+    """
+    GIVEN a spool holding documents
+    WHEN a replay fails after the first batch, and the spool is closed and opened again
+    THEN check that the replay resumes with the batch that failed
+    """
+    def write(batch):
+        if batch[0]['value'] == '5':
+            raise AutoReconnect('connection refused')
+        replayed.extend(batch)
+
+    replayed = []
+    with Spool(str(tmpdir), segment_size=SEGMENT_SIZE, max_bytes=10 * SEGMENT_SIZE) as spool:
+        spool.append(telemetry(12))
+        with pytest.raises(AutoReconnect):
+            spool.replay(write, batch_size=5)
+    assert len(replayed) == 5
+
+    with Spool(str(tmpdir), segment_size=SEGMENT_SIZE, max_bytes=10 * SEGMENT_SIZE) as spool:
+        assert len(spool) == 7
+        assert spool.replay(replayed.extend, batch_size=5) == 7
+    assert [document['value'] for document in replayed] == [str(index) for index in range(12)]
+
+
+def test_disk_space_is_bounded(tmpdir):
+    """
+    GIVEN a spool of at most 2 segments
+    WHEN more documents are appended than the segments hold
+    THEN check that appending raises SpoolFull without appending any of the documents
+    """
+    with Spool(str(tmpdir), segment_size=SEGMENT_SIZE, max_bytes=2 * SEGMENT_SIZE) as spool:
+        spool.append(telemetry(10))
+        with pytest.raises(SpoolFull):
+            spool.append(telemetry(20))
+        assert len(spool) == 10
+        assert len(os.listdir(str(tmpdir))) <= 4
+
+
+def test_torn_record_is_ignored(tmpdir):
+    """
+    GIVEN a spool whose last record was not completely written (such as after a crash)
+    WHEN the spool is opened again
+    THEN check that the complete records are kept and the torn one ignored
+    """
+    with Spool(str(tmpdir), segment_size=SEGMENT_SIZE, max_bytes=2 * SEGMENT_SIZE) as spool:
+        spool.append(telemetry(3))
+        end = spool._offset
+        spool.append(telemetry(1, start=3))
+        # Corrupts the end of the last record
+        spool._map[spool._offset - 1] ^= 0xFF
+    with Spool(str(tmpdir), segment_size=SEGMENT_SIZE, max_bytes=2 * SEGMENT_SIZE) as spool:
+        assert len(spool) == 3
+        assert spool._offset == end
+        assert end > RECORD_HEADER.size
+
+
+def test_a_spool_is_used_by_one_process(tmpdir):
+    """
+    GIVEN a directory of spools, one of them in use
+    WHEN another spool is opened in the directory
+    THEN check that it uses the next sub-directory
+    """
+    with open_spool(str(tmpdir), segment_size=SEGMENT_SIZE) as first, \
+            open_spool(str(tmpdir), segment_size=SEGMENT_SIZE) as second:
+        assert first.directory == os.path.join(str(tmpdir), '0')
+        assert second.directory == os.path.join(str(tmpdir), '1')
+
+
+def test_buffer_spools_while_the_database_is_down(tmpdir):
+    """
+    GIVEN a write-behind buffer with a spool, and a database that is down
+    WHEN documents are added, part of them written twice, and the database recovers
+    THEN check that all the documents are replayed from the spool, each stored once
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    flaky = FlakyCollection(collection)
+    spool = Spool(str(tmpdir), segment_size=64 * SEGMENT_SIZE, max_bytes=64 * SEGMENT_SIZE)
+    buffer = WriteBehindBuffer(DocumentCollection(flaky), batch_size=10, max_delay=60, spool=spool)
+    documents = telemetry(50)
+    # A batch that was written before the connection was lost is replayed too
+    DocumentCollection(collection).insert_many([dict(document) for document in documents[:5]])
+    for document in documents[:25]:
+        buffer.add(dict(document))
+    buffer.add(Telemetry(**documents[25]))
+    for document in documents[26:]:
+        buffer.add(dict(document))
+    assert buffer.flush(timeout=5)
+    assert buffer.documents_spooled == 50
+    assert collection.count_documents({}) == 5
+
+    flaky.down = False
+    buffer._next_replay = time.monotonic()
+    with buffer._condition:
+        buffer._condition.notify_all()
+    deadline = time.monotonic() + 5
+    while len(spool) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    buffer.close()
+    assert buffer.documents_replayed == 50
+    assert collection.count_documents({}) == 50
+    assert sorted(collection.distinct('value'), key=int) == [str(index) for index in range(50)]
+
+
+def test_replaying_buckets_is_idempotent(tmpdir):
+    """
+    GIVEN a write-behind buffer with a spool, writing to buckets
+    WHEN the same spooled batch is replayed twice
+    THEN check that its readings are stored once
+    """
+    collection = mongomock.MongoClient().mqtt_data.Buckets
+    buckets = BucketCollection(collection)
+    buckets.ensure_indexes()
+    spool = Spool(str(tmpdir), segment_size=64 * SEGMENT_SIZE, max_bytes=64 * SEGMENT_SIZE)
+    with WriteBehindBuffer(buckets, spool=spool) as buffer:
+        documents = [dict(document, _id=document_id(document)) for document in telemetry(3)]
+        buffer._write_replayed([dict(document) for document in documents])
+        buffer._write_replayed([dict(document) for document in documents])
+    bucket = collection.find_one()
+    assert bucket['count'] == 3
+    assert len(bucket['readings']) == 3
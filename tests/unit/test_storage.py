@@ -0,0 +1,189 @@
+"""
+This file (test_storage.py) contains the unit tests for the storage.py file.
+"""
+from datetime import datetime
+from bson import ObjectId
+from ingest.storage import AsyncBucketCollection, BucketCollection, DocumentCollection, STORAGE_MODES, \
+    TimeSeriesCollection, document_id, migrate, storage_for, to_number
+from ingest.write_buffer import open_write_buffer
+import mongomock
+import pytest
+
+
+def reading(minute, value, device_id='device1', datastream_name='temp', hour=10):
+    return {'tstamp': datetime(2019, 5, 6, hour, minute), 'device_id': device_id, 'value': value,
+            'context': {'latitude': '12.3'}, 'datastream_name': datastream_name}
+
+
+def test_to_number():
+    """
+    GIVEN values received as strings and numbers
+    WHEN they are converted to numbers
+    THEN check that numeric values become floats and other values are unchanged
+    """
+    assert to_number('21.5') == 21.5
+    assert to_number(3) == 3.0
+    assert to_number('on') == 'on'
+    assert to_number(True) is True
+
+
+def test_buckets_group_readings_per_device_datastream_and_hour():
+    """
+    GIVEN a bucket collection
+    WHEN readings of two datastreams over two hours are written in two batches
+    THEN check that there is one bucket per datastream and hour, holding the statistics of its readings
+    """
+    collection = mongomock.MongoClient().mqtt_data.Buckets
+    buckets = BucketCollection(collection)
+    buckets.ensure_indexes()
+    buckets.insert_many([reading(5, '21.5'), reading(10, '22'), reading(5, '40', datastream_name='humidity')])
+    buckets.insert_many([reading(1, '20.5'), reading(0, '23', hour=11)], ordered=False)
+
+    assert collection.count_documents({}) == 3
+    bucket = collection.find_one({'device_id': 'device1', 'datastream_name': 'temp',
+                                  'hour': datetime(2019, 5, 6, 10)})
+    assert bucket['count'] == 3
+    assert bucket['min'] == 20.5
+    assert bucket['max'] == 22.0
+    assert bucket['sum'] == 64.0
+    assert bucket['first'] == datetime(2019, 5, 6, 10, 1)
+    assert bucket['last'] == datetime(2019, 5, 6, 10, 10)
+    assert [item['v'] for item in bucket['readings']] == [21.5, 22.0, 20.5]
+    assert bucket['readings'][0]['c'] == {'latitude': '12.3'}
+
+
+def test_buckets_of_non_numeric_values_have_no_statistics():
+    """
+    GIVEN a bucket collection
+    WHEN readings with non-numeric values are written
+    THEN check that they are stored and counted, without minimum, maximum or sum
+    """
+    collection = mongomock.MongoClient().mqtt_data.Buckets
+    BucketCollection(collection).insert_many([reading(5, 'on'), reading(6, 'off')])
+    bucket = collection.find_one()
+    assert bucket['count'] == 2
+    assert 'sum' not in bucket and 'min' not in bucket
+    assert [item['v'] for item in bucket['readings']] == ['on', 'off']
+
+
+def test_timeseries_readings():
+    """
+    GIVEN a time-series collection
+    WHEN readings are written
+    THEN check that they are stored with their device and datastream as meta and a numeric value
+    """
+    collection = mongomock.MongoClient().mqtt_data.Readings
+    TimeSeriesCollection(collection).insert_many([reading(5, '21.5')])
+    document = collection.find_one({}, {'_id': False})
+    assert document == {'tstamp': datetime(2019, 5, 6, 10, 5), 'meta': {'device_id': 'device1', 'datastream_name': 'temp'},
+                        'value': 21.5, 'context': {'latitude': '12.3'}}
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 100])
+def test_migrate_to_buckets(batch_size):
+    """
+    GIVEN a collection with one document per reading
+    WHEN it is migrated to buckets (in batches)
+    THEN check that all the readings are copied, and that the migration resumes after the last _id
+    """
+    database = mongomock.MongoClient().mqtt_data
+    database.Data.insert_many([reading(minute, str(minute)) for minute in range(5)])
+    migrated, last_id = migrate(database.Data, BucketCollection(database.Buckets), batch_size=batch_size)
+    assert migrated == 5
+    assert database.Buckets.find_one()['count'] == 5
+    assert database.Buckets.find_one()['sum'] == 10.0
+
+    database.Data.insert_one(reading(5, '5'))
+    assert migrate(database.Data, BucketCollection(database.Buckets), start_after=last_id)[0] == 1
+    assert database.Buckets.find_one()['count'] == 6
+
+
+def test_migrate_to_documents():
+    """
+    GIVEN a collection with one document per reading, and values stored as strings
+    WHEN it is migrated to another collection of documents
+    THEN check that the documents are copied unchanged, values included
+    """
+    database = mongomock.MongoClient().mqtt_data
+    database.Data.insert_many([reading(1, '21.5'), reading(2, 'on')])
+    assert migrate(database.Data, DocumentCollection(database.Copy))[0] == 2
+    assert database.Copy.find_one({'value': '21.5'}, {'_id': False}) == reading(1, '21.5')
+    assert database.Copy.find_one({'value': 21.5}) is None
+
+
+def test_buckets_do_not_store_readings_twice():
+    """
+    GIVEN a bucket collection holding readings
+    WHEN the same readings are written again, alone and with new readings (such as when the spool is replayed)
+    THEN check that each reading is stored once
+    """
+    collection = mongomock.MongoClient().mqtt_data.Buckets
+    buckets = BucketCollection(collection)
+    buckets.ensure_indexes()
+    batch = [reading(5, '21.5'), reading(10, '22'), reading(15, '23')]
+    buckets.insert_many([dict(document) for document in batch])
+    buckets.insert_many([dict(document) for document in batch])
+    buckets.insert_many([dict(document) for document in batch[1:]] + [reading(20, '24')])
+
+    bucket = collection.find_one()
+    assert bucket['count'] == 4
+    assert bucket['sum'] == 90.5
+    assert [item['v'] for item in bucket['readings']] == [21.5, 22.0, 23.0, 24.0]
+    assert len({item['_id'] for item in bucket['readings']}) == 4
+
+
+def test_timeseries_readings_keep_their_id():
+    """
+    GIVEN a telemetry document with an _id (such as one replayed from the spool)
+    WHEN it is converted to a time-series reading
+    THEN check that the reading has the same _id
+    """
+    document = dict(reading(5, '21.5'), _id=document_id(reading(5, '21.5')))
+    assert TimeSeriesCollection.reading(document)['_id'] == document['_id']
+    assert '_id' not in TimeSeriesCollection.reading(reading(5, '21.5'))
+
+
+def test_document_ids_are_deterministic_object_ids():
+    """
+    GIVEN two identical readings and a different one
+    WHEN their _ids are computed
+    THEN check that they are ObjectIds, equal for the identical readings only
+    """
+    assert isinstance(document_id(reading(5, '21.5')), ObjectId)
+    assert document_id(reading(5, '21.5')) == document_id(reading(5, 21.5))
+    assert document_id(reading(5, '21.5')) != document_id(reading(6, '21.5'))
+
+
+def test_timeseries_storage_cannot_be_spooled(tmpdir):
+    """
+    GIVEN the time-series storage, whose writes are not idempotent
+    WHEN a write buffer with a spool is opened
+    THEN check that it is refused
+    """
+    with pytest.raises(ValueError):
+        open_write_buffer('127.0.0.1:27017', 'mqtt_data', 'Data', storage='timeseries', spool=str(tmpdir))
+
+
+def test_storage_for_each_mode():
+    """
+    GIVEN a collection
+    WHEN the storage of each storage mode is created for it
+    THEN check that each mode has its storage (motor having its own for buckets), and that an unknown mode is refused
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    assert [type(storage_for(mode, collection)) for mode in STORAGE_MODES] == \
+        [DocumentCollection, BucketCollection, TimeSeriesCollection]
+    assert isinstance(storage_for('buckets', collection, asynchronous=True), AsyncBucketCollection)
+    with pytest.raises(ValueError):
+        storage_for('rows', collection)
+
+
+def test_documents_are_stored_unchanged():
+    """
+    GIVEN a collection of documents (the legacy storage)
+    WHEN a reading with a numeric string value is written
+    THEN check that it is stored as on_message always stored it, with its _id
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    DocumentCollection(collection).insert_many([reading(5, '21.5')])
+    assert collection.find_one() == dict(reading(5, '21.5'), _id=document_id(reading(5, '21.5')))
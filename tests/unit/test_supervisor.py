@@ -0,0 +1,125 @@
+"""
+This file (test_supervisor.py) contains the unit tests for the Supervisor class in the supervisor.py file.
+"""
+import pytest
+import sys
+
+if sys.version_info < (3, 8):
+    pytest.skip('the asyncio ingest service requires Python 3.8 or later', allow_module_level=True)
+
+from ingest.async_service import AsyncIngestService, device_partition, shared_subscription
+from ingest.supervisor import Supervisor
+from functools import partial
+import asyncio
+import json
+import os
+import time
+
+DEVICES = [f'device{index}' for index in range(12)]
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeClient:
+    """MQTT client receiving 5 messages of each device, then waiting"""
+    def __init__(self, subscriptions):
+        self.subscriptions = subscriptions
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def subscribe(self, topic):
+        self.subscriptions.append(topic)
+
+    @property
+    async def messages(self):
+        for index in range(5):
+            for device_id in DEVICES:
+                payload = json.dumps({'context': {}, 'datastream_name': 'temp', 'value': str(index)}).encode()
+                yield FakeMessage(f'telemetry/{device_id}/temp', payload)
+        await asyncio.Event().wait()
+
+
+class FileCollection:
+    """Collection writing the device ids of the documents to a file (one file per instance)"""
+    def __init__(self, filename):
+        self.filename = filename
+
+    async def insert_many(self, documents, ordered=True):
+        with open(self.filename, 'a') as file:
+            file.writelines(f'{document.device_id}\n' for document in documents)
+
+
+async def create_service(directory, index, instances):
+    subscriptions = []
+    return AsyncIngestService(lambda: FakeClient(subscriptions), FileCollection(os.path.join(directory, f'{index}.txt')),
+                              topic=shared_subscription('#', 'ingest'), max_delay=0.01,
+                              partition=(index, instances))
+
+
+async def create_failing_service(directory, index, instances):
+    marker = os.path.join(directory, f'failed-{index}')
+    if index == 0 and not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise ConnectionRefusedError('MongoDB is not available')
+    return await create_service(directory, index, instances)
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert condition()
+
+
+def test_shared_subscription():
+    """
+    GIVEN a topic filter and a group
+    WHEN the shared subscription is built
+    THEN check that it has the $share prefix of MQTT v5
+    """
+    assert shared_subscription('telemetry/#', 'ingest') == '$share/ingest/telemetry/#'
+
+
+def test_instances_store_their_partition_of_the_devices(tmpdir):
+    """
+    GIVEN a supervisor of 3 instances, each receiving all of the messages
+    WHEN the instances run and are stopped
+    THEN check that each message is stored by exactly one instance, that of the partition of its device
+    """
+    supervisor = Supervisor(partial(create_service, str(tmpdir)), instances=3, stats_interval=0.05)
+    with supervisor:
+        wait_until(lambda: supervisor.stats()['messages_received'] == 3 * 5 * len(DEVICES))
+    stats = supervisor.stats()
+    assert stats['messages_skipped'] == 2 * 5 * len(DEVICES)
+    assert stats['documents_written'] == 5 * len(DEVICES)
+    assert stats['restarts'] == 0
+    stored = []
+    for index in range(3):
+        device_ids = tmpdir.join(f'{index}.txt').read().split()
+        assert all(device_partition(device_id, 3) == index for device_id in device_ids)
+        stored.extend(device_ids)
+    assert sorted(stored) == sorted(DEVICES * 5)
+
+
+def test_stopped_instances_are_restarted(tmpdir):
+    """
+    GIVEN a supervisor of 2 instances, the first one failing when it starts the first time
+    WHEN the instances run
+    THEN check that the failed instance is restarted, and that all of the messages are stored
+    """
+    supervisor = Supervisor(partial(create_failing_service, str(tmpdir)), instances=2, stats_interval=0.05,
+                            restart_delay=0.05)
+    with supervisor:
+        wait_until(lambda: supervisor.stats()['messages_received'] == 2 * 5 * len(DEVICES))
+        assert supervisor.stats()['instances'] == 2
+    stats = supervisor.stats()
+    assert stats['restarts'] == 1
+    assert stats['documents_written'] == 5 * len(DEVICES)
@@ -0,0 +1,86 @@
+"""
+This file (test_telemetry.py) contains the unit tests for the decoding of telemetry messages in the telemetry.py file.
+"""
+from ingest.telemetry import Telemetry, TelemetryDecoder, decode_telemetry, orjson, topic_device_id
+from datetime import datetime
+import json
+import pickle
+import pytest
+
+RECEIVED = datetime(2019, 5, 6, 10, 11, 12)
+
+
+def payload(**message):
+    return json.dumps(message).encode()
+
+
+def test_decode_valid_message():
+    """
+    GIVEN a telemetry message published to telemetry/<device_id>/<datastream_name>
+    WHEN the message is decoded
+    THEN check that the record has the device id of the topic and the fields of the message
+    """
+    telemetry = decode_telemetry('telemetry/8daa3270/temp',
+                                 payload(context={'latitude': '12.3'}, datastream_name='temp', value='21.5'), RECEIVED)
+    assert telemetry == Telemetry(RECEIVED, '8daa3270', 'temp', '21.5', {'latitude': '12.3'})
+    assert telemetry.as_document() == {'tstamp': RECEIVED, 'device_id': '8daa3270', 'value': '21.5',
+                                       'context': {'latitude': '12.3'}, 'datastream_name': 'temp'}
+
+
+def test_decode_invalid_messages():
+    """
+    GIVEN messages that are not valid telemetry messages
+    WHEN the messages are decoded
+    THEN check that no document is returned
+    """
+    assert decode_telemetry('telemetry/8daa3270/temp', b'not json', RECEIVED) is None
+    assert decode_telemetry('telemetry/8daa3270/temp', b'[1, 2]', RECEIVED) is None
+    assert decode_telemetry('telemetry/8daa3270/temp', payload(datastream_name='temp', value='21.5'), RECEIVED) is None
+    assert decode_telemetry('telemetry/8daa3270/temp',
+                            payload(context={}, datastream_name='temp', value='21.5', extra=1), RECEIVED) is None
+    assert decode_telemetry('telemetry/8daa3270/temp',
+                            payload(context={}, datastream_name='', value='21.5'), RECEIVED) is None
+    assert decode_telemetry('telemetry/8daa3270/temp',
+                            payload(context={}, datastream_name='temp', value=''), RECEIVED) is None
+    assert decode_telemetry('telemetry', payload(context={}, datastream_name='temp', value='21.5'), RECEIVED) is None
+
+
+@pytest.mark.parametrize('backend', ['json', 'orjson', 'msgspec'])
+def test_decoder_backends(backend):
+    """
+    GIVEN a decoder of telemetry messages using one of the backends
+    WHEN valid and invalid messages are decoded
+    THEN check that all the backends return the same records
+    """
+    if backend == 'orjson' and orjson is None:
+        pytest.skip('orjson is not installed')
+    if backend == 'msgspec':
+        pytest.importorskip('msgspec')
+    decoder = TelemetryDecoder(backend)
+    assert decoder('telemetry/8daa3270/temp', payload(context={}, datastream_name='temp', value=21.5),
+                   RECEIVED) == Telemetry(RECEIVED, '8daa3270', 'temp', 21.5, {})
+    assert decoder('telemetry/8daa3270/temp', b'not json', RECEIVED) is None
+    assert decoder('telemetry/8daa3270/temp', b'"temp"', RECEIVED) is None
+    assert decoder('telemetry/8daa3270/temp', payload(datastream_name='temp', value='21.5'), RECEIVED) is None
+    assert decoder('telemetry/8daa3270/temp',
+                   payload(context={}, datastream_name='temp', value='21.5', extra=1), RECEIVED) is None
+
+
+def test_topic_cache_is_bounded():
+    """
+    GIVEN a decoder caching the device ids of at most 2 topics
+    WHEN messages of 3 topics are decoded, and the decoder is pickled (such as for a worker process)
+    THEN check that the cache holds the 2 most recent topics, and that the copy has its own cache
+    """
+    assert topic_device_id('telemetry/8daa3270') == '8daa3270'
+    assert topic_device_id('telemetry') is None
+    decoder = TelemetryDecoder(cache_size=2)
+    message = payload(context={}, datastream_name='temp', value='21.5')
+    for topic in ['telemetry/a/temp', 'telemetry/b/temp', 'telemetry/a/temp', 'telemetry/c/temp']:
+        decoder(topic, message, RECEIVED)
+    info = decoder.device_id.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 3, 2)
+
+    copy = pickle.loads(pickle.dumps(decoder))
+    assert copy.device_id.cache_info().currsize == 0
+    assert copy('telemetry/d/temp', message, RECEIVED).device_id == 'd'
@@ -0,0 +1,80 @@
+"""
+This file (test_workers.py) contains the unit tests for the IngestWorkers class in the workers.py file.
+"""
+from ingest.storage import DocumentCollection
+from ingest.telemetry import as_document
+from ingest.workers import IngestWorkers
+from ingest.write_buffer import WriteBehindBuffer
+from functools import partial
+import json
+import mongomock
+import os
+
+
+def payload(value, datastream_name='temp'):
+    return json.dumps({'context': {}, 'datastream_name': datastream_name, 'value': str(value)}).encode()
+
+
+class FileSink:
+    """Sink writing the documents to a file, as JSON lines (one file per worker process)"""
+    def __init__(self, directory):
+        self.file = open(os.path.join(directory, f'documents-{os.getpid()}.jsonl'), 'w')
+
+    def add(self, document):
+        self.file.write(json.dumps(as_document(document), default=str) + '\n')
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+def test_thread_workers_store_valid_messages():
+    """
+    GIVEN thread workers writing to a collection through a write-behind buffer
+    WHEN valid and invalid messages are queued
+    THEN check that the valid messages are stored and the invalid ones are counted
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    with IngestWorkers(lambda: WriteBehindBuffer(DocumentCollection(collection), batch_size=50), workers=3) as workers:
+        for index in range(200):
+            assert workers.put(f'telemetry/device{index % 4}/temp', payload(index))
+        workers.put('telemetry/device1/temp', b'not json')
+        workers.put('telemetry/device1/temp', payload(''))
+    assert workers.messages_received == 202
+    assert workers.messages_stored == 200
+    assert workers.messages_invalid == 2
+    assert collection.count_documents({}) == 200
+    assert collection.count_documents({'device_id': 'device3'}) == 50
+
+
+def test_put_drops_messages_when_the_queue_stays_full(caplog):
+    """
+    GIVEN workers that are not started, with a queue of 5 messages
+    WHEN more messages are queued without waiting
+    THEN check that the messages that do not fit are dropped, and that the drops are logged once
+    """
+    workers = IngestWorkers(lambda: None, workers=1, max_queue=5)
+    results = [workers.put('telemetry/device1/temp', payload(index), timeout=0) for index in range(8)]
+    assert results == [True] * 5 + [False] * 3
+    assert workers.messages_dropped == 3
+    assert [record.getMessage() for record in caplog.records] == \
+        ['Dropped 1 messages so far: the queue of the workers is full']
+
+
+def test_process_workers_store_valid_messages(tmpdir):
+    """
+    GIVEN worker processes, each writing to its own sink
+    WHEN messages are queued
+    THEN check that all the valid messages are stored once
+    """
+    with IngestWorkers(partial(FileSink, str(tmpdir)), workers=2, processes=True) as workers:
+        for index in range(1000):
+            workers.put('telemetry/device1/humidity', payload(index, 'humidity'))
+        workers.put('telemetry/device1/humidity', b'{}')
+    assert workers.messages_stored == 1000
+    assert workers.messages_invalid == 1
+
+    values = []
+    for filename in tmpdir.listdir():
+        values.extend(json.loads(line)['value'] for line in filename.readlines())
+    assert sorted(values, key=int) == [str(index) for index in range(1000)]
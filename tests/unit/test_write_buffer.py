@@ -0,0 +1,137 @@
+"""
+This file (test_write_buffer.py) contains the unit tests for the WriteBehindBuffer class in the write_buffer.py file.
+"""
+from ingest.write_buffer import WriteBehindBuffer
+from pymongo.errors import AutoReconnect
+import mongomock
+import threading
+import time
+
+
+def telemetry(count, start=0):
+    return [{'device_id': 'device1', 'datastream_name': 'temp', 'value': str(index), 'context': {}}
+            for index in range(start, start + count)]
+
+
+class BlockingCollection:
+    """Collection whose bulk inserts wait until they are released"""
+    def __init__(self):
+        self.released = threading.Event()
+        self.documents = []
+
+    def insert_many(self, documents, ordered=True):
+        self.released.wait()
+        self.documents.extend(documents)
+
+
+class FailingCollection:
+    """Collection that cannot be reached"""
+    def insert_many(self, documents, ordered=True):
+        raise AutoReconnect('connection refused')
+
+
+def test_flush_when_batch_size_is_reached():
+    """
+    GIVEN a write-behind buffer with a batch size of 10 and a long maximum delay
+    WHEN 25 documents are added
+    THEN check that two full batches are written without waiting for the delay
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    buffer = WriteBehindBuffer(collection, batch_size=10, max_delay=60)
+    for document in telemetry(25):
+        assert buffer.add(document)
+    deadline = time.monotonic() + 5
+    while buffer.batches_written < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert collection.count_documents({}) == 20
+    assert len(buffer) == 5
+    buffer.close()
+    assert collection.count_documents({}) == 25
+    assert buffer.documents_written == 25
+
+
+def test_flush_when_max_delay_is_reached():
+    """
+    GIVEN a write-behind buffer with a large batch size and a short maximum delay
+    WHEN a few documents are added
+    THEN check that they are written once the delay has passed
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    with WriteBehindBuffer(collection, batch_size=1000, max_delay=0.05) as buffer:
+        for document in telemetry(3):
+            buffer.add(document)
+        deadline = time.monotonic() + 5
+        while collection.count_documents({}) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert collection.count_documents({}) == 3
+        assert buffer.batches_written == 1
+
+
+def test_flush_waits_for_all_documents():
+    """
+    GIVEN a write-behind buffer with documents waiting for the maximum delay
+    WHEN the buffer is flushed
+    THEN check that all the documents are written when flush returns
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    with WriteBehindBuffer(collection, batch_size=4, max_delay=60) as buffer:
+        for document in telemetry(10):
+            buffer.add(document)
+        assert buffer.flush(timeout=5)
+        assert collection.count_documents({}) == 10
+
+
+def test_add_waits_while_the_buffer_is_full():
+    """
+    GIVEN a write-behind buffer holding at most 4 documents, and a database that does not answer
+    WHEN more documents are added
+    THEN check that adding waits (and times out) while the buffer is full, and succeeds once it is written
+    """
+    collection = BlockingCollection()
+    buffer = WriteBehindBuffer(collection, batch_size=2, max_delay=60, max_pending=4)
+    documents = telemetry(10)
+    added = 0
+    while buffer.add(documents[added], timeout=0.1):
+        added += 1
+    # One batch is being written, the rest of the documents fill the buffer
+    assert added == 6
+    assert buffer.documents_rejected == 1
+    collection.released.set()
+    for document in documents[added:]:
+        assert buffer.add(document, timeout=5)
+    buffer.close()
+    assert len(collection.documents) == 10
+
+
+def test_duplicate_documents_do_not_fail_the_batch():
+    """
+    GIVEN a collection that already contains one of the documents
+    WHEN the documents are written with an unordered bulk insert
+    THEN check that the other documents are written, and the duplicate is counted as failed
+    """
+    collection = mongomock.MongoClient().mqtt_data.Data
+    documents = [dict(document, _id=index) for index, document in enumerate(telemetry(5))]
+    collection.insert_one(dict(documents[0]))
+    with WriteBehindBuffer(collection, batch_size=5) as buffer:
+        for document in documents:
+            buffer.add(document)
+    assert collection.count_documents({}) == 5
+    assert buffer.documents_written == 4
+    assert buffer.documents_failed == 1
+
+
+def test_failed_batches_are_passed_to_on_error():
+    """
+    GIVEN a database that cannot be reached
+    WHEN documents are written
+    THEN check that the documents of the failed batches are passed to on_error
+    """
+    failed = []
+    buffer = WriteBehindBuffer(FailingCollection(), batch_size=3, on_error=lambda batch, exception: failed.extend(batch))
+    for document in telemetry(7):
+        buffer.add(document)
+    buffer.close()
+    assert len(failed) == 7
+    assert buffer.documents_failed == 7
+    assert buffer.documents_written == 0
+    assert not buffer.add(telemetry(1)[0])